@@ -0,0 +1,54 @@
+import json
+from typing import Any, AsyncIterator, Dict, List
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Encodes one Server-Sent Event frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def source_metadata(retrieved_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Strips chunk content so the first event only carries what is needed to cite sources."""
+    return [
+        {
+            "id": doc.get("id"),
+            "rank": doc.get("rank"),
+            "similarity_score": doc.get("similarity_score"),
+            "metadata": doc.get("metadata", {}),
+        }
+        for doc in retrieved_docs
+    ]
+
+
+def rag_event_stream(request: Request, query: str, sources: List[Dict[str, Any]],
+                     tokens: AsyncIterator[str], answer_prefix: str = "") -> StreamingResponse:
+    """
+    Streams 'sources', then one 'token' event per generated piece, then 'done'.
+    Generation is abandoned (and the upstream stream closed) as soon as the client disconnects.
+    """
+
+    async def events():
+        try:
+            yield format_sse("sources", {"query": query, "sources": sources})
+            if answer_prefix:
+                yield format_sse("token", {"text": answer_prefix})
+            async for piece in tokens:
+                if await request.is_disconnected():
+                    print("--- SSE: Client disconnected, cancelling generation.")
+                    break
+                yield format_sse("token", {"text": piece})
+            else:
+                yield format_sse("done", {"query": query})
+        except Exception as e:
+            print(f"--- SSE: Error while streaming answer: {e}")
+            yield format_sse("error", {"detail": "Could not generate response due to a system error."})
+        finally:
+            await tokens.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,10 +1,14 @@
+import io
 import os
-from fastapi import APIRouter, HTTPException, File, UploadFile, Query, status
+import shutil
+from fastapi import APIRouter, Depends, HTTPException, File, Header, UploadFile, Query, Request, Response, status
 from app.core.rag import RAGService
-from app.core.data_prep import DataProcessor
-from app.core.temp_rag import TemporaryRAGManager
+from app.core.jobs import IngestionJobQueue
+from app.core.temp_rag import TemporaryRAGManager, TempSessionStore, DEFAULT_SESSION
+from app.core.concurrency import run_blocking, STAGE_INGEST, STAGE_TEMP_INGEST, STAGE_EMBED_SEARCH
+from app.api.sse import rag_event_stream, source_metadata
 from app.models.schemas import QueryRequest, SimpleRAGResponse
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 # Router instance
 upload_router = APIRouter(tags=["RAG - Upload & Temp"])
@@ -13,82 +17,159 @@ upload_router = APIRouter(tags=["RAG - Upload & Temp"])
 # We will initialize it in main.py and pass the instance to this module.
 temp_rag_manager: TemporaryRAGManager = None
 main_rag_service: RAGService = None
+ingestion_jobs: IngestionJobQueue = None
+max_temp_upload_bytes: int = 64 * 1024 * 1024
 
-def initialize_temp_rag_router(rag_service_instance: RAGService):
+def initialize_temp_rag_router(rag_service_instance: RAGService, temp_store: Optional[TempSessionStore] = None,
+                               job_queue: Optional[IngestionJobQueue] = None,
+                               temp_upload_max_bytes: Optional[int] = None):
     """Initializes the required managers for the router."""
-    global temp_rag_manager, main_rag_service
+    global temp_rag_manager, main_rag_service, ingestion_jobs, max_temp_upload_bytes
     main_rag_service = rag_service_instance
-    temp_rag_manager = TemporaryRAGManager(rag_service_instance)
+    temp_rag_manager = TemporaryRAGManager(rag_service_instance, store=temp_store)
+    ingestion_jobs = job_queue
+    if temp_upload_max_bytes is not None:
+        max_temp_upload_bytes = temp_upload_max_bytes
+
+
+def get_session_id(
+    x_session_id: Optional[str] = Header(None, description="Temporary-upload session id"),
+    session_id: Optional[str] = Query(None, description="Temporary-upload session id (if no header)")
+) -> str:
+    """Session id for temporary uploads: X-Session-Id header, then ?session_id=, else the shared default."""
+    return (x_session_id or session_id or DEFAULT_SESSION).strip()[:128] or DEFAULT_SESSION
 
 
 # --- API 1: Temporary/Permanent Upload ---
 @upload_router.post("/upload", status_code=status.HTTP_201_CREATED)
 async def upload_document(
+    response: Response,
     file: UploadFile = File(...),
     # save_permanent: Frontend से इस फ़ील्ड को 'true' या 'false' भेजा जाएगा
-    save_permanent: bool = Query(False, description="Should this file be permanently saved to the main DB?")
+    save_permanent: bool = Query(False, description="Should this file be permanently saved to the main DB?"),
+    subject: Optional[str] = Query(None, description="Subject partition for a permanent upload (default: from the file name)"),
+    session_key: str = Depends(get_session_id)
 ) -> Dict[str, Any]:
     """
     Uploads a document and either indexes it permanently to the main DB or temporarily to RAM.
+    Permanent uploads are indexed by a background job: the response (202) carries a job_id
+    to follow on /rag/jobs/{job_id}.
     """
-    if main_rag_service is None or temp_rag_manager is None:
+    if main_rag_service is None or temp_rag_manager is None or ingestion_jobs is None:
         raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
 
-    file_content = await file.read()
-    
+    # The upload is not read into one bytes object: both paths stream from the spooled upload file
+    # (Starlette keeps it in memory up to 1 MB and in a temporary file on disk beyond that).
+    # /upload_temp takes the raw PDF body instead and never touches disk.
     if save_permanent:
-        # A. PERMANENT SAVE (मौजूदा /info/upload लॉजिक)
-        temp_path = os.path.join(os.getenv("PDF_DIRECTORY", "data/pdfs"), file.filename)
-        with open(temp_path, "wb") as buffer:
-            buffer.write(file_content)
+        # A. PERMANENT SAVE (सिर्फ़ नई फ़ाइल को index करें, पूरे corpus को नहीं)
+        pdf_directory = os.getenv("PDF_DIRECTORY", "data/pdfs")
+        os.makedirs(pdf_directory, exist_ok=True)
+        filename = os.path.basename(file.filename)
+        # Saved to a private snapshot first; the job moves it into the PDF directory once indexed,
+        # so a re-upload never truncates the live file and a failed one leaves it untouched.
+        snapshot_path = ingestion_jobs.upload_path(filename)
+        with open(snapshot_path, "wb") as buffer:
+            await run_blocking(STAGE_INGEST, shutil.copyfileobj, file.file, buffer, 1 << 20)
 
-        try:
-            # Indexing logic
-            processor = DataProcessor(pdf_directory=os.getenv("PDF_DIRECTORY", "data/pdfs"))
-            
-            # We must load *all* documents to perform the split correctly
-            all_documents = processor.process_all_pdfs() 
-            chunks = processor.split_documents(all_documents, chunk_size=1000, chunk_overlap=200)
-            texts = [doc.page_content for doc in chunks]
-            
-            # Re-index the entire database (safer method)
-            embeddings = main_rag_service.retriever.embedding_manager.generate_embeddings(texts)
-            # We rely on initialize_db.py's method to handle updates/clearing for simplicity.
-            # For a true API, we would only add the new chunks.
-            
-            # 🚨 NOTE: For production, you should only add *new* documents. 
-            # For simplicity, we assume the main DB is updated by adding new ones.
-            main_rag_service.vector_store.add_documents(chunks, embeddings) 
-            
-            return {
-                "status": "Saved Permanently",
-                "filename": file.filename,
-                "message": "File added to permanent vector store and indexed."
-            }
+        # Only the uploaded file is split/embedded (stable chunk ids make re-uploads upserts),
+        # in the background so the request returns right away and never ties up this worker.
+        job = ingestion_jobs.submit(snapshot_path, filename, destination=os.path.join(pdf_directory, filename),
+                                    subject=subject)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "status": "Queued",
+            "filename": file.filename,
+            "job_id": job["job_id"],
+            "status_url": f"/rag/jobs/{job['job_id']}",
+            "queue_position": job["queue_position"],
+            "message": "File saved; indexing runs in the background."
+        }
 
-        except Exception as e:
-            # Clean up the file if indexing failed
-            os.remove(temp_path)
-            raise HTTPException(status_code=500, detail=f"Permanent indexing failed: {str(e)}")
-        
     else:
         # B. TEMPORARY SAVE (नया लॉजिक)
         try:
-            temp_data = temp_rag_manager.index_temporary_data(file_content, file.filename)
+            temp_data = await run_blocking(
+                STAGE_TEMP_INGEST, temp_rag_manager.index_temporary_stream, file.file, file.filename, session_key
+            )
             
             return {
                 "status": "Indexed Temporarily",
                 "filename": temp_data['filename'],
                 "chunks_indexed": temp_data['chunk_count'],
+                "session_id": temp_data['session_id'],
                 "message": "Data indexed in RAM for temporary session querying."
             }
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Temporary indexing failed: {str(e)}")
 
 
+# --- API 1a: Temporary upload without multipart ---
+@upload_router.post("/upload_temp", status_code=status.HTTP_201_CREATED)
+async def upload_temporary_document(
+    request: Request,
+    filename: str = Query(..., description="Name of the uploaded PDF"),
+    session_key: str = Depends(get_session_id)
+) -> Dict[str, Any]:
+    """
+    Indexes a PDF sent as the raw request body (Content-Type: application/pdf) into RAM.
+    The body is read from the request stream into a memory buffer capped at
+    TEMP_UPLOAD_MAX_MB, so unlike a multipart /upload nothing is spooled to disk.
+    """
+    if temp_rag_manager is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_temp_upload_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds {max_temp_upload_bytes} bytes.")
+    # pypdf needs random access (the xref table sits at the end), so the PDF is held whole, in RAM only
+    buffer = io.BytesIO()
+    async for part in request.stream():
+        if buffer.tell() + len(part) > max_temp_upload_bytes:
+            raise HTTPException(status_code=413, detail=f"File exceeds {max_temp_upload_bytes} bytes.")
+        buffer.write(part)
+    if not buffer.tell():
+        raise HTTPException(status_code=400, detail="Empty request body.")
+    buffer.seek(0)
+
+    try:
+        temp_data = await run_blocking(
+            STAGE_TEMP_INGEST, temp_rag_manager.index_temporary_stream, buffer, os.path.basename(filename), session_key
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Temporary indexing failed: {str(e)}")
+    return {
+        "status": "Indexed Temporarily",
+        "filename": temp_data['filename'],
+        "chunks_indexed": temp_data['chunk_count'],
+        "session_id": temp_data['session_id'],
+        "message": "Data indexed in RAM for temporary session querying."
+    }
+
+
+# --- API 1b: Ingestion jobs ---
+@upload_router.get("/jobs/{job_id}")
+def get_ingestion_job(job_id: str) -> Dict[str, Any]:
+    """Stage-level progress of a permanent upload: status, stage, chunks done/total, timings, error."""
+    if ingestion_jobs is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@upload_router.get("/jobs")
+def list_ingestion_jobs(limit: int = Query(20, ge=1, le=200)) -> Dict[str, Any]:
+    """Most recent ingestion jobs, newest first."""
+    if ingestion_jobs is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+    return {"jobs": ingestion_jobs.recent(limit), "queue": ingestion_jobs.stats()}
+
+
 # --- API 2: Temporary Query ---
 @upload_router.post("/temp_query", response_model=SimpleRAGResponse)
-async def query_temp_document(request: QueryRequest) -> SimpleRAGResponse:
+async def query_temp_document(request: QueryRequest, session_key: str = Depends(get_session_id)) -> SimpleRAGResponse:
     """
     Queries the temporarily indexed document in RAM. 
     If temporary data is not available, it queries the main permanent DB.
@@ -97,7 +178,7 @@ async def query_temp_document(request: QueryRequest) -> SimpleRAGResponse:
         raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
     
     # 1. पहले अस्थायी स्टोर से पूछें
-    temp_result = temp_rag_manager.query_temporary_data(request.query, request.top_k)
+    temp_result = await temp_rag_manager.aquery_temporary_data(request.query, request.top_k, session_key)
     
     if temp_result['answer']:
         # 2. अगर अस्थायी डेटा में जवाब मिला
@@ -109,7 +190,8 @@ async def query_temp_document(request: QueryRequest) -> SimpleRAGResponse:
     # 3. अगर अस्थायी स्टोर खाली है या जवाब नहीं मिला, तो Main DB से पूछें
     print("INFO: Temporary store empty/unresponsive. Falling back to main DB query.")
     try:
-        main_result = main_rag_service.query_rag(query=request.query, top_k=request.top_k)
+        main_result = await main_rag_service.aquery_rag(query=request.query, top_k=request.top_k, mode=request.mode,
+                                                        where=request.metadata_filter())
         return SimpleRAGResponse(
             query=request.query,
             answer=f"[Answer from Main DB]: {main_result['answer']}"
@@ -118,25 +200,57 @@ async def query_temp_document(request: QueryRequest) -> SimpleRAGResponse:
         raise HTTPException(status_code=500, detail=f"Main DB query failed: {str(e)}")
 
 
+# --- API 2b: Temporary Query (streaming) ---
+@upload_router.post("/temp_query/stream")
+async def stream_temp_document(request: QueryRequest, http_request: Request,
+                               session_key: str = Depends(get_session_id)):
+    """
+    Streaming version of /temp_query (Server-Sent Events). Falls back to the main DB
+    exactly like the non-streaming endpoint when there is no temporary data.
+    """
+    if temp_rag_manager is None or main_rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+
+    retrieved = await run_blocking(
+        STAGE_EMBED_SEARCH, temp_rag_manager.retrieve_temporary_context, request.query, request.top_k, session_key
+    )
+    if retrieved is not None:
+        return rag_event_stream(
+            http_request,
+            query=request.query,
+            sources=retrieved['sources'],
+            tokens=main_rag_service.astream_answer(request.query, retrieved['context']),
+            answer_prefix=f"[Answer from {retrieved['source_file']} (TEMP)]: "
+        )
+
+    print("INFO: Temporary store empty/unresponsive. Falling back to main DB query.")
+    try:
+        retrieved_docs = await main_rag_service.aretrieve(request.query, top_k=request.top_k, mode=request.mode,
+                                                          where=request.metadata_filter())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Main DB query failed: {str(e)}")
+    return rag_event_stream(
+        http_request,
+        query=request.query,
+        sources=source_metadata(retrieved_docs),
+        tokens=main_rag_service.astream_answer(request.query, main_rag_service.build_context(retrieved_docs)),
+        answer_prefix="[Answer from Main DB]: "
+    )
+
+
 # --- API 3: Cleanup ---
 @upload_router.get("/clear_temp")
-def clear_temp_data():
+def clear_temp_data(session_key: str = Depends(get_session_id)):
     """Clears the temporary document from RAM."""
     if temp_rag_manager is None:
         raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
         
-    temp_rag_manager.delete_temporary_data()
+    temp_rag_manager.delete_temporary_data(session_key)
     return {"status": "success", "message": "Temporary RAG store cleared from RAM."}
 
 @upload_router.get("/check_temp_status")
-def check_temp_status():
-    """Returns the current status of the temporary RAG store in RAM."""
-    from app.core.temp_rag import TEMP_STORE # TEMP_STORE को सीधे इम्पोर्ट करें
-    
-    status_info = {
-        "is_active": "temp_session" in TEMP_STORE,
-        "filename": TEMP_STORE.get("temp_session", {}).get("filename", "N/A"),
-        "chunk_count": TEMP_STORE.get("temp_session", {}).get("chunk_count", 0),
-        "keys_in_store": list(TEMP_STORE.keys())
-    }
-    return status_info
\ No newline at end of file
+def check_temp_status(session_key: str = Depends(get_session_id)):
+    """Returns the status of this session's temporary data and of the shared RAM store."""
+    if temp_rag_manager is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+    return temp_rag_manager.session_status(session_key)
@@ -0,0 +1,172 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases, collapses whitespace and trims trailing punctuation for exact-match keys."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" ?.!")
+
+
+class AnswerCache:
+    """
+    Two-tier cache of RAG answers.
+
+    Exact tier: (normalized query, scope) -> answer, where scope holds top_k and anything
+    else that changes the answer (e.g. retrieval mode). Semantic tier: an answer is reused
+    when a new query embedding has cosine similarity >= semantic_threshold with a cached
+    query of the same scope. It is off by default (threshold > 1.0): with small models, short
+    related questions ("what is a stack" / "what is a queue") score above 0.95. Cached query
+    embeddings live in one preallocated matrix, one row per entry. Entries expire after
+    ttl_seconds, the least recently used entry is evicted beyond max_entries, and everything is
+    dropped when the index version (vector store contents) changes.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, semantic_threshold: float = 1.01):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self._entries: "OrderedDict[Tuple[str, Hashable], Dict[str, Any]]" = OrderedDict()
+        self._index_version: Optional[Hashable] = None
+        # Semantic tier: row i of _matrix is the normalized embedding of the entry _slot_keys[i]
+        self._matrix: Optional[np.ndarray] = None
+        self._slot_keys: List[Optional[Tuple[str, Hashable]]] = []
+        self._free_slots: List[int] = []
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, index_version: Hashable):
+        if index_version != self._index_version:
+            if self._entries:
+                self.invalidations += 1
+                print(f"--- AnswerCache: Index changed, dropping {len(self._entries)} cached answers.")
+            self._clear()
+            self._index_version = index_version
+
+    def _clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self._slot_keys = []
+        self._free_slots = []
+
+    def _remove(self, key: Tuple[str, Hashable]):
+        entry = self._entries.pop(key)
+        self._free_slot(entry)
+
+    def _free_slot(self, entry: Dict[str, Any]):
+        slot = entry.get("slot")
+        if slot is not None:
+            self._matrix[slot] = 0.0
+            self._slot_keys[slot] = None
+            self._free_slots.append(slot)
+
+    def _store_embedding(self, key: Tuple[str, Hashable], embedding: Optional[np.ndarray]) -> Optional[int]:
+        """Writes the embedding into a free row of the matrix; None if there is nothing to store."""
+        if embedding is None or self.semantic_threshold > 1.0:
+            return None
+        vector = self._normalize(embedding)
+        if self._matrix is None or self._matrix.shape[1] != len(vector):
+            # First entry, or a different embedding model: start an empty matrix
+            for entry in self._entries.values():
+                entry["slot"] = None
+            self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            self._slot_keys = [None] * self.max_entries
+            self._free_slots = list(range(self.max_entries - 1, -1, -1))
+        slot = self._free_slots.pop()
+        self._matrix[slot] = vector
+        self._slot_keys[slot] = key
+        return slot
+
+    def _is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry["created"] < self.ttl_seconds
+
+    def get_exact(self, query: str, scope: Hashable, index_version: Hashable) -> Optional[Dict[str, Any]]:
+        key = (normalize_query(query), scope)
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not self._is_fresh(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry["result"]
+
+    def get_semantic(self, embedding: np.ndarray, scope: Hashable, index_version: Hashable) -> Optional[Dict[str, Any]]:
+        """Returns the answer of the most similar cached query above the threshold (counts a miss otherwise)."""
+        with self._lock:
+            self._check_version(index_version)
+            if self.semantic_threshold > 1.0 or self._matrix is None:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ self._normalize(embedding)  # free rows are zero
+            above = np.flatnonzero(scores >= self.semantic_threshold)
+            for slot in above[np.argsort(-scores[above], kind="stable")]:
+                key = self._slot_keys[slot]
+                if key is None or key[1] != scope:
+                    continue
+                entry = self._entries[key]
+                if not self._is_fresh(entry):
+                    continue
+                self._entries.move_to_end(key)
+                self.semantic_hits += 1
+                return entry["result"]
+            self.misses += 1
+            return None
+
+    def put(self, query: str, scope: Hashable, index_version: Hashable, embedding: Optional[np.ndarray],
+            result: Dict[str, Any]):
+        """Caches an answer. Without an embedding (e.g. lexical queries) it is only found by the exact tier."""
+        if self.max_entries <= 0:
+            return
+        key = (normalize_query(query), scope)
+        with self._lock:
+            self._check_version(index_version)
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._free_slot(evicted)
+                self.evictions += 1
+            self._entries[key] = {
+                "result": result,
+                "slot": self._store_embedding(key, embedding),
+                "created": time.time(),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        hit_rate = (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round(hit_rate, 4),
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "ttl_seconds": self.ttl_seconds,
+            "semantic_threshold": self.semantic_threshold,
+        }
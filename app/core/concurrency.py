@@ -0,0 +1,80 @@
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Stage names used across the request path
+STAGE_EMBED_SEARCH = "embed_search"
+STAGE_LLM = "llm"
+STAGE_INGEST = "ingest"
+STAGE_TEMP_INGEST = "temp_ingest"
+STAGE_STARTUP = "startup"
+
+# Default per-stage concurrency limits (overridden from main.py via configure())
+_stage_limits: Dict[str, int] = {
+    STAGE_EMBED_SEARCH: 8,
+    STAGE_LLM: 32,
+    STAGE_INGEST: 1,
+    STAGE_TEMP_INGEST: 4,
+    STAGE_STARTUP: 3,  # embedding model, vector store and LLM client load side by side
+}
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+# Calls currently running per stage (read by background ingestion to back off while queries run)
+_active: Dict[str, int] = {}
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_workers = 8
+
+
+def configure(blocking_workers: int, stage_limits: Dict[str, int]):
+    """Sets the size of the blocking-work thread pool and the per-stage concurrency limits."""
+    global _executor, _executor_workers
+    _executor_workers = max(1, blocking_workers)
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+    _stage_limits.update({stage: max(1, limit) for stage, limit in stage_limits.items()})
+    _semaphores.clear()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_executor_workers, thread_name_prefix="rag-blocking")
+    return _executor
+
+
+def stage_limit(stage: str) -> asyncio.Semaphore:
+    """Semaphore bounding how many requests may be inside a stage at once."""
+    semaphore = _semaphores.get(stage)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(_stage_limits.get(stage, _executor_workers))
+        _semaphores[stage] = semaphore
+    return semaphore
+
+
+async def run_blocking(stage: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs blocking (CPU-bound or synchronous I/O) work on the bounded executor so the
+    event loop keeps serving other requests. Context variables are carried over.
+    """
+    async with stage_limit(stage):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        _active[stage] = _active.get(stage, 0) + 1
+        try:
+            return await loop.run_in_executor(_get_executor(), call)
+        finally:
+            _active[stage] -= 1
+
+
+def active(stage: str) -> int:
+    """Number of run_blocking calls of stage in progress right now."""
+    return _active.get(stage, 0)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
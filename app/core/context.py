@@ -0,0 +1,157 @@
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str, chars_per_token: float = 4.0) -> int:
+    """Cheap token estimate for budgeting (Gemini averages roughly 4 characters per token)."""
+    return int(len(text) / chars_per_token) + 1
+
+
+def _shingles(text: str, size: int = 3) -> Set[Tuple[str, ...]]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _text_overlap(left: str, right: str, max_overlap: int, min_overlap: int = 20) -> int:
+    """Length of the longest suffix of left that is a prefix of right (0 if shorter than min_overlap)."""
+    for length in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+class ContextPacker:
+    """
+    Turns retrieved chunks into the context string sent to the LLM.
+
+    1. Chunks from the same source_file/page are merged when they overlap or touch: by their
+       start_index when the splitter recorded one, otherwise by matching text at the seam
+       (the chunk_overlap the splitter repeated).
+    2. Blocks whose word 3-grams are near-duplicates (Jaccard >= dedup_threshold) of a better
+       ranked block are dropped, e.g. the same passage in two copies of a PDF.
+    3. Blocks are added best score first until token_budget is used up; the first block is
+       truncated rather than dropped so there is always some context.
+    """
+
+    def __init__(self, token_budget: int = 3000, dedup_threshold: float = 0.85, max_overlap_chars: int = 400,
+                 chars_per_token: float = 4.0):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.max_overlap_chars = max_overlap_chars
+        self.chars_per_token = chars_per_token
+
+    def pack(self, retrieved_docs: List[Dict[str, Any]]) -> str:
+        return CONTEXT_SEPARATOR.join(block["content"] for block in self.select(retrieved_docs))
+
+    def select(self, retrieved_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merged, deduplicated and budgeted blocks: {'content', 'metadata', 'rank', 'ids'}, best first."""
+        blocks = self._merge(retrieved_docs)
+        blocks = self._dedup(blocks)
+        return self._fit_budget(blocks)
+
+    # --- 1. merge ---
+    def _merge(self, retrieved_docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for position, doc in enumerate(retrieved_docs):
+            content = (doc.get('content') or "").strip()
+            if not content:
+                continue
+            metadata = doc.get('metadata') or {}
+            key = (metadata.get('source_file', metadata.get('source')), metadata.get('page'))
+            groups.setdefault(key, []).append({
+                "content": content,
+                "metadata": metadata,
+                "rank": doc.get('rank', position + 1),
+                "ids": [doc['id']] if doc.get('id') else [],
+                "start": metadata.get('start_index'),
+            })
+
+        blocks = []
+        for key, chunks in groups.items():
+            if key == (None, None):
+                blocks.extend(chunks)  # no provenance, nothing to merge on
+                continue
+            # Document order within the page; chunks without start_index keep their retrieval order
+            if all(chunk["start"] is not None for chunk in chunks):
+                chunks.sort(key=lambda chunk: chunk["start"])
+            merged = [chunks[0]]
+            for chunk in chunks[1:]:
+                for i, block in enumerate(merged):
+                    combined = self._join(block, chunk)
+                    if combined is not None:
+                        merged[i] = combined
+                        break
+                else:
+                    merged.append(chunk)
+            blocks.extend(merged)
+        return sorted(blocks, key=lambda block: block["rank"])
+
+    def _join(self, left: Dict[str, Any], right: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """left + right as one block if they overlap or are adjacent, else None."""
+        a, b = left["content"], right["content"]
+        if b in a:
+            text = a
+        elif a in b:
+            text = b
+        elif left["start"] is not None and right["start"] is not None:
+            # Offsets into the page text: right starts inside left (overlap) or right after it
+            overlap = left["start"] + len(a) - right["start"]
+            if overlap > 0 and a.endswith(b[:overlap]):
+                text = a + b[overlap:]
+            elif -2 <= overlap <= 0:  # only the separator whitespace the splitter dropped in between
+                text = a + "\n" + b
+            else:
+                return None
+        else:
+            overlap = _text_overlap(a, b, self.max_overlap_chars)
+            if not overlap:
+                overlap = _text_overlap(b, a, self.max_overlap_chars)
+                if not overlap:
+                    return None
+                a, b = b, a
+            text = a + b[overlap:]
+        starts = [block["start"] for block in (left, right) if block["start"] is not None]
+        return {
+            "content": text,
+            "metadata": left["metadata"],
+            "rank": min(left["rank"], right["rank"]),
+            "ids": left["ids"] + right["ids"],
+            "start": min(starts) if starts else None,
+        }
+
+    # --- 2. near-duplicate removal ---
+    def _dedup(self, blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        kept, kept_shingles = [], []
+        for block in blocks:
+            shingles = _shingles(block["content"])
+            duplicate = any(
+                shingles and other and len(shingles & other) / len(shingles | other) >= self.dedup_threshold
+                for other in kept_shingles
+            )
+            if not duplicate:
+                kept.append(block)
+                kept_shingles.append(shingles)
+        return kept
+
+    # --- 3. token budget ---
+    def _fit_budget(self, blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if self.token_budget <= 0:
+            return blocks
+        separator_tokens = estimate_tokens(CONTEXT_SEPARATOR, self.chars_per_token)
+        packed, used = [], 0
+        for block in blocks:
+            cost = estimate_tokens(block["content"], self.chars_per_token) + (separator_tokens if packed else 0)
+            if used + cost <= self.token_budget:
+                packed.append(block)
+                used += cost
+            elif not packed:
+                max_chars = int(self.token_budget * self.chars_per_token)
+                packed.append(dict(block, content=block["content"][:max_chars]))
+                used = self.token_budget
+        return packed
@@ -1,37 +1,137 @@
 import os
+import hashlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Any
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from typing import List, Any, Callable, Iterator, Optional, Tuple
+from app.core.startup import timed_import
+from app.core.page_cache import PageTextCache
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hex digest of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_pdf_pages(pdf_path: str) -> List[Any]:
+    """Loads one PDF into page documents. Module-level so it can run in a worker process."""
+    pdf_file = Path(pdf_path)
+    PyPDFLoader = timed_import("langchain_community.document_loaders").PyPDFLoader
+    loader = PyPDFLoader(str(pdf_file))
+    documents = loader.load()
+
+    for doc in documents:
+        doc.metadata['source_file'] = pdf_file.name
+        doc.metadata['file_type'] = 'pdf'
+    return documents
+
 
 class DataProcessor:
     """Handles loading and splitting documents from a directory."""
 
-    def __init__(self, pdf_directory: str):
+    def __init__(self, pdf_directory: str, max_workers: Optional[int] = None,
+                 page_cache: Optional[PageTextCache] = None):
         self.pdf_directory = pdf_directory
+        # None/1 = load serially in this process; >1 = process pool across files
+        self.max_workers = max_workers
+        # Extracted pages by file hash: unchanged PDFs are not parsed again
+        self.page_cache = page_cache
+
+    def list_pdf_files(self) -> List[Path]:
+        """Returns all PDF files under the directory in a stable order."""
+        return sorted(Path(self.pdf_directory).glob("**/*.pdf"))
+
+    def process_pdf(self, pdf_path: str, parse: Optional[Callable[[str], List[Any]]] = None) -> List[Any]:
+        """
+        Loads a single PDF file and tags every page with its source metadata. Served from the
+        page cache when the bytes were parsed before; parse replaces the loader on a miss
+        (e.g. to run it in a worker process).
+        """
+        parse = parse or _load_pdf_pages
+        if self.page_cache is None:
+            return parse(pdf_path)
+        file_hash = file_sha256(pdf_path)
+        documents = self.page_cache.get(file_hash, pdf_path)
+        if documents is None:
+            documents = parse(pdf_path)
+            self.page_cache.put(file_hash, documents)
+        return documents
+
+    def iter_pdf_documents(self, pdf_files: Optional[List[Path]] = None) -> Iterator[Tuple[Path, List[Any]]]:
+        """
+        Yields (pdf_file, pages) one file at a time, in input order.
+        With max_workers > 1 files are parsed in a process pool, but only a small window of
+        files is in flight, so memory is bounded by that window instead of the whole corpus.
+        """
+        if pdf_files is None:
+            pdf_files = self.list_pdf_files()
+
+        workers = self.max_workers or 1
+        if workers <= 1 or len(pdf_files) <= 1:
+            for pdf_file in pdf_files:
+                try:
+                    documents = self.process_pdf(str(pdf_file))
+                except Exception as e:
+                    print(f"  ✗ Error loading {pdf_file.name}: {e}")
+                    continue
+                print(f"  ✓ Loaded {len(documents)} pages from: {pdf_file.name}")
+                yield pdf_file, documents
+            return
+
+        window = workers * 2
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            files = iter(pdf_files)
+
+            def submit_next() -> bool:
+                pdf_file = next(files, None)
+                if pdf_file is None:
+                    return False
+                file_hash = file_sha256(str(pdf_file)) if self.page_cache is not None else None
+                cached = self.page_cache.get(file_hash, str(pdf_file)) if file_hash else None
+                if cached is not None:
+                    future = Future()
+                    future.set_result(cached)
+                else:
+                    future = executor.submit(_load_pdf_pages, str(pdf_file))
+                pending.append((pdf_file, file_hash, cached is not None, future))
+                return True
+
+            while len(pending) < window and submit_next():
+                pass
+
+            while pending:
+                pdf_file, file_hash, from_cache, future = pending.popleft()
+                submit_next()
+                try:
+                    documents = future.result()
+                except Exception as e:
+                    print(f"  ✗ Error loading {pdf_file.name}: {e}")
+                    continue
+                if file_hash and not from_cache:
+                    self.page_cache.put(file_hash, documents)
+                print(f"  ✓ Loaded {len(documents)} pages from: {pdf_file.name}")
+                yield pdf_file, documents
+
+    def iter_chunks(self, chunk_size: int = 1000, chunk_overlap: int = 200,
+                    pdf_files: Optional[List[Path]] = None) -> Iterator[Tuple[Path, List[Any]]]:
+        """Streams (pdf_file, chunks) per file: extraction feeds splitting without holding every page."""
+        for pdf_file, documents in self.iter_pdf_documents(pdf_files):
+            yield pdf_file, self.split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
     def process_all_pdfs(self) -> List[Any]:
         """Loads and processes all PDF files in the specified directory."""
         all_documents = []
-        pdf_dir = Path(self.pdf_directory)
-        pdf_files = list(pdf_dir.glob("**/*.pdf"))
+        pdf_files = self.list_pdf_files()
         
         print(f"--- DataProcessor: Found {len(pdf_files)} PDF files to process in {self.pdf_directory}")
         
-        for pdf_file in pdf_files:
-            try:
-                # Use PyPDFLoader as per your original code
-                loader = PyPDFLoader(str(pdf_file))
-                documents = loader.load()
-                
-                for doc in documents:
-                    doc.metadata['source_file'] = pdf_file.name
-                    doc.metadata['file_type'] = 'pdf'
-                
-                all_documents.extend(documents)
-                print(f"  ✓ Loaded {len(documents)} pages from: {pdf_file.name}")
-            except Exception as e:
-                print(f"  ✗ Error loading {pdf_file.name}: {e}")
+        for _, documents in self.iter_pdf_documents(pdf_files):
+            all_documents.extend(documents)
         
         print(f"--- DataProcessor: Total documents loaded: {len(all_documents)}")
         return all_documents
@@ -41,15 +141,25 @@ class DataProcessor:
         if not documents:
             return []
             
+        RecursiveCharacterTextSplitter = timed_import("langchain.text_splitter").RecursiveCharacterTextSplitter
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             length_function=len,
-            separators=["\n\n", "\n", " ", ""]
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True  # lets ContextPacker merge overlapping neighbours exactly
         )
         split_docs = text_splitter.split_documents(documents)
         print(f"--- DataProcessor: Split {len(documents)} documents into {len(split_docs)} chunks")
         return split_docs
 
+
+def default_worker_count() -> int:
+    """Worker count for parallel extraction: PDF_WORKERS env var, else the number of CPUs."""
+    configured = os.getenv("PDF_WORKERS")
+    if configured:
+        return max(1, int(configured))
+    return os.cpu_count() or 1
+
 # Note: This file contains the logic. Data loading and splitting will be executed 
-# in the 'initialize_db.py' script.
\ No newline at end of file
+# in the 'initialize_db.py' script.
@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import time
+import atexit
+import hashlib
+import threading
+from typing import List, Optional
+import numpy as np
+from app.core.filelock import file_lock, tmp_path_for
+
+# SHA-1 digests are stored as raw uint8 rows: an "S20" array drops trailing NUL bytes on read
+KEY_BYTES = 20
+# Rows a key may live in; a new key replaces the oldest of them once all are taken
+WAYS = 8
+
+
+class EmbeddingCache:
+    """
+    Disk-backed, content-addressed cache of text embeddings for one model, shared by every
+    process that opens the same directory (gunicorn workers, the inference sidecar and
+    initialize_db.py).
+
+    Layout (one directory per model name):
+      meta.json    - model name, dim, dtype and capacity; written once, when the files are created
+      vectors.npy  - fixed-capacity (max_entries x dim) float16/float32 matrix, memory-mapped
+      row_keys.npy - SHA-1 digest (max_entries x 20 uint8) of the text stored in each row;
+                     all zeros marks a free row
+      stamps.npy   - time each row was written, to pick the row to replace
+
+    There is no key -> row index: the digest picks a set of WAYS rows and a lookup compares the
+    digests of that set. Writers take cache.lock exclusively for a batch and clear a row's key
+    before rewriting its vector, so a crash mid-write leaves a free row, never a wrong one.
+    Readers take it shared. When a set is full its oldest row is overwritten.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, max_entries: int = 200_000,
+                 dtype: str = "float16", flush_interval: float = 5.0):
+        self.model_name = model_name
+        self.sets = max(1, max_entries // WAYS)
+        self.max_entries = self.sets * WAYS
+        self.dtype = np.dtype(dtype)
+        self.flush_interval = flush_interval
+        safe_name = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.directory = os.path.join(cache_dir, safe_name)
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.vectors_path = os.path.join(self.directory, "vectors.npy")
+        self.row_keys_path = os.path.join(self.directory, "row_keys.npy")
+        self.stamps_path = os.path.join(self.directory, "stamps.npy")
+        self.lock_path = os.path.join(self.directory, "cache.lock")
+
+        self.dim: Optional[int] = None
+        self.vectors: Optional[np.ndarray] = None
+        self.row_keys: Optional[np.ndarray] = None
+        self.stamps: Optional[np.ndarray] = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_flush = time.time()
+        with file_lock(self.lock_path, shared=True):
+            self._open()
+        if self.vectors is not None:
+            print(f"--- EmbeddingCache: Opened {self.directory}")
+        atexit.register(self.flush)
+
+    @staticmethod
+    def key_for(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _open(self) -> bool:
+        """Maps the files another process (or an earlier run) created. False if there are none yet."""
+        if not all(os.path.exists(p) for p in
+                   (self.meta_path, self.vectors_path, self.row_keys_path, self.stamps_path)):
+            return False
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model_name") != self.model_name or np.dtype(meta.get("dtype")) != self.dtype \
+                    or meta.get("max_entries") != self.max_entries:
+                print(f"--- EmbeddingCache: Settings changed, discarding cache in {self.directory}")
+                return False
+            self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+            self.row_keys = np.load(self.row_keys_path, mmap_mode="r+")
+            self.stamps = np.load(self.stamps_path, mmap_mode="r+")
+            self.dim = meta["dim"]
+            return True
+        except Exception as e:
+            print(f"--- EmbeddingCache: Could not open cache, starting empty: {e}")
+            self.dim, self.vectors, self.row_keys, self.stamps = None, None, None, None
+            return False
+
+    def _create(self, dim: int):
+        """Builds empty files under temporary names and moves them in, so another process
+        that still maps the old files (e.g. with other settings) never sees them truncated."""
+        os.makedirs(self.directory, exist_ok=True)
+        for path, dtype, shape in ((self.vectors_path, self.dtype, (self.max_entries, dim)),
+                                   (self.row_keys_path, np.uint8, (self.max_entries, KEY_BYTES)),
+                                   (self.stamps_path, np.float64, (self.max_entries,))):
+            tmp_path = tmp_path_for(path)
+            # Sparse on most filesystems: disk is only used for rows that get written
+            np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape).flush()
+            os.replace(tmp_path, path)
+        meta = {"model_name": self.model_name, "dim": dim, "dtype": self.dtype.name,
+                "max_entries": self.max_entries}
+        tmp_path = tmp_path_for(self.meta_path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+        print(f"--- EmbeddingCache: Created {self.directory} ({self.max_entries} x {dim})")
+        self._open()
+
+    def _rows_for(self, digest: bytes) -> slice:
+        start = (int.from_bytes(digest[:8], "little") % self.sets) * WAYS
+        return slice(start, start + WAYS)
+
+    def _find(self, digest: bytes) -> Optional[int]:
+        rows = self._rows_for(digest)
+        match = np.flatnonzero((self.row_keys[rows] == np.frombuffer(digest, dtype=np.uint8)).all(axis=1))
+        return rows.start + int(match[0]) if len(match) else None
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Returns the cached float32 vector for each text, or None where it is not cached."""
+        results: List[Optional[np.ndarray]] = []
+        with self._lock, file_lock(self.lock_path, shared=True):
+            if self.vectors is None:
+                self._open()
+            for text in texts:
+                row = self._find(bytes.fromhex(self.key_for(text))) if self.vectors is not None else None
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                results.append(np.array(self.vectors[row], dtype=np.float32))
+        return results
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        """Stores embeddings, replacing the oldest row of a key's set when the set is full."""
+        if len(texts) == 0:
+            return
+        embeddings = np.asarray(embeddings)
+        with self._lock, file_lock(self.lock_path):
+            if self.vectors is None:
+                self._open()
+            if self.vectors is None or self.dim != embeddings.shape[1]:
+                self._create(embeddings.shape[1])
+            now = time.time()
+            for text, embedding in zip(texts, embeddings):
+                digest = bytes.fromhex(self.key_for(text))
+                row = self._find(digest)
+                if row is None:
+                    rows = self._rows_for(digest)
+                    row = rows.start + int(np.argmin(self.stamps[rows]))  # free rows have stamp 0
+                self.row_keys[row] = 0
+                self.vectors[row] = embedding.astype(self.dtype)
+                self.row_keys[row] = np.frombuffer(digest, dtype=np.uint8)
+                self.stamps[row] = now
+            self._dirty = True
+            due = now - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes the rows changed so far back to disk. Other processes see them without this."""
+        with self._lock:
+            if not self._dirty or self.vectors is None:
+                return
+            self.vectors.flush()
+            self.row_keys.flush()
+            self.stamps.flush()
+            self._dirty = False
+            self._last_flush = time.time()
+
+    def stats(self):
+        with self._lock:
+            entries = int(np.count_nonzero(self.stamps)) if self.stamps is not None else 0
+            return {"entries": entries, "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses, "dtype": self.dtype.name}
+
+
+def create_embedding_cache(model_name: str) -> Optional[EmbeddingCache]:
+    """Builds the cache from EMBEDDING_CACHE_* env vars. EMBEDDING_CACHE_DIR='' disables it."""
+    cache_dir = os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache")
+    if not cache_dir:
+        return None
+    return EmbeddingCache(
+        cache_dir=cache_dir,
+        model_name=model_name,
+        max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000")),
+        dtype=os.getenv("EMBEDDING_CACHE_DTYPE", "float16"),
+    )
@@ -0,0 +1,49 @@
+import os
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+# Cross-process coordination for files shared by gunicorn workers, the inference sidecar and
+# initialize_db.py. flock() locks belong to the open file, so two threads of one process that
+# each open the lock file exclude each other too.
+
+
+@contextmanager
+def file_lock(lock_path: str, shared: bool = False) -> Iterator[None]:
+    """Holds an advisory lock on lock_path (created if missing) for the duration of the block."""
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases the lock
+
+
+def hold_exclusive(lock_path: str) -> Optional[int]:
+    """
+    Takes lock_path exclusively without waiting and keeps it until the returned fd is closed
+    (or the process exits). None if another process holds it. The holder may unlink lock_path
+    before closing: a lock taken on the unlinked file is detected and taken again on the new one.
+    """
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    while True:
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            current = os.stat(lock_path).st_ino
+        except FileNotFoundError:
+            current = None
+        if current == os.fstat(fd).st_ino:
+            return fd
+        os.close(fd)  # locked a file that was unlinked meanwhile
+
+
+def tmp_path_for(path: str) -> str:
+    """Scratch name for an atomic write of path, unique per process and thread."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
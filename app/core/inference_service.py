@@ -0,0 +1,326 @@
+import os
+import time
+import queue
+import pickle
+import threading
+from multiprocessing.connection import Client, Connection, Listener, AuthenticationError
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.core.metrics import timed
+
+# Methods each target exposes over the socket; anything else is refused
+SHARED_METHODS = {
+    "embedding": {"generate_embeddings", "embed_query", "encode_queries"},
+    "query_batcher": {"stats"},
+    "vector_store": {"add_documents", "upsert_documents", "delete_documents", "get_count", "flush", "query",
+                     "lexical_search", "get_documents", "get_version", "get_page"},
+    "vector_backend": {"stats", "count"},
+    "temp_store": {"begin_session", "add_chunks", "update_progress", "get_session", "query", "delete_session",
+                   "stats"},
+    "server": {"ping", "stats"},
+}
+# Index writes from different gunicorn workers are applied one at a time
+_WRITE_METHODS = {"add_documents", "upsert_documents", "delete_documents", "flush"}
+# Safe to send twice, so a call can be retried when the reply was lost
+_READ_METHODS = {"embed_query", "encode_queries", "query", "lexical_search", "get_documents", "get_version",
+                 "get_page", "get_count", "get_session", "stats", "count", "ping"}
+
+
+class RemoteInferenceError(RuntimeError):
+    """The sidecar is unreachable, or raised an error that could not be sent back as is."""
+
+
+def _sendable_error(error: Exception) -> Exception:
+    """The error itself if it survives a pickle round trip, else a RemoteInferenceError carrying its repr."""
+    try:
+        pickle.loads(pickle.dumps(error, protocol=pickle.HIGHEST_PROTOCOL))
+        return error
+    except Exception:
+        return RemoteInferenceError(repr(error))
+
+
+class InferenceServer:
+    """
+    Sidecar that owns the embedding model, the vector store and the temporary session store,
+    and serves them to every gunicorn worker over a Unix socket (multiprocessing.connection,
+    authenticated). One thread per worker connection; concurrent embed_query calls from all
+    workers meet in the sidecar's query batcher. Temp uploads live here, so a follow-up query
+    finds them whichever worker handles it.
+    """
+
+    def __init__(self, address: str, authkey: bytes, embedding_manager, vector_store, temp_store):
+        self.address = address
+        self.authkey = authkey
+        self.targets = {
+            "embedding": embedding_manager,
+            "query_batcher": embedding_manager.query_batcher,
+            "vector_store": vector_store,
+            "vector_backend": vector_store.backend,
+            "temp_store": temp_store,
+            "server": self,
+        }
+        self._write_lock = threading.Lock()
+        self._listener: Optional[Listener] = None
+        self.started = time.time()
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.remove(self.address)  # stale socket of a previous run
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        os.chmod(self.address, 0o600)  # requests are pickles: only this user may connect
+        print(f"--- InferenceServer: Listening on {self.address}")
+        while True:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                print("--- InferenceServer: Rejected a connection with a wrong authkey")
+                continue
+            except OSError:
+                return  # listener closed
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(conn,), name="inference-conn", daemon=True).start()
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+    def _serve(self, conn: Connection):
+        try:
+            while True:
+                try:
+                    target, method, args, kwargs = conn.recv()
+                except EOFError:
+                    return
+                status, value = self._dispatch(target, method, args, kwargs)
+                try:
+                    payload = pickle.dumps((status, value), protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception as e:
+                    self.errors += 1
+                    payload = pickle.dumps(("error", RemoteInferenceError(
+                        f"{target}.{method} returned a value that cannot be sent: {e!r}")))
+                conn.send_bytes(payload)
+        except OSError:
+            pass  # worker went away
+        finally:
+            self.connections -= 1
+            conn.close()
+
+    def _dispatch(self, target: str, method: str, args: tuple, kwargs: dict) -> Tuple[str, Any]:
+        self.requests += 1
+        if method not in SHARED_METHODS.get(target, ()):
+            self.errors += 1
+            return "error", RemoteInferenceError(f"{target}.{method} is not served by the inference sidecar")
+        try:
+            fn = getattr(self.targets[target], method)
+            if target == "vector_store" and method in _WRITE_METHODS:
+                with self._write_lock:
+                    return "ok", fn(*args, **kwargs)
+            return "ok", fn(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            return "error", _sendable_error(e)
+
+    def ping(self) -> bool:
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connections": self.connections,
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptime_s": round(time.time() - self.started, 1),
+        }
+
+
+class InferenceClient:
+    """Worker side of the sidecar: a small pool of connections, one per concurrent caller."""
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._idle: "queue.LifoQueue[Connection]" = queue.LifoQueue()
+
+    def call(self, target: str, method: str, *args, **kwargs) -> Any:
+        """
+        Sends one request on a pooled connection. Pooled connections are dead after a sidecar
+        restart, so a failed call is retried once on a fresh connection when that is safe: the
+        request could not be written at all, or the method only reads.
+        """
+        for attempt in range(2):
+            conn = self._connect() if attempt else self._checkout()
+            try:
+                conn.send((target, method, args, kwargs))
+            except (EOFError, OSError) as e:
+                # Nothing reached the sidecar, so nothing was applied
+                conn.close()
+                self.close()  # the other idle connections predate the same failure
+                if attempt:
+                    raise RemoteInferenceError(f"Inference sidecar connection lost during {target}.{method}: {e}")
+                continue
+            except Exception as e:
+                # e.g. an unpicklable request: the stream state is unknown
+                conn.close()
+                raise RemoteInferenceError(f"Inference sidecar call {target}.{method} failed: {e!r}")
+            try:
+                status, value = conn.recv()
+            except (EOFError, OSError) as e:
+                conn.close()
+                self.close()
+                # Writes are not retried: the request may already have been applied (e.g. add_documents)
+                if attempt or method not in _READ_METHODS:
+                    raise RemoteInferenceError(f"Inference sidecar connection lost during {target}.{method}: {e}")
+                continue
+            except Exception as e:
+                # e.g. a reply that does not unpickle: the stream state is unknown
+                conn.close()
+                raise RemoteInferenceError(f"Inference sidecar call {target}.{method} failed: {e!r}")
+            self._idle.put(conn)
+            if status == "error":
+                raise value
+            return value
+
+    def _checkout(self) -> Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _connect(self) -> Connection:
+        try:
+            return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        except (OSError, AuthenticationError) as e:
+            raise RemoteInferenceError(f"Inference sidecar not reachable at {self.address}: {e}")
+
+    def wait_until_ready(self, timeout_s: float = 300.0, interval_s: float = 0.5):
+        """Blocks until the sidecar answers (it may still be loading the model when workers boot)."""
+        deadline = time.monotonic() + timeout_s
+        while True:
+            try:
+                self.call("server", "ping")
+                return
+            except RemoteInferenceError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(interval_s)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _RemoteStats:
+    """Stands in for a sidecar component of which workers only read stats()."""
+
+    def __init__(self, client: InferenceClient, target: str):
+        self.client = client
+        self.target = target
+
+    def stats(self) -> Dict[str, Any]:
+        return self.client.call(self.target, "stats")
+
+    def count(self) -> int:
+        return self.client.call(self.target, "count")
+
+
+class RemoteEmbeddingManager:
+    """EmbeddingManager interface backed by the sidecar's model (batching and cache live there)."""
+
+    def __init__(self, client: InferenceClient, model_name: str):
+        self.client = client
+        self.model_name = model_name
+        self.cache = None
+        self.query_batcher = _RemoteStats(client, "query_batcher")
+
+    def generate_embeddings(self, texts: List[str], use_cache: bool = True) -> np.ndarray:
+        return self.client.call("embedding", "generate_embeddings", list(texts), use_cache=use_cache)
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        return self.client.call("embedding", "encode_queries", list(queries))
+
+    def embed_query(self, query: str) -> np.ndarray:
+        with timed("query_embed"):
+            return self.client.call("embedding", "embed_query", query)
+
+
+class RemoteVectorStore:
+    """VectorStore interface backed by the sidecar's index (one copy for all workers)."""
+
+    def __init__(self, client: InferenceClient, collection_name: str, persist_directory: str):
+        self.client = client
+        self.collection_name = collection_name
+        self.persist_directory = persist_directory
+        self.backend = _RemoteStats(client, "vector_backend")
+
+    def add_documents(self, documents: List[Any], embeddings: np.ndarray):
+        return self.client.call("vector_store", "add_documents", documents, embeddings)
+
+    def upsert_documents(self, documents: List[Any], embeddings: np.ndarray, ids: List[str]):
+        return self.client.call("vector_store", "upsert_documents", documents, embeddings, list(ids))
+
+    def delete_documents(self, ids: List[str]):
+        return self.client.call("vector_store", "delete_documents", list(ids))
+
+    def get_count(self) -> int:
+        return self.client.call("vector_store", "get_count")
+
+    def flush(self):
+        return self.client.call("vector_store", "flush")
+
+    def query(self, query_embeddings: np.ndarray, n_results: int,
+              where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return self.client.call("vector_store", "query", query_embeddings, n_results, where=where)
+
+    def lexical_search(self, query: str, top_k: int = 5,
+                       where: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        return self.client.call("vector_store", "lexical_search", query, top_k=top_k, where=where)
+
+    def get_documents(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return self.client.call("vector_store", "get_documents", list(ids))
+
+    def get_version(self) -> str:
+        return self.client.call("vector_store", "get_version")
+
+    def get_page(self, limit: int, offset: int = 0) -> Dict[str, Any]:
+        return self.client.call("vector_store", "get_page", limit, offset=offset)
+
+
+class RemoteTempSessionStore:
+    """TempSessionStore interface backed by the sidecar, so every worker sees every session."""
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    def begin_session(self, session_id: str, filename: str, total_pages: int = 0) -> str:
+        return self.client.call("temp_store", "begin_session", session_id, filename, total_pages=total_pages)
+
+    def add_chunks(self, session_id: str, texts: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray,
+                   upload_id: Optional[str] = None):
+        return self.client.call("temp_store", "add_chunks", session_id, texts, metadatas, embeddings,
+                                upload_id=upload_id)
+
+    def update_progress(self, session_id: str, pages_processed: int = 0, state: Optional[str] = None,
+                        upload_id: Optional[str] = None):
+        return self.client.call("temp_store", "update_progress", session_id, pages_processed=pages_processed,
+                                state=state, upload_id=upload_id)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self.client.call("temp_store", "get_session", session_id)
+
+    def query(self, session_id: str, query_embedding: np.ndarray, top_k: int) -> Optional[Dict[str, Any]]:
+        with timed("temp_search"):
+            return self.client.call("temp_store", "query", session_id, query_embedding, top_k)
+
+    def delete_session(self, session_id: str, upload_id: Optional[str] = None) -> bool:
+        return self.client.call("temp_store", "delete_session", session_id, upload_id=upload_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.client.call("temp_store", "stats")
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable
+from app.core.rag import EmbeddingManager, VectorStore
+from app.core.data_prep import DataProcessor, file_sha256
+from app.core.metrics import timed
+from app.core.filelock import file_lock, tmp_path_for
+from app.core.subjects import derive_subject, normalize_subject
+
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+# Lock files next to the manifest: one per file ingest (all processes), one per manifest write
+INGEST_LOCK_FILENAME = "ingest.lock"
+MANIFEST_LOCK_FILENAME = "ingest_manifest.lock"
+
+# Serializes ingests between the threads of one process (INGEST_LOCK_FILENAME does it across processes)
+_INGEST_LOCK = threading.Lock()
+
+
+def make_chunk_id(file_hash: str, chunk_index: int, content: str) -> str:
+    """Stable chunk id derived from the source file hash and the chunk's own content."""
+    content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+    return f"chunk_{file_hash[:16]}_{chunk_index}_{content_hash}"
+
+
+class IngestionManifest:
+    """
+    Per-file record of what is already in the vector store.
+    Key: source file name. Value: {'sha256', 'chunk_size', 'chunk_overlap', 'subject', 'chunk_ids',
+    'complete', 'batches_done'}. An entry with complete=False is a checkpoint of a partially indexed file.
+
+    Several processes update the same manifest (every gunicorn worker runs a job queue, and
+    initialize_db.py), so save() only writes the entries this instance changed: under a lock
+    file it re-reads the manifest and applies them on top.
+    """
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.lock_path = os.path.join(os.path.dirname(manifest_path) or ".", MANIFEST_LOCK_FILENAME)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._changed: Dict[str, Optional[Dict[str, Any]]] = {}  # unsaved sets, None = removed
+        self.reload()
+
+    def reload(self):
+        """Re-reads the manifest from disk (another process may have updated it); unsaved changes are kept."""
+        entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"--- IngestionManifest: Could not read {self.manifest_path}, starting empty: {e}")
+        for source_file, entry in self._changed.items():
+            if entry is None:
+                entries.pop(source_file, None)
+            else:
+                entries[source_file] = entry
+        self.entries = entries
+
+    def save(self):
+        """Merges this instance's changes into the manifest on disk, atomically (tmp + replace)."""
+        os.makedirs(os.path.dirname(self.manifest_path) or ".", exist_ok=True)
+        with file_lock(self.lock_path):
+            self.reload()
+            tmp_path = tmp_path_for(self.manifest_path)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.manifest_path)
+            self._changed = {}
+
+    def get(self, source_file: str) -> Optional[Dict[str, Any]]:
+        return self.entries.get(source_file)
+
+    def find_by_hash(self, file_hash: str) -> Optional[str]:
+        for source_file, entry in self.entries.items():
+            if entry.get("sha256") == file_hash:
+                return source_file
+        return None
+
+    def set(self, source_file: str, entry: Dict[str, Any]):
+        self.entries[source_file] = entry
+        self._changed[source_file] = entry
+
+    def remove(self, source_file: str):
+        self.entries.pop(source_file, None)
+        self._changed[source_file] = None
+
+
+class IncrementalIngestor:
+    """
+    Indexes single PDF files into the permanent vector store.
+    Chunk ids are derived from content hashes, so re-indexing the same bytes is an upsert
+    and the manifest lets unchanged files be skipped without touching the model.
+    Every chunk is tagged with the subject partition of its file (see subject_for).
+    """
+
+    def __init__(self, processor: DataProcessor, embedding_manager: EmbeddingManager, vector_store: VectorStore,
+                 subject_tags: Optional[Dict[str, str]] = None, checkpoint_batches: int = 8,
+                 checkpoint_seconds: float = 30.0):
+        self.processor = processor
+        self.embedding_manager = embedding_manager
+        self.vector_store = vector_store
+        self.subject_tags = subject_tags or {}
+        # A checkpoint flushes the whole store (and BM25 index), so it is taken every checkpoint_batches
+        # batches or checkpoint_seconds, whichever comes first; batches after it are simply redone on resume
+        self.checkpoint_batches = max(1, checkpoint_batches)
+        self.checkpoint_seconds = checkpoint_seconds
+        self.manifest = IngestionManifest(os.path.join(vector_store.persist_directory, MANIFEST_FILENAME))
+
+    def subject_for(self, source_file: str, subject: Optional[str] = None) -> str:
+        """
+        Subject of a file: the explicit one (e.g. given at upload), else its entry in the tags
+        file, else the one it was indexed with before, else derived from the file name.
+        """
+        if subject:
+            return normalize_subject(subject)
+        if source_file in self.subject_tags:
+            return self.subject_tags[source_file]
+        previous = self.manifest.get(source_file)
+        if previous and previous.get("subject"):
+            return previous["subject"]
+        return derive_subject(source_file)
+
+    def ingest_file(self, pdf_path: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                    batch_size: Optional[int] = None, load_pages: Optional[Callable[[str], List[Any]]] = None,
+                    on_stage: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                    progress: Optional[Callable[[int, int], None]] = None,
+                    subject: Optional[str] = None, source_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Indexes one PDF. Returns a summary with status 'indexed', 'unchanged' or 'duplicate'.
+        Background jobs pass load_pages (parse in a worker process), on_stage(stage, info) for
+        'parsing'/'splitting'/'embedding', and progress(chunks_done, chunks_total) per batch.
+        source_path: where the file will live once published, if pdf_path is an upload snapshot
+        (same file name); recorded as the chunks' 'source'.
+        """
+        with _INGEST_LOCK, file_lock(os.path.join(self.vector_store.persist_directory, INGEST_LOCK_FILENAME)):
+            self.manifest.reload()
+            return self._ingest_file(pdf_path, chunk_size, chunk_overlap, batch_size,
+                                     load_pages or self.processor.process_pdf, on_stage, progress, subject,
+                                     source_path)
+
+    def _ingest_file(self, pdf_path: str, chunk_size: int, chunk_overlap: int, batch_size: Optional[int],
+                     load_pages: Callable[[str], List[Any]],
+                     on_stage: Optional[Callable[[str, Dict[str, Any]], None]],
+                     progress: Optional[Callable[[int, int], None]],
+                     subject: Optional[str] = None, source_path: Optional[str] = None) -> Dict[str, Any]:
+        on_stage = on_stage or (lambda stage, info: None)
+        source_file = Path(pdf_path).name
+        file_hash = file_sha256(pdf_path)
+        subject = self.subject_for(source_file, subject)
+
+        existing = self.manifest.get(source_file)
+        if self._is_current(existing, file_hash, chunk_size, chunk_overlap, subject):
+            print(f"--- IncrementalIngestor: {source_file} unchanged, skipping.")
+            return {"status": "unchanged", "source_file": source_file, "chunk_count": len(existing["chunk_ids"])}
+
+        duplicate_of = self.manifest.find_by_hash(file_hash)
+        if duplicate_of and duplicate_of != source_file and \
+                self._is_current(self.manifest.get(duplicate_of), file_hash, chunk_size, chunk_overlap):
+            print(f"--- IncrementalIngestor: {source_file} has the same content as {duplicate_of}, skipping.")
+            return {"status": "duplicate", "source_file": source_file, "duplicate_of": duplicate_of,
+                    "chunk_count": len(self.manifest.get(duplicate_of)["chunk_ids"])}
+
+        on_stage("parsing", {})
+        with timed("ingest_parse"):
+            documents = load_pages(pdf_path)
+        if source_path:
+            for doc in documents:
+                doc.metadata['source'] = source_path
+        on_stage("splitting", {"pages": len(documents)})
+        with timed("ingest_split"):
+            chunks = self.processor.split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        on_stage("embedding", {"chunks_total": len(chunks)})
+        return self.index_chunks(source_file, file_hash, chunks, chunk_size, chunk_overlap,
+                                 batch_size=batch_size, progress=progress, subject=subject)
+
+    def index_chunks(self, source_file: str, file_hash: str, chunks: List[Any],
+                     chunk_size: int, chunk_overlap: int, batch_size: Optional[int] = None,
+                     progress: Optional[Callable[[int, int], None]] = None,
+                     subject: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Upserts the chunks of one file and drops any chunks left over from an older version.
+        With batch_size, chunks are embedded and inserted batch by batch and the manifest is
+        checkpointed periodically, so an interrupted run resumes after the last checkpoint.
+        """
+        subject = self.subject_for(source_file, subject)
+        ids = []
+        for i, chunk in enumerate(chunks):
+            chunk.metadata['chunk_index'] = i
+            chunk.metadata['file_sha256'] = file_hash
+            chunk.metadata['subject'] = subject
+            ids.append(make_chunk_id(file_hash, i, chunk.page_content))
+
+        previous = self.manifest.get(source_file)
+        batch_size = batch_size or max(len(chunks), 1)
+        total_batches = (len(chunks) + batch_size - 1) // batch_size
+
+        # Resume a checkpointed file: batches already written for the same bytes are skipped
+        start_batch = 0
+        if previous and not previous.get("complete", True) and \
+                previous.get("sha256") == file_hash and previous.get("chunk_size") == chunk_size \
+                and previous.get("chunk_overlap") == chunk_overlap and previous.get("subject") == subject:
+            start_batch = min(previous.get("batches_done", 0), total_batches)
+            if start_batch:
+                print(f"--- IncrementalIngestor: Resuming {source_file} at batch {start_batch + 1}/{total_batches}")
+
+        last_checkpoint = time.monotonic()
+        for batch_index in range(start_batch, total_batches):
+            start, end = batch_index * batch_size, (batch_index + 1) * batch_size
+            batch_chunks, batch_ids = chunks[start:end], ids[start:end]
+            with timed("ingest_embed"):
+                embeddings = self.embedding_manager.generate_embeddings([c.page_content for c in batch_chunks])
+            with timed("ingest_upsert"):
+                self.vector_store.upsert_documents(batch_chunks, embeddings, batch_ids)
+
+            if batch_index + 1 < total_batches and (
+                    (batch_index + 1 - start_batch) % self.checkpoint_batches == 0
+                    or time.monotonic() - last_checkpoint >= self.checkpoint_seconds):
+                # Store data must be durable before the manifest claims the batch is done
+                last_checkpoint = time.monotonic()
+                self.vector_store.flush()
+                self.manifest.set(source_file, self._entry(file_hash, chunk_size, chunk_overlap, subject, ids,
+                                                           complete=False, batches_done=batch_index + 1,
+                                                           previous=previous))
+                self.manifest.save()
+            if progress:
+                progress(min(end, len(chunks)), len(chunks))
+
+        if previous:
+            stale_ids = sorted(set(previous.get("chunk_ids", [])) - set(ids))
+            self.vector_store.delete_documents(stale_ids)
+
+        self.manifest.set(source_file, self._entry(file_hash, chunk_size, chunk_overlap, subject, ids,
+                                                   complete=True, batches_done=total_batches))
+        self.vector_store.flush()
+        self.manifest.save()
+        print(f"--- IncrementalIngestor: Indexed {len(ids)} chunks from {source_file} (subject: {subject})")
+        return {"status": "indexed", "source_file": source_file, "subject": subject, "chunk_count": len(ids)}
+
+    def remove_file(self, source_file: str):
+        """Deletes every chunk of a file from the store and forgets it in the manifest."""
+        entry = self.manifest.get(source_file)
+        if not entry:
+            return
+        self.vector_store.delete_documents(entry.get("chunk_ids", []))
+        self.vector_store.flush()
+        self.manifest.remove(source_file)
+        self.manifest.save()
+        print(f"--- IncrementalIngestor: Removed {source_file} from the index")
+
+    def is_indexed(self, source_file: str, file_hash: str, chunk_size: int, chunk_overlap: int) -> bool:
+        """True if this exact file version is fully indexed with the given chunking and subject."""
+        return self._is_current(self.manifest.get(source_file), file_hash, chunk_size, chunk_overlap,
+                                self.subject_for(source_file))
+
+    @staticmethod
+    def _entry(file_hash: str, chunk_size: int, chunk_overlap: int, subject: str, ids: List[str], complete: bool,
+               batches_done: int, previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        chunk_ids = list(ids)
+        if previous and not complete:
+            # Keep the old version's ids around until the file completes, so they can still be cleaned up
+            chunk_ids = list(dict.fromkeys(chunk_ids + previous.get("chunk_ids", [])))
+        return {
+            "sha256": file_hash,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "subject": subject,
+            "chunk_ids": chunk_ids,
+            "complete": complete,
+            "batches_done": batches_done,
+        }
+
+    @staticmethod
+    def _is_current(entry: Optional[Dict[str, Any]], file_hash: str, chunk_size: int, chunk_overlap: int,
+                    subject: Optional[str] = None) -> bool:
+        """subject=None ignores the tag; files indexed before subjects existed are otherwise re-tagged."""
+        return bool(entry) and entry.get("complete", True) and entry.get("sha256") == file_hash \
+            and entry.get("chunk_size") == chunk_size and entry.get("chunk_overlap") == chunk_overlap \
+            and (subject is None or entry.get("subject") == subject)
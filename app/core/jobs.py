@@ -0,0 +1,339 @@
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from app.core.data_prep import _load_pdf_pages
+from app.core.ingest import IncrementalIngestor
+from app.core.filelock import hold_exclusive
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class IngestThrottle:
+    """
+    Paces background ingestion between embed/upsert batches: at most max_chunks_per_second
+    (0 = no cap), and while busy() reports query work in flight it waits up to
+    max_yield_seconds before the next batch, so a big upload never starves query latency.
+    """
+
+    def __init__(self, max_chunks_per_second: float = 0.0, max_yield_seconds: float = 2.0,
+                 busy: Optional[Callable[[], bool]] = None):
+        self.max_chunks_per_second = max_chunks_per_second
+        self.max_yield_seconds = max_yield_seconds
+        self.busy = busy
+        self._last: Optional[float] = None
+
+    def reset(self):
+        self._last = time.perf_counter()
+
+    def pace(self, chunks: int) -> float:
+        """Blocks as needed after a batch of chunks. Returns the seconds spent waiting."""
+        started = time.perf_counter()
+        if self.max_chunks_per_second > 0:
+            last = self._last if self._last is not None else started
+            delay = chunks / self.max_chunks_per_second - (started - last)
+            if delay > 0:
+                time.sleep(delay)
+        if self.busy is not None:
+            deadline = time.perf_counter() + self.max_yield_seconds
+            while self.busy() and time.perf_counter() < deadline:
+                time.sleep(0.01)
+        self._last = time.perf_counter()
+        return self._last - started
+
+
+class IngestionJobQueue:
+    """
+    Background ingestion for permanent uploads. submit() returns immediately with a job record;
+    one runner thread processes jobs in order: parse (worker process pool) -> split ->
+    embed + upsert in throttled batches. Each job is a JSON file in jobs_dir, so any gunicorn
+    worker can answer /rag/jobs/{id}, and jobs of a worker that died are picked up again on
+    the next start (the ingest manifest checkpoints make that resume at the last batch).
+    """
+
+    def __init__(self, ingestor: IncrementalIngestor, jobs_dir: str, parse_workers: int = 1,
+                 batch_size: int = 32, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 throttle: Optional[IngestThrottle] = None, retention_seconds: float = 7 * 24 * 3600):
+        self.ingestor = ingestor
+        self.jobs_dir = jobs_dir
+        self.parse_workers = parse_workers
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.throttle = throttle or IngestThrottle()
+        self.retention_seconds = retention_seconds
+        os.makedirs(jobs_dir, exist_ok=True)
+
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._claims: Dict[str, int] = {}  # job id -> fd holding its lock file, for the life of the job
+        self.completed = 0
+        self.failed = 0
+
+    # --- public API ---
+    def start(self):
+        """Starts the runner and re-queues unfinished jobs whose owning process is gone."""
+        self._prune()
+        for listed in self._read_all():
+            job_id = listed["job_id"]
+            if listed.get("status") not in ACTIVE_STATES or not self._claim(job_id):
+                continue
+            # Re-read under the lock: the owner may have finished the job since the listing
+            record = self._read(job_id)
+            if record is None or record.get("status") not in ACTIVE_STATES:
+                self._release(job_id)
+                continue
+            if self._was_published(record):
+                # The owner died between publishing the file and recording success
+                self._finish(record, record["result"])
+                self._release(job_id)
+                continue
+            print(f"--- IngestionJobQueue: Resuming job {job_id} ({record.get('filename')})")
+            record.update(status=QUEUED, stage=QUEUED, owner_pid=os.getpid())
+            self._store(record)
+            self._queue.put(job_id)
+        self._thread = threading.Thread(target=self._run, name="ingest-jobs", daemon=True)
+        self._thread.start()
+
+    def upload_path(self, filename: str) -> str:
+        """
+        Private path to save an upload to before submit(destination=...): the job hashes and parses
+        this copy, so the live PDF is never truncated under a running job and survives a failed one.
+        """
+        directory = os.path.join(self.jobs_dir, "uploads", uuid.uuid4().hex)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+    def submit(self, pdf_path: str, filename: str, destination: Optional[str] = None,
+               subject: Optional[str] = None) -> Dict[str, Any]:
+        """With destination, pdf_path (from upload_path) is moved there once indexed, and deleted on failure."""
+        job_id = uuid.uuid4().hex
+        record = {
+            "job_id": job_id,
+            "filename": filename,
+            "subject": subject,
+            "path": pdf_path,
+            "status": QUEUED,
+            "stage": QUEUED,
+            "progress": {"pages": None, "chunks_total": None, "chunks_done": 0, "percent": 0.0},
+            "stage_seconds": {},
+            "throttled_seconds": 0.0,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "destination": destination,
+            "owner_pid": os.getpid(),
+        }
+        self._claim(job_id)
+        self._store(record)
+        self._queue.put(job_id)
+        return dict(record, queue_position=self._queue.qsize())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job record, from memory or from disk (the job may belong to another worker)."""
+        if not _JOB_ID_RE.match(job_id):
+            return None
+        with self._lock:
+            record = self._jobs.get(job_id)
+            if record is not None:
+                return json.loads(json.dumps(record))
+        return self._read(job_id)
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        records = sorted(self._read_all(), key=lambda r: r.get("created_at", 0), reverse=True)
+        return records[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "parse_workers": self.parse_workers,
+        }
+
+    def shutdown(self):
+        self._queue.put(None)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # --- runner ---
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            record = self._read(job_id)
+            if record is None:
+                continue
+            with self._lock:
+                self._jobs[job_id] = record
+            try:
+                self._process(record)
+            finally:
+                with self._lock:
+                    self._jobs.pop(job_id, None)
+                self._release(job_id)
+
+    def _process(self, record: Dict[str, Any]):
+        stage_started = [time.perf_counter(), RUNNING]
+
+        def enter_stage(stage: str, info: Dict[str, Any]):
+            now = time.perf_counter()
+            self._update(record, stage_seconds=dict(record["stage_seconds"],
+                                                    **{stage_started[1]: round(now - stage_started[0], 3)}),
+                         stage=stage, progress=dict(record["progress"], **info))
+            stage_started[:] = [now, stage]
+            if stage == "embedding":
+                self.throttle.reset()
+
+        def batch_done(done: int, total: int):
+            batch = min(done - record["progress"].get("chunks_done", 0), self.batch_size)
+            waited = self.throttle.pace(max(batch, 0))
+            self._update(record, throttled_seconds=round(record["throttled_seconds"] + waited, 3),
+                         progress=dict(record["progress"], chunks_done=done, chunks_total=total,
+                                       percent=round(100.0 * done / total, 1) if total else 100.0))
+
+        self._update(record, status=RUNNING, stage=RUNNING, started_at=time.time())
+        print(f"--- IngestionJobQueue: Job {record['job_id']} started ({record['filename']})")
+        try:
+            result = self.ingestor.ingest_file(
+                record["path"], self.chunk_size, self.chunk_overlap,
+                batch_size=self.batch_size, load_pages=self._load_pages,
+                on_stage=enter_stage, progress=batch_done, subject=record.get("subject"),
+                source_path=record.get("destination")
+            )
+            if record.get("destination"):
+                # Recorded before the move, so a resume after a crash here knows the file is live
+                enter_stage("publishing", {})
+                self._update(record, result=result)
+                # Published only now: a re-upload replaces the live PDF in one rename, after indexing
+                shutil.move(record["path"], record["destination"])
+                os.rmdir(os.path.dirname(record["path"]))
+        except Exception as e:
+            enter_stage("failed", {})
+            self.failed += 1
+            print(f"--- IngestionJobQueue: Job {record['job_id']} failed: {e}")
+            if record.get("destination"):
+                shutil.rmtree(os.path.dirname(record["path"]), ignore_errors=True)
+            self._update(record, status=FAILED, stage="failed", error=str(e), finished_at=time.time())
+            return
+
+        enter_stage("done", {})
+        self._finish(record, result)
+
+    def _finish(self, record: Dict[str, Any], result: Dict[str, Any]):
+        self.completed += 1
+        progress = dict(record["progress"], percent=100.0)
+        self._update(record, status=SUCCEEDED, stage="done", result=result, progress=progress,
+                     finished_at=time.time())
+        print(f"--- IngestionJobQueue: Job {record['job_id']} {result['status']} "
+              f"({result['chunk_count']} chunks)")
+
+    @staticmethod
+    def _was_published(record: Dict[str, Any]) -> bool:
+        """True if the job got as far as moving its indexed snapshot to the destination."""
+        if record.get("stage") != "publishing" or not record.get("destination"):
+            return False
+        if os.path.exists(record["path"]) or not os.path.exists(record["destination"]):
+            return False
+        shutil.rmtree(os.path.dirname(record["path"]), ignore_errors=True)
+        return True
+
+    def _load_pages(self, pdf_path: str) -> List[Any]:
+        """Parses the PDF in a worker process so pypdf does not compete with queries for the GIL."""
+        processor = self.ingestor.processor  # page cache: re-uploaded bytes are not parsed again
+        if self.parse_workers <= 0:
+            return processor.process_pdf(pdf_path)
+        if self._pool is None:
+            # spawn: forking a process that already runs threads (and possibly torch) is unsafe
+            self._pool = ProcessPoolExecutor(max_workers=self.parse_workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        return processor.process_pdf(pdf_path, parse=lambda path: self._pool.submit(_load_pdf_pages, path).result())
+
+    # --- persistence ---
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _update(self, record: Dict[str, Any], **changes):
+        with self._lock:
+            record.update(changes)
+        self._store(record)
+
+    def _store(self, record: Dict[str, Any]):
+        """Atomic write (tmp + replace) so readers in other workers never see half a record."""
+        with self._lock:
+            data = json.dumps(record)
+        path = self._path(record["job_id"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, job_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _read_all(self) -> List[Dict[str, Any]]:
+        records = []
+        for path in Path(self.jobs_dir).glob("*.json"):
+            record = self._read(path.stem)
+            if record is not None:
+                records.append(record)
+        return records
+
+    def _claim(self, job_id: str) -> bool:
+        """
+        Takes the job's lock file (flock) for this process and holds it until _release. The kernel
+        drops the lock when its owner dies, so a dead worker's job can be claimed by exactly one other.
+        """
+        if job_id in self._claims:
+            return True
+        fd = hold_exclusive(os.path.join(self.jobs_dir, f"{job_id}.lock"))
+        if fd is None:
+            return False
+        self._claims[job_id] = fd
+        return True
+
+    def _release(self, job_id: str):
+        fd = self._claims.pop(job_id, None)
+        if fd is None:
+            return
+        try:
+            os.remove(os.path.join(self.jobs_dir, f"{job_id}.lock"))
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def _prune(self):
+        """Drops finished job records older than retention_seconds."""
+        cutoff = time.time() - self.retention_seconds
+        for record in self._read_all():
+            if record.get("status") not in ACTIVE_STATES and (record.get("finished_at") or 0) < cutoff:
+                try:
+                    os.remove(self._path(record["job_id"]))
+                except FileNotFoundError:
+                    pass
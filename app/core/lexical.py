@@ -0,0 +1,129 @@
+import os
+import re
+import math
+import pickle
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+from app.core.filelock import tmp_path_for
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased alphanumeric tokens. Keeps numbers, so 'Q.12' or 'GATE 2024' stay searchable."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    In-memory BM25 inverted index over chunk ids, persisted with pickle next to the vector store.
+    Supports incremental add (upsert) and remove so it can follow every write to the collection.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}  # term -> {doc_id: term frequency}
+        self.doc_lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}  # doc_id -> its distinct terms, for cheap removal
+        self.total_length = 0
+        self.dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, ids: List[str], texts: List[str]):
+        """Indexes texts under ids, replacing any previous text for the same id."""
+        with self._lock:
+            self.remove([doc_id for doc_id in ids if doc_id in self.doc_lengths])
+            for doc_id, text in zip(ids, texts):
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[doc_id] = tf
+                self.doc_terms[doc_id] = list(counts.keys())
+                length = sum(counts.values())
+                self.doc_lengths[doc_id] = length
+                self.total_length += length
+            self.dirty = True
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for doc_id in ids:
+                length = self.doc_lengths.pop(doc_id, None)
+                if length is None:
+                    continue
+                self.total_length -= length
+                for term in self.doc_terms.pop(doc_id, []):
+                    docs = self.postings.get(term)
+                    if docs is None:
+                        continue
+                    docs.pop(doc_id, None)
+                    if not docs:
+                        del self.postings[term]
+                self.dirty = True
+
+    def search(self, query: str, top_k: int = 5, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Returns up to top_k (doc_id, bm25 score) pairs, best first. With allowed, only those ids are
+        scored (statistics still cover the whole index), so a filter never starves the ranking.
+        """
+        with self._lock:
+            n_docs = len(self.doc_lengths)
+            if not n_docs or (allowed is not None and not allowed):
+                return []
+            avg_length = self.total_length / n_docs
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    if allowed is not None and doc_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def save(self, path: str):
+        """Writes the index atomically (only if it changed since the last save)."""
+        with self._lock:
+            if not self.dirty:
+                return
+            state = {"k1": self.k1, "b": self.b, "postings": self.postings,
+                     "doc_lengths": self.doc_lengths, "doc_terms": self.doc_terms,
+                     "total_length": self.total_length}
+            tmp_path = tmp_path_for(path)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        if not os.path.exists(path):
+            return index
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            index.k1, index.b = state["k1"], state["b"]
+            index.postings = state["postings"]
+            index.doc_lengths = state["doc_lengths"]
+            index.doc_terms = state["doc_terms"]
+            index.total_length = state["total_length"]
+        except Exception as e:
+            print(f"--- BM25Index: Could not load {path}, starting empty: {e}")
+            index = cls()
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuses several ranked id lists: score(id) = sum over lists of 1 / (k + rank)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
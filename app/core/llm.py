@@ -0,0 +1,245 @@
+import os
+import re
+import time
+import json
+import random
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+from app.core.context import estimate_tokens
+from app.core.metrics import timed, observe_stage, record_llm_usage, LLM_CALLS, LLM_TOKENS
+from app.core.startup import timed_import
+
+LLM_PROVIDERS = ("gemini", "fake")
+
+RAG_PROMPT_TEMPLATE = """You are a helpful Study Buddy AI assistant. Use the following context to answer the question accurately and concisely.
+
+Context:
+{context}
+
+Question: {question}
+
+Answer: Provide a clear and informative answer based ONLY on the context above. If the context doesn't contain enough information to answer the question, politely say, 'I'm sorry, I couldn't find the answer in the provided study materials.'"""
+
+RAG_GENERATION_CONFIG = {
+    "temperature": 0.1,
+    "max_output_tokens": 1024
+}
+
+LLM_ERROR_ANSWER = "Error: Could not generate response due to a system error."
+
+
+class BaseLLM:
+    """
+    LLM provider interface. Providers implement the three text primitives (generate_text,
+    agenerate_text, astream_text); prompt building, metrics and the error fallback for RAG
+    answers are shared here. `purpose` labels the call in metrics ("rag", "quiz", ...).
+    """
+    model_name = "base"
+
+    def __init__(self):
+        PromptTemplate = timed_import("langchain.prompts").PromptTemplate
+        self.prompt_template = PromptTemplate(
+            input_variables=["context", "question"],
+            template=RAG_PROMPT_TEMPLATE
+        )
+
+    # --- provider primitives ---
+    def generate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        raise NotImplementedError
+
+    async def agenerate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        raise NotImplementedError
+
+    def astream_text(self, prompt: str, config: Optional[Dict[str, Any]] = None,
+                     purpose: str = "rag") -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    # --- RAG answers ---
+    def build_rag_prompt(self, query: str, context: str) -> str:
+        return self.prompt_template.format(context=context, question=query)
+
+    def generate_rag_response(self, query: str, context: str) -> str:
+        formatted_prompt = self.build_rag_prompt(query, context)
+        try:
+            with timed("llm"):
+                answer = self.generate_text(formatted_prompt, RAG_GENERATION_CONFIG, purpose="rag")
+            LLM_CALLS.inc(purpose="rag", outcome="ok")
+            return answer
+        except Exception as e:
+            LLM_CALLS.inc(purpose="rag", outcome="error")
+            print(f"--- {type(self).__name__}: Error generating response: {e}")
+            return LLM_ERROR_ANSWER
+
+    async def agenerate_rag_response(self, query: str, context: str) -> str:
+        """Same as generate_rag_response, without blocking the event loop."""
+        formatted_prompt = self.build_rag_prompt(query, context)
+        try:
+            with timed("llm"):
+                answer = await self.agenerate_text(formatted_prompt, RAG_GENERATION_CONFIG, purpose="rag")
+            LLM_CALLS.inc(purpose="rag", outcome="ok")
+            return answer
+        except Exception as e:
+            LLM_CALLS.inc(purpose="rag", outcome="error")
+            print(f"--- {type(self).__name__}: Error generating response: {e}")
+            return LLM_ERROR_ANSWER
+
+    async def astream_rag_response(self, query: str, context: str) -> AsyncIterator[str]:
+        """Yields answer text pieces as they are generated. Closing the generator stops the stream."""
+        formatted_prompt = self.build_rag_prompt(query, context)
+        started = time.perf_counter()
+        stream = self.astream_text(formatted_prompt, RAG_GENERATION_CONFIG, purpose="rag")
+        first_token = True
+        try:
+            async for piece in stream:
+                if first_token:
+                    observe_stage("llm_first_token", time.perf_counter() - started)
+                    first_token = False
+                yield piece
+        finally:
+            observe_stage("llm_stream", time.perf_counter() - started)
+            LLM_CALLS.inc(purpose="rag_stream", outcome="error" if first_token else "ok")
+            await stream.aclose()
+
+
+# --- Gemini (google-genai) ---
+class GeminiLLM(BaseLLM):
+    def __init__(self, model_name: str, api_key: str):
+        if not api_key:
+            raise ValueError("Gemini API key is required.")
+        super().__init__()
+        self.model_name = model_name
+        genai = timed_import("google.genai")  # lazy: google-genai is slow to import
+        self.client = genai.Client(api_key=api_key)
+        print(f"--- GeminiLLM: Initialized with model: {self.model_name}")
+
+    def generate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        response = self.client.models.generate_content(model=self.model_name, contents=prompt, config=config)
+        record_llm_usage(purpose, response)
+        return response.text
+
+    async def agenerate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        response = await self.client.aio.models.generate_content(model=self.model_name, contents=prompt, config=config)
+        record_llm_usage(purpose, response)
+        return response.text
+
+    async def astream_text(self, prompt: str, config: Optional[Dict[str, Any]] = None,
+                           purpose: str = "rag") -> AsyncIterator[str]:
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model_name, contents=prompt, config=config
+        )
+        last_chunk = None
+        try:
+            async for chunk in stream:
+                last_chunk = chunk
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            # The final chunk carries the usage totals for the whole stream
+            record_llm_usage(purpose, last_chunk)
+            close = getattr(stream, "aclose", None)
+            if close is not None:
+                await close()
+
+
+# --- Local stand-in for load tests ---
+_QUIZ_COUNT_RE = re.compile(r"Generate (\d+) multiple-choice")
+_QUESTION_RE = re.compile(r"Question: (.*?)\n")
+
+
+class FakeLLMError(RuntimeError):
+    """Injected failure. The code mimics Gemini's rate-limit error so retry paths get exercised."""
+    code = 429
+
+
+class FakeLLM(BaseLLM):
+    """
+    Offline provider with Gemini-like timing: latency_ms before the first token, then
+    answer_tokens at tokens_per_second. error_rate is the fraction of calls that raise,
+    exercising the same error paths as a failed Gemini call. Quiz prompts (JSON config)
+    get schema-valid MCQs so the quiz bank and /generate-quiz behave normally.
+    """
+
+    def __init__(self, latency_ms: float = 300.0, tokens_per_second: float = 100.0, error_rate: float = 0.0,
+                 answer_tokens: int = 80, seed: Optional[int] = None):
+        super().__init__()
+        self.model_name = "fake-llm"
+        self.latency_s = max(latency_ms, 0.0) / 1000.0
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.answer_tokens = answer_tokens
+        self._random = random.Random(seed)
+        print(f"--- FakeLLM: Initialized (latency {latency_ms:g} ms, {tokens_per_second:g} tokens/s, "
+              f"error rate {error_rate:g})")
+
+    def _response_text(self, prompt: str, config: Optional[Dict[str, Any]]) -> str:
+        if config and config.get("response_mime_type") == "application/json":
+            match = _QUIZ_COUNT_RE.search(prompt)
+            return json.dumps(self._fake_mcqs(int(match.group(1)) if match else 5))
+        match = _QUESTION_RE.search(prompt)
+        question = match.group(1).strip() if match else "your question"
+        words = ["Based", "on", "the", "study", "materials,", "regarding", f"'{question}':"]
+        filler = prompt.split()[-200:] or ["answer"]
+        while len(words) < self.answer_tokens:
+            words.append(self._random.choice(filler))
+        return " ".join(words[:self.answer_tokens])
+
+    @staticmethod
+    def _fake_mcqs(count: int) -> List[Dict[str, Any]]:
+        return [{
+            "question": f"Sample question {i + 1}?",
+            "options": {key: f"Option {key}" for key in ("A", "B", "C", "D")},
+            "correct_answer": "A",
+            "explanation": "Generated by FakeLLM."
+        } for i in range(count)]
+
+    def _begin(self, prompt: str, purpose: str):
+        if self._random.random() < self.error_rate:
+            raise FakeLLMError("FakeLLM: injected error (429 RESOURCE_EXHAUSTED)")
+        LLM_TOKENS.inc(estimate_tokens(prompt), purpose=purpose, kind="prompt")
+
+    def _generation_seconds(self, text: str) -> float:
+        if self.tokens_per_second <= 0:
+            return 0.0
+        return len(text.split()) / self.tokens_per_second
+
+    def generate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        self._begin(prompt, purpose)
+        text = self._response_text(prompt, config)
+        time.sleep(self.latency_s + self._generation_seconds(text))
+        LLM_TOKENS.inc(len(text.split()), purpose=purpose, kind="completion")
+        return text
+
+    async def agenerate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        self._begin(prompt, purpose)
+        text = self._response_text(prompt, config)
+        await asyncio.sleep(self.latency_s + self._generation_seconds(text))
+        LLM_TOKENS.inc(len(text.split()), purpose=purpose, kind="completion")
+        return text
+
+    async def astream_text(self, prompt: str, config: Optional[Dict[str, Any]] = None,
+                           purpose: str = "rag") -> AsyncIterator[str]:
+        self._begin(prompt, purpose)
+        words = self._response_text(prompt, config).split()
+        await asyncio.sleep(self.latency_s)
+        # Gemini streams a few words per chunk
+        for i in range(0, len(words), 8):
+            piece = words[i:i + 8]
+            await asyncio.sleep(self._generation_seconds(" ".join(piece)))
+            yield (" " if i else "") + " ".join(piece)
+        LLM_TOKENS.inc(len(words), purpose=purpose, kind="completion")
+
+
+def create_llm(provider: str, model_name: str, api_key: Optional[str] = None) -> BaseLLM:
+    """Builds the configured provider. The fake provider reads its knobs from FAKE_LLM_* env vars."""
+    if provider == "gemini":
+        return GeminiLLM(model_name=model_name, api_key=api_key)
+    if provider == "fake":
+        seed = os.getenv("FAKE_LLM_SEED")
+        return FakeLLM(
+            latency_ms=float(os.getenv("FAKE_LLM_LATENCY_MS", "300")),
+            tokens_per_second=float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "100")),
+            error_rate=float(os.getenv("FAKE_LLM_ERROR_RATE", "0")),
+            answer_tokens=int(os.getenv("FAKE_LLM_ANSWER_TOKENS", "80")),
+            seed=int(seed) if seed else None
+        )
+    raise ValueError(f"Unknown LLM provider '{provider}' (expected one of {', '.join(LLM_PROVIDERS)})")
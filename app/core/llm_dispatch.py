@@ -0,0 +1,387 @@
+import json
+import time
+import heapq
+import random
+import asyncio
+import hashlib
+import threading
+import concurrent.futures
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from app.core.llm import BaseLLM
+from app.core.context import estimate_tokens
+from app.core.metrics import observe_stage, REGISTRY
+
+# Lower runs first. Purposes without an entry get PRIORITY_DEFAULT.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BACKGROUND = 10
+PURPOSE_PRIORITY = {
+    "rag": PRIORITY_INTERACTIVE,
+    "quiz": PRIORITY_DEFAULT,
+    "quiz_refill": PRIORITY_BACKGROUND,
+}
+
+RETRYABLE_CODES = (408, 429, 500, 502, 503, 504)
+_RETRYABLE_MARKERS = ("RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "429", "503", "timed out")
+
+LLM_RETRIES = REGISTRY.counter("llm_retries_total", "LLM calls retried after a retryable error, by reason.")
+
+
+def _error_code(error: BaseException) -> Optional[int]:
+    for attribute in ("code", "status_code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Rate limits, overload and transient transport errors; bad requests are not retried."""
+    code = _error_code(error)
+    if code is not None:
+        return code in RETRYABLE_CODES
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    message = str(error)
+    return any(marker in message for marker in _RETRYABLE_MARKERS)
+
+
+class TokenBucket:
+    """Continuously refilling budget of `per_minute` units (0 = unlimited)."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.per_minute, self.level + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until amount is available (amount is capped at the bucket size)."""
+        if self.per_minute <= 0:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.per_minute) - self.level
+        return max(missing, 0.0) * 60.0 / self.per_minute
+
+    def take(self, amount: float, now: float):
+        if self.per_minute > 0:
+            self._refill(now)
+            self.level -= min(amount, self.per_minute)
+
+
+class LLMDispatcher:
+    """
+    Single entry point for LLM calls, running on one event loop:
+
+    - single-flight: identical in-flight prompts (same purpose, prompt and config) share one call;
+    - budget: requests/tokens per minute via token buckets, plus an optional concurrency cap;
+    - priority: waiting calls are admitted lowest priority value first (interactive RAG answers
+      ahead of quiz generation, background quiz-bank refills last), FIFO within a priority;
+    - retries: retryable errors (429, 5xx, timeouts) back off exponentially with jitter, and a
+      429 pauses all admissions for the backoff so a class-wide spike does not keep hammering.
+
+    Sync callers (worker threads) are marshalled onto the loop, so they share the same budget.
+    They wait at most sync_timeout_seconds, and close() (at shutdown) fails every pending call,
+    so no thread is left blocked on a loop that has stopped.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0, max_concurrency: int = 0,
+                 max_retries: int = 3, retry_base_seconds: float = 0.5, retry_max_seconds: float = 20.0,
+                 expected_output_tokens: int = 256, coalesce: bool = True,
+                 loop: Optional[asyncio.AbstractEventLoop] = None, sync_timeout_seconds: float = 300.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.expected_output_tokens = expected_output_tokens
+        self.coalesce = coalesce
+        self.sync_timeout_seconds = sync_timeout_seconds
+
+        self._loop = loop
+        self._closed = False
+        self._external: "set[concurrent.futures.Future]" = set()  # calls submitted from other threads/loops
+        self._loop_lock = threading.Lock()
+        self._waiting: List[Tuple[int, int, float, asyncio.Future]] = []  # (priority, seq, tokens, grant)
+        self._seq = 0
+        self._running = 0
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._backoffs: "set[asyncio.Future]" = set()  # retries sleeping until their next attempt
+
+        self.calls = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.admitted = 0
+
+    # --- loop handling ---
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """The bound loop; outside the app (scripts) a private loop thread is started on first use."""
+        with self._loop_lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-dispatch", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _on_loop(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def _submit(self, coro: Awaitable[Any], loop: asyncio.AbstractEventLoop) -> concurrent.futures.Future:
+        """Schedules coro on the dispatcher loop from another thread; close() can cancel it."""
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        with self._loop_lock:
+            self._external.add(future)
+        future.add_done_callback(self._external.discard)
+        return future
+
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError("LLM dispatcher is closed")
+
+    def close(self):
+        """Fails queued, backing-off and cross-thread calls, cancels in-flight ones; later calls raise. Idempotent."""
+        if self._closed:
+            return
+        self._closed = True
+        with self._loop_lock:
+            external, self._external = list(self._external), set()
+        for future in external:
+            future.cancel()  # unblocks call_sync() even if the loop never runs again
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        if self._on_loop():
+            self._fail_pending()
+        elif loop.is_running():
+            loop.call_soon_threadsafe(self._fail_pending)
+
+    def _fail_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        waiting, self._waiting = self._waiting, []
+        for _, _, _, grant in waiting:
+            if not grant.done():
+                grant.set_exception(RuntimeError("LLM dispatcher is closed"))
+        for wake in list(self._backoffs):
+            if not wake.done():
+                wake.set_exception(RuntimeError("LLM dispatcher is closed"))
+        for task in list(self._inflight.values()):
+            task.cancel()
+
+    # --- public API ---
+    async def call(self, make_call: Callable[[], Awaitable[str]], key: Optional[str] = None,
+                   priority: int = PRIORITY_DEFAULT, tokens: int = 0) -> str:
+        """Runs make_call() under the budget with retries; callers with the same key share the result."""
+        self._check_open()
+        loop = self._get_loop()
+        if not self._on_loop():
+            return await asyncio.wrap_future(self._submit(self.call(make_call, key, priority, tokens), loop))
+
+        if self.coalesce and key is not None:
+            # The shared call is its own task: a caller that goes away does not cancel it for the others
+            task = self._inflight.get(key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = loop.create_task(self._call_with_retries(make_call, priority, tokens))
+                self._inflight[key] = task
+                task.add_done_callback(lambda done, k=key: self._forget(k, done))
+            return await asyncio.shield(task)
+        return await self._call_with_retries(make_call, priority, tokens)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter was cancelled
+
+    def call_sync(self, make_call: Callable[[], Awaitable[str]], key: Optional[str] = None,
+                  priority: int = PRIORITY_DEFAULT, tokens: int = 0, timeout: Optional[float] = None) -> str:
+        """
+        Blocking call() for worker threads (waits at most timeout, default sync_timeout_seconds).
+        Must not be used from the dispatcher loop itself.
+        """
+        self._check_open()
+        loop = self._get_loop()
+        if self._on_loop():
+            raise RuntimeError("LLMDispatcher.call_sync() called from the dispatcher's event loop")
+        future = self._submit(self.call(make_call, key, priority, tokens), loop)
+        try:
+            return future.result(timeout=self.sync_timeout_seconds if timeout is None else timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError("LLM call did not finish in time")
+        except concurrent.futures.CancelledError:
+            raise RuntimeError("LLM dispatcher is closed")
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_DEFAULT, tokens: int = 0):
+        """Admission under the budget for a call the caller makes itself (streams: no coalescing or retry)."""
+        self._check_open()
+        loop = self._get_loop()
+        if not self._on_loop():
+            await asyncio.wrap_future(self._submit(self._acquire(priority, tokens), loop))
+            try:
+                yield
+            finally:
+                loop.call_soon_threadsafe(self._release)
+            return
+        await self._acquire(priority, tokens)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._waiting),
+            "in_flight": self._running,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "failures": self.failures,
+            "wait_seconds_avg": round(self.wait_seconds_total / self.admitted, 4) if self.admitted else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 4),
+            "paused_seconds_left": round(max(0.0, self._paused_until - time.monotonic()), 3),
+        }
+
+    # --- retries ---
+    async def _call_with_retries(self, make_call: Callable[[], Awaitable[str]], priority: int, tokens: int) -> str:
+        self.calls += 1
+        attempt = 0
+        while True:
+            await self._acquire(priority, tokens)
+            try:
+                return await make_call()
+            except Exception as e:
+                code = _error_code(e)
+                if code == 429 or "RESOURCE_EXHAUSTED" in str(e):
+                    self.rate_limited += 1
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self.failures += 1
+                    raise
+                delay = min(self.retry_max_seconds, self.retry_base_seconds * (2 ** attempt))
+                delay *= random.uniform(0.5, 1.5)  # jitter spreads out the retries of a spike
+                if code == 429 or "RESOURCE_EXHAUSTED" in str(e):
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                attempt += 1
+                self.retries += 1
+                LLM_RETRIES.inc(reason=str(code) if code else type(e).__name__)
+                print(f"--- LLMDispatcher: Retry {attempt}/{self.max_retries} in {delay:.2f}s after: {e}")
+            finally:
+                self._release()
+            await self._backoff(delay)
+
+    async def _backoff(self, delay: float):
+        """Sleeps before a retry; close() ends the sleep with an error instead of letting it retry."""
+        self._check_open()
+        loop = asyncio.get_running_loop()
+        wake = loop.create_future()
+        handle = loop.call_later(delay, lambda: wake.done() or wake.set_result(None))
+        self._backoffs.add(wake)
+        try:
+            await wake
+        finally:
+            handle.cancel()
+            self._backoffs.discard(wake)
+
+    # --- admission ---
+    async def _acquire(self, priority: int, tokens: int):
+        self._check_open()  # nothing is admitted after close()
+        loop = asyncio.get_running_loop()
+        grant = loop.create_future()
+        self._seq += 1
+        heapq.heappush(self._waiting, (priority, self._seq, float(tokens), grant))
+        started = time.perf_counter()
+        self._pump()
+        try:
+            await grant
+        except asyncio.CancelledError:
+            if grant.done() and not grant.cancelled():
+                self._release()  # granted just before the cancel: hand the slot back
+            else:
+                self._waiting = [entry for entry in self._waiting if entry[3] is not grant]
+                heapq.heapify(self._waiting)
+            raise
+        waited = time.perf_counter() - started
+        self.admitted += 1
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        observe_stage("llm_queue_wait", waited)
+
+    def _release(self):
+        self._running -= 1
+        self._pump()
+
+    def _pump(self):
+        """Admits waiters in priority order while the budget allows; otherwise re-checks when it will."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiting:
+            priority, seq, tokens, grant = self._waiting[0]
+            if grant.done():  # cancelled waiter
+                heapq.heappop(self._waiting)
+                continue
+            if self.max_concurrency and self._running >= self.max_concurrency:
+                return  # _release() pumps again
+            now = time.monotonic()
+            delay = max(self._paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._pump)
+                return
+            heapq.heappop(self._waiting)
+            self.requests.take(1, now)
+            self.tokens.take(tokens, now)
+            self._running += 1
+            grant.set_result(None)
+
+
+class DispatchingLLM(BaseLLM):
+    """Provider wrapper that sends every call of the inner provider through an LLMDispatcher."""
+
+    def __init__(self, inner: BaseLLM, dispatcher: LLMDispatcher):
+        super().__init__()
+        self.inner = inner
+        self.dispatcher = dispatcher
+        self.model_name = inner.model_name
+
+    def _plan(self, prompt: str, config: Optional[Dict[str, Any]], purpose: str) -> Tuple[str, int, int]:
+        """(coalescing key, priority, token estimate) of one call."""
+        digest = hashlib.sha1()
+        digest.update(json.dumps([self.model_name, purpose, config], sort_keys=True, default=str).encode("utf-8"))
+        digest.update(prompt.encode("utf-8"))
+        tokens = estimate_tokens(prompt) + self.dispatcher.expected_output_tokens
+        return digest.hexdigest(), PURPOSE_PRIORITY.get(purpose, PRIORITY_DEFAULT), tokens
+
+    def generate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        key, priority, tokens = self._plan(prompt, config, purpose)
+        return self.dispatcher.call_sync(lambda: self.inner.agenerate_text(prompt, config, purpose),
+                                         key=key, priority=priority, tokens=tokens)
+
+    async def agenerate_text(self, prompt: str, config: Optional[Dict[str, Any]] = None, purpose: str = "rag") -> str:
+        key, priority, tokens = self._plan(prompt, config, purpose)
+        return await self.dispatcher.call(lambda: self.inner.agenerate_text(prompt, config, purpose),
+                                          key=key, priority=priority, tokens=tokens)
+
+    async def astream_text(self, prompt: str, config: Optional[Dict[str, Any]] = None,
+                           purpose: str = "rag") -> AsyncIterator[str]:
+        _, priority, tokens = self._plan(prompt, config, purpose)
+        async with self.dispatcher.slot(priority, tokens):
+            async for piece in self.inner.astream_text(prompt, config, purpose):
+                yield piece
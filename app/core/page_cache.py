@@ -0,0 +1,103 @@
+import os
+import gzip
+import json
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+from app.core.startup import timed_import
+
+# Bump when the extraction itself changes (loader, page metadata); old entries then miss
+PAGE_CACHE_FORMAT = 1
+# Set again from the path the bytes are loaded from, since the same file may be renamed
+_PATH_KEYS = ("source", "source_file")
+
+
+def _extractor_version() -> str:
+    return f"{PAGE_CACHE_FORMAT}:pypdf-{timed_import('pypdf').__version__}"
+
+
+class PageTextCache:
+    """
+    Extracted page text and metadata of PDFs, keyed by the SHA-256 of the file bytes, so an
+    unchanged file is never parsed twice (rebuilds, re-chunking experiments, re-uploads).
+
+    One gzipped JSONL file per PDF (<sha256>.jsonl.gz): a header line with the extractor
+    version and page count, then one {"text", "metadata"} line per page. Entries written by
+    another pypdf version are ignored. Writes are atomic (tmp + replace), so concurrent
+    writers of the same file just write it twice.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.extractor = _extractor_version()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, f"{file_hash}.jsonl.gz")
+
+    def get(self, file_hash: str, pdf_path: str) -> Optional[List[Any]]:
+        """Page documents for these bytes, tagged with pdf_path as their source; None on a miss."""
+        try:
+            with gzip.open(self._path(file_hash), "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if header.get("extractor") != self.extractor:
+                    self._count(hit=False)
+                    return None
+                rows = [json.loads(line) for line in f]
+        except (OSError, EOFError, ValueError):
+            self._count(hit=False)  # missing, or cut short by a crash mid-write
+            return None
+        if len(rows) != header.get("pages"):
+            self._count(hit=False)
+            return None
+
+        Document = timed_import("langchain_core.documents").Document
+        pdf_file = Path(pdf_path)
+        documents = []
+        for row in rows:
+            metadata = dict(row["metadata"], source=str(pdf_file), source_file=pdf_file.name)
+            documents.append(Document(page_content=row["text"], metadata=metadata))
+        self._count(hit=True)
+        return documents
+
+    def put(self, file_hash: str, documents: List[Any]):
+        path = self._path(file_hash)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=1) as f:
+            f.write(json.dumps({"extractor": self.extractor, "pages": len(documents)}) + "\n")
+            for doc in documents:
+                metadata = {k: v for k, v in doc.metadata.items() if k not in _PATH_KEYS}
+                f.write(json.dumps({"text": doc.page_content, "metadata": metadata}) + "\n")
+        os.replace(tmp_path, path)
+
+    def prune(self, keep_hashes: Set[str]) -> int:
+        """Deletes entries of files that are no longer present. Returns the number removed."""
+        removed = 0
+        for path in Path(self.cache_dir).glob("*.jsonl.gz"):
+            if path.name[:-len(".jsonl.gz")] not in keep_hashes:
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        entries = list(Path(self.cache_dir).glob("*.jsonl.gz"))
+        return {"entries": len(entries), "bytes": sum(p.stat().st_size for p in entries),
+                "hits": self.hits, "misses": self.misses}
+
+
+def create_page_cache() -> Optional[PageTextCache]:
+    """Builds the cache from PAGE_CACHE_DIR. PAGE_CACHE_DIR='' disables it."""
+    cache_dir = os.getenv("PAGE_CACHE_DIR", "data/page_cache")
+    if not cache_dir:
+        return None
+    return PageTextCache(cache_dir)
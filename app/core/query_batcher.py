@@ -0,0 +1,99 @@
+import time
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+import numpy as np
+
+
+class QueryEmbeddingBatcher:
+    """
+    Coalesces single-query embedding requests from concurrent callers into one model batch.
+
+    Callers block in embed(); a background thread takes the first waiting query, keeps
+    collecting for at most max_wait_ms (or until max_batch_size queries are waiting) and
+    encodes them together. Recently seen query strings are served from an in-memory LRU.
+    Every caller gets its own copy of the vector, so changing it cannot touch the cache.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, cache_size: int = 1024):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self.batches = 0
+        self.batched_queries = 0
+        self.cache_hits = 0
+        self._worker = threading.Thread(target=self._run, name="query-embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def embed(self, query: str) -> np.ndarray:
+        """Returns the embedding for one query string, batched with any concurrent callers."""
+        with self._cache_lock:
+            cached = self._cache.get(query)
+            if cached is not None:
+                self._cache.move_to_end(query)
+                self.cache_hits += 1
+                return cached.copy()
+
+        future: Future = Future()
+        self._queue.put((query, future))
+        return future.result()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Take whatever is already queued without waiting any longer
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            unique_queries = list(dict.fromkeys(query for query, _ in batch))
+            try:
+                embeddings = np.array(self.encode_fn(unique_queries), dtype=np.float32)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            embeddings.flags.writeable = False  # cached rows stay read-only; callers get copies
+            by_query = dict(zip(unique_queries, embeddings))
+            self._remember(by_query, len(batch))
+            for query, future in batch:
+                future.set_result(by_query[query].copy())
+
+    def _remember(self, by_query, batch_size: int):
+        with self._cache_lock:
+            self.batches += 1
+            self.batched_queries += batch_size
+            if self.cache_size <= 0:
+                return
+            for query, embedding in by_query.items():
+                self._cache[query] = embedding
+                self._cache.move_to_end(query)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def stats(self):
+        with self._cache_lock:
+            average = self.batched_queries / self.batches if self.batches else 0.0
+            return {"batches": self.batches, "queries": self.batched_queries, "avg_batch_size": round(average, 2),
+                    "cache_hits": self.cache_hits, "cache_entries": len(self._cache)}
@@ -0,0 +1,215 @@
+import os
+import json
+import random
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional
+from app.core.filelock import file_lock, tmp_path_for
+from app.core.quiz_gen import QuizGenerator, validate_mcq
+from app.core.answer_cache import normalize_query
+from app.core.subjects import build_filter, normalize_subject
+
+MCQ_FIELDS = ("question", "options", "correct_answer", "explanation")
+
+
+class QuizBank:
+    """
+    Persistent per-topic banks of pre-generated MCQs. A topic asked within one subject has its
+    own bank, generated from that subject's chunks only.
+
+    Requests are served from the bank (random sample, no repeats within a request,
+    least-served questions first). A question is retired after max_serves deliveries; when
+    a topic has fewer than low_watermark questions left, a background worker refills it up
+    to target_size by generating from the topic's top retrieved chunks in rotation.
+
+    Banks are shared by all workers through their files: a bank is re-read when its file
+    changed, and every read-modify-write holds the bank's lock and lock file, so topics never
+    wait on each other's file I/O.
+    """
+
+    def __init__(self, quiz_generator: QuizGenerator, bank_directory: str = "data/quiz_bank",
+                 target_size: int = 30, low_watermark: int = 10, max_serves: int = 3,
+                 questions_per_chunk: int = 5, context_chunks: int = 5):
+        self.quiz_generator = quiz_generator
+        self.bank_directory = bank_directory
+        self.target_size = target_size
+        self.low_watermark = low_watermark
+        self.max_serves = max_serves
+        self.questions_per_chunk = questions_per_chunk
+        self.context_chunks = context_chunks
+        self._topics: Dict[str, Dict[str, Any]] = {}
+        self._mtimes: Dict[str, Optional[int]] = {}  # bank file mtime when _topics was last read/written
+        self._lock = threading.Lock()  # guards the dicts above and _topic_locks, never held across I/O
+        self._topic_locks: Dict[str, threading.Lock] = {}
+        self._refilling = set()
+        self._refill_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="quiz-bank-refill")
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        os.makedirs(self.bank_directory, exist_ok=True)
+
+    @staticmethod
+    def _topic_key(topic: str, subject: Optional[str] = None) -> str:
+        topic_key = normalize_query(topic)
+        return f"{topic_key} @{normalize_subject(subject)}" if subject else topic_key
+
+    # --- storage ---
+    def _path(self, topic_key: str) -> str:
+        return os.path.join(self.bank_directory, hashlib.sha1(topic_key.encode("utf-8")).hexdigest()[:16] + ".json")
+
+    @staticmethod
+    def _mtime(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _get_topic(self, topic_key: str) -> Dict[str, Any]:
+        """The bank for topic_key, re-read if another worker changed its file. Call with the topic's lock held."""
+        path = self._path(topic_key)
+        mtime = self._mtime(path)
+        bank = self._topics.get(topic_key)
+        if bank is not None and mtime == self._mtimes.get(topic_key):
+            return bank
+        bank = {"topic": topic_key, "questions": [], "next_chunk": 0}
+        if mtime is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    bank = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"--- QuizBank: Could not read bank for '{topic_key}', starting empty: {e}")
+        with self._lock:
+            self._topics[topic_key] = bank
+            self._mtimes[topic_key] = mtime
+        return bank
+
+    def _topic_lock(self, topic_key: str) -> threading.Lock:
+        with self._lock:
+            return self._topic_locks.setdefault(topic_key, threading.Lock())
+
+    @contextmanager
+    def _locked(self, topic_key: str) -> Iterator[Dict[str, Any]]:
+        """The up-to-date bank, locked against other threads and worker processes until the block ends."""
+        with self._topic_lock(topic_key), file_lock(self._path(topic_key)[:-len(".json")] + ".lock"):
+            yield self._get_topic(topic_key)
+
+    def _save(self, bank: Dict[str, Any]):
+        path = self._path(bank["topic"])
+        tmp_path = tmp_path_for(path)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(bank, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        mtime = self._mtime(path)
+        with self._lock:
+            self._mtimes[bank["topic"]] = mtime
+
+    # --- serving ---
+    def take(self, topic: str, num_questions: int, subject: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """Returns num_questions distinct questions from the bank, or None on a bank miss."""
+        topic_key = self._topic_key(topic, subject)
+        with self._locked(topic_key) as bank:
+            questions = bank["questions"]
+            if len(questions) < num_questions:
+                with self._lock:
+                    self.misses += 1
+                return None
+
+            # Random order, then least-served first: fresh questions win, ties are shuffled
+            pool = random.sample(questions, len(questions))
+            pool.sort(key=lambda q: q.get("served", 0))
+            chosen = pool[:num_questions]
+            for question in chosen:
+                question["served"] = question.get("served", 0) + 1
+            bank["questions"] = [q for q in questions if q.get("served", 0) < self.max_serves]
+            self._save(bank)
+            with self._lock:
+                self.hits += 1
+            return [self._public(q) for q in chosen]
+
+    def add(self, topic: str, questions: List[Dict[str, Any]], source_id: Optional[str] = None,
+            served: int = 0, subject: Optional[str] = None) -> int:
+        """Validates and stores questions (deduplicated by question text). Returns how many were new."""
+        topic_key = self._topic_key(topic, subject)
+        added = 0
+        with self._locked(topic_key) as bank:
+            known = {q["id"] for q in bank["questions"]}
+            for item in questions:
+                if not validate_mcq(item):
+                    continue
+                question_id = hashlib.sha1(item["question"].strip().encode("utf-8")).hexdigest()[:16]
+                if question_id in known:
+                    continue
+                entry = self._public(item)
+                entry.update({"id": question_id, "source_id": source_id, "served": served})
+                if served < self.max_serves:
+                    bank["questions"].append(entry)
+                known.add(question_id)
+                added += 1
+            self._save(bank)
+        return added
+
+    def needs_refill(self, topic: str, subject: Optional[str] = None) -> bool:
+        topic_key = self._topic_key(topic, subject)
+        with self._topic_lock(topic_key):
+            return len(self._get_topic(topic_key)["questions"]) < self.low_watermark
+
+    # --- background generation ---
+    def schedule_refill(self, topic: str, subject: Optional[str] = None):
+        """Queues a background refill for the topic unless one is already pending."""
+        topic_key = self._topic_key(topic, subject)
+        with self._lock:
+            if topic_key in self._refilling:
+                return
+            self._refilling.add(topic_key)
+        self._refill_executor.submit(self._refill, topic, subject)
+
+    def prefill(self, topics: List[str]):
+        for topic in topics:
+            if topic.strip() and self.needs_refill(topic):
+                self.schedule_refill(topic.strip())
+
+    def _refill(self, topic: str, subject: Optional[str] = None):
+        topic_key = self._topic_key(topic, subject)
+        try:
+            chunks = self.quiz_generator.retriever.retrieve(topic, top_k=self.context_chunks,
+                                                            where=build_filter(subjects=[subject] if subject else None))
+            if not chunks:
+                print(f"--- QuizBank: No context found for topic '{topic}', nothing to refill.")
+                return
+            for _ in range(len(chunks)):
+                with self._locked(topic_key) as bank:
+                    if len(bank["questions"]) >= self.target_size:
+                        break
+                    chunk = chunks[bank["next_chunk"] % len(chunks)]
+                    bank["next_chunk"] = bank["next_chunk"] + 1
+                    self._save(bank)
+                generated = self.quiz_generator.generate_quiz_from_context(chunk['content'], self.questions_per_chunk,
+                                                                            purpose="quiz_refill")
+                added = self.add(topic, generated, source_id=chunk.get('id'), subject=subject)
+                print(f"--- QuizBank: Added {added} question(s) to '{topic_key}' from chunk {chunk.get('id')}")
+            self.refills += 1
+        except Exception as e:
+            print(f"--- QuizBank: Refill for '{topic_key}' failed: {e}")
+        finally:
+            with self._lock:
+                self._refilling.discard(topic_key)
+
+    @staticmethod
+    def _public(question: Dict[str, Any]) -> Dict[str, Any]:
+        return {field: question[field] for field in MCQ_FIELDS if field in question}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "topics_loaded": len(self._topics),
+                "questions_loaded": sum(len(b["questions"]) for b in self._topics.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refills": self.refills,
+                "refills_pending": len(self._refilling),
+            }
+
+    def shutdown(self):
+        self._refill_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,14 +1,24 @@
 import json
 import re
-from typing import List, Dict, Any
-from app.core.rag import RAGRetriever, GeminiLLM
+from typing import List, Dict, Any, Optional
+from app.core.rag import RAGRetriever
+from app.core.llm import BaseLLM
+from app.core.concurrency import run_blocking, stage_limit, STAGE_EMBED_SEARCH, STAGE_LLM
+from app.core.metrics import timed, LLM_CALLS
+
+MCQ_OPTION_KEYS = ("A", "B", "C", "D")
+
+QUIZ_GENERATION_CONFIG = {
+    "temperature": 0.4,
+    "response_mime_type": "application/json"
+}
 
 
 class QuizGenerator:
     """
-    Generates MCQs using a RAGRetriever and GeminiLLM.
+    Generates MCQs using a RAGRetriever and an LLM provider (Gemini, or the fake one for load tests).
     """
-    def __init__(self, retriever: RAGRetriever, llm: GeminiLLM):
+    def __init__(self, retriever: RAGRetriever, llm: BaseLLM):
         self.retriever = retriever
         self.llm = llm
         print("--- QuizGenerator Initialized ---")
@@ -48,37 +58,80 @@ Avoid questions that can be answered by simply spotting words in the text.
                     return None
             return None
 
-    def generate_quiz_json(self, topic: str, num_questions: int = 5) -> List[Dict[str, Any]]:
+    def _parse_quiz_response(self, response_text: str) -> List[Dict[str, Any]]:
+        response_text = response_text.strip()
+        with timed("quiz_parse"):
+            mcq_list = self._extract_json(response_text)
+        if mcq_list and isinstance(mcq_list, list):
+            print(f"--- Successfully generated {len(mcq_list)} questions.")
+            return mcq_list
+        print(f"--- Failed to parse JSON. LLM output:\n{response_text}")
+        return []
+
+    def generate_quiz_from_context(self, context: str, num_questions: int = 5,
+                                   purpose: str = "quiz") -> List[Dict[str, Any]]:
+        """Generates MCQs for an already retrieved context chunk (blocking LLM call)."""
+        prompt = self._create_prompt(context, num_questions)
+
+        try:
+            with timed("quiz_llm"):
+                response_text = self.llm.generate_text(prompt, QUIZ_GENERATION_CONFIG, purpose=purpose)
+            LLM_CALLS.inc(purpose=purpose, outcome="ok")
+            return self._parse_quiz_response(response_text)
+
+        except Exception as e:
+            LLM_CALLS.inc(purpose=purpose, outcome="error")
+            print(f"--- Error generating quiz: {e}")
+            return []
+
+    def generate_quiz_json(self, topic: str, num_questions: int = 5,
+                           where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
         print(f"\n--- QuizGenerator: Generating {num_questions} question(s) for topic: '{topic}'")
 
         # Retrieve a single document
-        retrieved_docs = self.retriever.retrieve(topic, top_k=1)
+        retrieved_docs = self.retriever.retrieve(topic, top_k=1, where=where)
         if not retrieved_docs:
             print(f"--- No context found for topic '{topic}'")
             return []
 
-        context = retrieved_docs[0]['content']
-        prompt = self._create_prompt(context, num_questions)
+        return self.generate_quiz_from_context(retrieved_docs[0]['content'], num_questions)
+
+    async def agenerate_quiz_json(self, topic: str, num_questions: int = 5,
+                                  where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Non-blocking generate_quiz_json: retrieval on the executor, the LLM via its async primitive."""
+        print(f"\n--- QuizGenerator: Generating {num_questions} question(s) for topic: '{topic}'")
+
+        retrieved_docs = await run_blocking(STAGE_EMBED_SEARCH, self.retriever.retrieve, topic, 1, "dense", where)
+        if not retrieved_docs:
+            print(f"--- No context found for topic '{topic}'")
+            return []
+
+        prompt = self._create_prompt(retrieved_docs[0]['content'], num_questions)
 
         try:
-            # Use Gemini client
-            response = self.llm.client.models.generate_content(
-                model=self.llm.model_name,
-                contents=prompt,
-                config={
-                    "temperature": 0.4,
-                    "response_mime_type": "application/json"
-                }
-            )
-            response_text = response.text.strip()
-            mcq_list = self._extract_json(response_text)
-            if mcq_list and isinstance(mcq_list, list):
-                print(f"--- Successfully generated {len(mcq_list)} questions.")
-                return mcq_list
-            else:
-                print(f"--- Failed to parse JSON. LLM output:\n{response_text}")
-                return []
+            async with stage_limit(STAGE_LLM):
+                with timed("quiz_llm"):
+                    response_text = await self.llm.agenerate_text(prompt, QUIZ_GENERATION_CONFIG, purpose="quiz")
+            LLM_CALLS.inc(purpose="quiz", outcome="ok")
+            return self._parse_quiz_response(response_text)
 
         except Exception as e:
+            LLM_CALLS.inc(purpose="quiz", outcome="error")
             print(f"--- Error generating quiz: {e}")
-            return []
\ No newline at end of file
+            return []
+
+
+def validate_mcq(item: Any) -> bool:
+    """Checks one generated question against the schema the prompt asks for."""
+    if not isinstance(item, dict):
+        return False
+    options = item.get("options")
+    if not isinstance(item.get("question"), str) or not item["question"].strip():
+        return False
+    if not isinstance(options, dict) or set(options.keys()) != set(MCQ_OPTION_KEYS):
+        return False
+    if not all(isinstance(text, str) and text.strip() for text in options.values()):
+        return False
+    if item.get("correct_answer") not in MCQ_OPTION_KEYS:
+        return False
+    return isinstance(item.get("explanation"), str)
@@ -1,22 +1,37 @@
 import os
+import json
+import asyncio
 import numpy as np
 import uuid
-from typing import List, Dict, Any
-from sentence_transformers import SentenceTransformer
-import chromadb
-import google.genai as genai
-from langchain.prompts import PromptTemplate
+from typing import List, Dict, Any, Optional, AsyncIterator, Set, Tuple
+from app.core.embedding_cache import EmbeddingCache
+from app.core.query_batcher import QueryEmbeddingBatcher
+from app.core.answer_cache import AnswerCache
+from app.core.lexical import BM25Index, reciprocal_rank_fusion
+from app.core.context import ContextPacker, CONTEXT_SEPARATOR
+from app.core.metrics import timed
+from app.core.startup import timed_import
+from app.core.llm import BaseLLM
+from app.core.vector_backends import VectorBackend, create_vector_backend
+from app.core.subjects import SubjectRouter, build_filter, matches_filter
+from app.core.concurrency import run_blocking, stage_limit, STAGE_EMBED_SEARCH, STAGE_LLM
+from app.core.filelock import file_lock
 
 # --- 1. Embedding Manager (from your code) ---
 class EmbeddingManager:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, cache: Optional[EmbeddingCache] = None):
         self.model_name = model_name
         self.model = None
+        # Optional disk cache keyed by text hash; unchanged chunks never reach the model again
+        self.cache = cache
+        self.query_batcher: Optional[QueryEmbeddingBatcher] = None
         self._load_model()
 
     def _load_model(self):
         try:
             print(f"--- EmbeddingManager: Loading model: {self.model_name}")
+            # Imported here: sentence-transformers pulls in torch, the slowest import of the app
+            SentenceTransformer = timed_import("sentence_transformers").SentenceTransformer
             self.model = SentenceTransformer(self.model_name)
             dim = self.model.get_sentence_embedding_dimension()
             print(f"--- EmbeddingManager: Model loaded. Dim: {dim}")
@@ -24,172 +39,642 @@ class EmbeddingManager:
             print(f"--- EmbeddingManager: Error loading model {self.model_name}: {e}")
             raise
 
-    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+    def generate_embeddings(self, texts: List[str], use_cache: bool = True) -> np.ndarray:
+        """
+        Embeds texts. use_cache=False bypasses the persistent cache: it is meant for chunks, and
+        one-off query strings would evict chunk embeddings that make re-ingestion cheap.
+        """
         if not self.model:
             raise ValueError("Model not loaded")
-        # Print is removed for cleaner API output, but kept for init
-        embeddings = self.model.encode(texts)
-        return embeddings
+        if self.cache is None or not use_cache or not texts:
+            # Print is removed for cleaner API output, but kept for init
+            with timed("embed_model"):
+                return self.model.encode(texts)
+
+        cached = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            # Encode each distinct missing text once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            with timed("embed_model"):
+                encoded = np.asarray(self.model.encode(unique_texts), dtype=np.float32)
+            self.cache.put_many(unique_texts, encoded)
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                cached[i] = by_text[texts[i]]
+        return np.vstack(cached).astype(np.float32, copy=False)
+
+    def warm_up(self):
+        """Dummy encodes (single and batched) so the first real request doesn't pay for lazy kernel initialization."""
+        if not self.model:
+            raise ValueError("Model not loaded")
+        with timed("embed_warmup"):
+            self.model.encode(["warm-up"])
+            self.model.encode(["warm-up query"] * 8)
+
+    def enable_query_batching(self, max_batch_size: int = 32, max_wait_ms: float = 5.0, cache_size: int = 1024):
+        """Routes embed_query through a micro-batcher shared by all concurrent requests."""
+        self.query_batcher = QueryEmbeddingBatcher(
+            self.encode_queries,  # has its own in-memory LRU; queries stay out of the chunk cache
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            cache_size=cache_size
+        )
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embeds a single query string (batched with concurrent queries when enabled)."""
+        with timed("query_embed"):
+            if self.query_batcher is not None:
+                return self.query_batcher.embed(query)
+            return self.encode_queries([query])[0]
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embeds query strings without going through the persistent chunk cache."""
+        return self.generate_embeddings(queries, use_cache=False)
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
 
 # --- 2. Vector Store (from your code) ---
 class VectorStore:
-    def __init__(self, collection_name: str, persist_directory: str):
+    def __init__(self, collection_name: str, persist_directory: str, backend: str = "chroma",
+                 vector_dtype: str = "float32", quantization: str = "none", rerank_factor: int = 4):
         self.collection_name = collection_name
         self.persist_directory = persist_directory
-        self.client = None
-        self.collection = None
+        self.backend_name = backend
+        self.vector_dtype = vector_dtype
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        # Storage + search implementation (Chroma or the memory-mapped NumPy index)
+        self.backend: Optional[VectorBackend] = None
+        # Bumped on every write from this process; see get_version()
+        self._writes = 0
+        # BM25 index kept in step with the collection for lexical/hybrid retrieval. Other processes
+        # (workers' job queues, initialize_db.py) write it too: it is re-read when the pickle changes,
+        # and unsaved local writes are journaled so flush() can replay them onto a newer pickle.
+        self.lexical_index_path = os.path.join(persist_directory, "bm25_index.pkl")
+        self.lexical_index: Optional[BM25Index] = None
+        self._lexical_stamp: Optional[Tuple[int, int]] = None  # (mtime_ns, size) of the pickle we hold
+        self._lexical_journal: List[Tuple[str, tuple]] = []
+        # Filtered BM25 searches score only the ids matching the filter: (filter, version) -> id set
+        self._filter_ids: Dict[Tuple[str, str], Set[str]] = {}
         self._initialize_store()
 
     def _initialize_store(self):
         try:
             os.makedirs(self.persist_directory, exist_ok=True)
-            self.client = chromadb.PersistentClient(path=self.persist_directory)
-            self.collection = self.client.get_or_create_collection(
-                name=self.collection_name,
-                metadata={"description": "PDF document embeddings for RAG"}
-            )
-            print(f"--- VectorStore: Initialized. Collection: {self.collection_name}. Docs: {self.collection.count()}")
+            self.backend = create_vector_backend(self.backend_name, self.persist_directory, self.collection_name,
+                                                 vector_dtype=self.vector_dtype, quantization=self.quantization,
+                                                 rerank_factor=self.rerank_factor)
+            print(f"--- VectorStore: Initialized ({self.backend_name}). Collection: {self.collection_name}. "
+                  f"Docs: {self.backend.count()}")
         except Exception as e:
             print(f"--- VectorStore: Error initializing store: {e}")
             raise
+        self._load_lexical_index()
+
+    def _load_lexical_index(self, page_size: int = 1000):
+        """Loads the persisted BM25 index, rebuilding it from the collection if it is missing or stale."""
+        self.lexical_index = BM25Index.load(self.lexical_index_path)
+        self._lexical_stamp = _file_stamp(self.lexical_index_path)
+        count = self.backend.count()
+        if len(self.lexical_index) == count:
+            return
+        print(f"--- VectorStore: Building BM25 index for {count} documents")
+        self.lexical_index = BM25Index()
+        for offset in range(0, count, page_size):
+            page = self.backend.get(limit=page_size, offset=offset)
+            self.lexical_index.add(page['ids'], page['documents'])
+        with file_lock(self.lexical_index_path + ".lock"):
+            self.lexical_index.save(self.lexical_index_path)
+            self._lexical_stamp = _file_stamp(self.lexical_index_path)
+
+    def _maybe_reload_lexical(self):
+        """Picks up a BM25 pickle saved by another process, unless this one has unsaved writes."""
+        if self.lexical_index.dirty:
+            return
+        stamp = _file_stamp(self.lexical_index_path)
+        if stamp is not None and stamp != self._lexical_stamp:
+            self.lexical_index = BM25Index.load(self.lexical_index_path)
+            self._lexical_stamp = stamp
+            self._lexical_journal = []
+
+    def _lexical_write(self, method: str, *args):
+        self._maybe_reload_lexical()
+        self._lexical_journal.append((method, args))
+        getattr(self.lexical_index, method)(*args)
 
     def add_documents(self, documents: List[Any], embeddings: np.ndarray):
         if len(documents) != len(embeddings):
             raise ValueError("Number of documents must match number of embeddings")
         
         # ... (Your document preparation logic remains the same) ...
-        ids, metadatas, documents_text, embeddings_list = [], [], [], []
-        for i, (doc, embedding) in enumerate(zip(documents, embeddings)):
+        ids, metadatas, documents_text = [], [], []
+        for i, doc in enumerate(documents):
             doc_id = f"doc_{uuid.uuid4().hex[:8]}_{i}"
             ids.append(doc_id)
             metadata = dict(doc.metadata)
             metadata['doc_index'] = i
             metadatas.append(metadata)
             documents_text.append(doc.page_content)
-            embeddings_list.append(embedding.tolist())
         
         try:
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings_list,
-                metadatas=metadatas,
-                documents=documents_text
-            )
-            print(f"--- VectorStore: Successfully added {len(documents)} documents. Total: {self.collection.count()}")
+            self.backend.add(ids, embeddings, metadatas, documents_text)
+            self._writes += 1
+            self._lexical_write("add", ids, documents_text)
+            print(f"--- VectorStore: Successfully added {len(documents)} documents. Total: {self.backend.count()}")
         except Exception as e:
             print(f"--- VectorStore: Error adding documents: {e}")
             raise
 
+    def upsert_documents(self, documents: List[Any], embeddings: np.ndarray, ids: List[str]):
+        """Inserts or overwrites documents under caller-supplied (stable) ids."""
+        if not (len(documents) == len(embeddings) == len(ids)):
+            raise ValueError("Number of documents, embeddings and ids must match")
+        if not ids:
+            return
+
+        metadatas = []
+        for i, doc in enumerate(documents):
+            metadata = dict(doc.metadata)
+            metadata['doc_index'] = i
+            metadatas.append(metadata)
+
+        try:
+            self.backend.upsert(list(ids), embeddings, metadatas, [doc.page_content for doc in documents])
+            self._writes += 1
+            self._lexical_write("add", list(ids), [doc.page_content for doc in documents])
+            print(f"--- VectorStore: Upserted {len(ids)} documents. Total: {self.backend.count()}")
+        except Exception as e:
+            print(f"--- VectorStore: Error upserting documents: {e}")
+            raise
+
+    def delete_documents(self, ids: List[str]):
+        """Removes documents by id. Unknown ids are ignored."""
+        if not ids:
+            return
+        self.backend.delete(list(ids))
+        self._writes += 1
+        self._lexical_write("remove", list(ids))
+        print(f"--- VectorStore: Deleted {len(ids)} documents. Total: {self.backend.count()}")
+
     def get_count(self):
-        return self.collection.count()
+        return self.backend.count()
+
+    def flush(self):
+        """Makes a batch of writes durable: backend data first, then side indexes (BM25)."""
+        self.backend.flush()
+        with file_lock(self.lexical_index_path + ".lock"):
+            if not self.lexical_index.dirty:
+                return
+            if _file_stamp(self.lexical_index_path) != self._lexical_stamp:
+                # Another process saved since we loaded: replay our writes onto its index
+                journal = self._lexical_journal
+                self.lexical_index = BM25Index.load(self.lexical_index_path)
+                for method, args in journal:
+                    getattr(self.lexical_index, method)(*args)
+            self.lexical_index.save(self.lexical_index_path)
+            self._lexical_stamp = _file_stamp(self.lexical_index_path)
+            self._lexical_journal = []
+
+    def query(self, query_embeddings: np.ndarray, n_results: int,
+              where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Nearest neighbours for one or more query embeddings (Chroma-shaped result lists)."""
+        return self.backend.query(query_embeddings, n_results=n_results, where=where)
+
+    def lexical_search(self, query: str, top_k: int = 5,
+                       where: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """BM25 hits; with where, only documents matching the filter are scored."""
+        allowed = self._ids_matching(where) if where else None
+        self._maybe_reload_lexical()
+        return self.lexical_index.search(query, top_k=top_k, allowed=allowed)
+
+    def _ids_matching(self, where: Dict[str, Any], max_cached: int = 32) -> Set[str]:
+        """Ids matching where (from the backend's metadata index), cached until the store changes."""
+        key = (json.dumps(where, sort_keys=True), self.get_version())
+        ids = self._filter_ids.get(key)
+        if ids is None:
+            ids = set(self.backend.ids_matching(where))
+            if len(self._filter_ids) >= max_cached:
+                self._filter_ids.clear()
+            self._filter_ids[key] = ids
+        return ids
+
+    def get_page(self, limit: int, offset: int = 0) -> Dict[str, Any]:
+        """One page of ids, documents and metadatas in storage order (for scans such as the subject router)."""
+        return self.backend.get(limit=limit, offset=offset)
+
+    def get_documents(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetches content and metadata by id: {id: {'content', 'metadata'}}."""
+        if not ids:
+            return {}
+        found = self.backend.get(ids=list(ids))
+        return {
+            doc_id: {"content": document, "metadata": metadata}
+            for doc_id, document, metadata in zip(found['ids'], found['documents'], found['metadatas'])
+        }
+
+    def get_version(self) -> str:
+        """
+        Changes whenever the indexed contents change. Local writes bump a counter; writes made by
+        other processes (e.g. another worker's re-upload, which may keep the document count) show
+        up in the persisted state: the backend's version and the BM25 pickle, which every flush saves.
+        """
+        return f"{self._writes}:{self.backend.version()}:{_file_stamp(self.lexical_index_path)}"
 
 # --- 3. RAG Retriever (from your code) ---
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+
+
 class RAGRetriever:
-    def __init__(self, vector_store: VectorStore, embedding_manager: EmbeddingManager):
+    def __init__(self, vector_store: VectorStore, embedding_manager: EmbeddingManager,
+                 hybrid_candidates: int = 4, rrf_k: int = 60, router: Optional[SubjectRouter] = None):
         self.vector_store = vector_store
         self.embedding_manager = embedding_manager
+        # Hybrid mode fuses the top (top_k * hybrid_candidates) of each ranking
+        self.hybrid_candidates = hybrid_candidates
+        self.rrf_k = rrf_k
+        # Picks subject partitions for unfiltered dense/hybrid queries
+        self.router = router
 
-    def retrieve(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        query_embedding = self.embedding_manager.generate_embeddings([query])[0]
-        
-        try:
-            results = self.vector_store.collection.query(
-                query_embeddings=[query_embedding.tolist()],
-                n_results=top_k,
-                include=['documents', 'metadatas', 'distances']
-            )
-            
-            retrieved_docs = []
-            
-            if results['documents'] and results['documents'][0]:
-                documents = results['documents'][0]
-                metadatas = results['metadatas'][0]
-                distances = results['distances'][0]
-                ids = results['ids'][0]
-                
-                for i, (doc_id, document, metadata, distance) in enumerate(zip(ids, documents, metadatas, distances)):
-                    similarity_score = 1 - distance # Convert distance to similarity score
-                    retrieved_docs.append({
-                        'id': doc_id,
-                        'content': document,
-                        'metadata': metadata,
-                        'similarity_score': similarity_score,
-                        'rank': i + 1
-                    })
-            
-            return retrieved_docs
-            
-        except Exception as e:
-            print(f"--- RAGRetriever: Error during retrieval: {e}")
-            return []
+    def retrieve(self, query: str, top_k: int = 5, mode: str = "dense",
+                 where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        if mode == "lexical":
+            return self.retrieve_lexical(query, top_k=top_k, where=where)
+        query_embedding = self.embedding_manager.embed_query(query)
+        return self.search(query, query_embedding, top_k=top_k, mode=mode, where=where)
 
-# --- 4. Gemini LLM (adapted from your code) ---
-class GeminiLLM:
-    def __init__(self, model_name: str, api_key: str):
-        if not api_key:
-            raise ValueError("Gemini API key is required.")
-        
-        self.model_name = model_name
-        self.client = genai.Client(api_key=api_key)
-        print(f"--- GeminiLLM: Initialized with model: {self.model_name}")
+    def route(self, query_embedding: Optional[np.ndarray],
+              where: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """(filter to search with, whether it came from the router). Explicit filters are never re-routed."""
+        if where is not None or self.router is None or query_embedding is None:
+            return where, False
+        subjects = self.router.route(query_embedding)
+        if not subjects:
+            return None, False
+        return build_filter(subjects=subjects), True
+
+    def search(self, query: str, query_embedding: Optional[np.ndarray], top_k: int = 5,
+               mode: str = "dense", where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Dispatches on retrieval mode: 'dense' (vectors), 'lexical' (BM25) or 'hybrid' (RRF of both).
+        where (subject/source filter) is pushed into the search; without one, dense and hybrid
+        queries are routed to their likely subjects, falling back to the whole store if the
+        routed partitions return fewer than top_k documents.
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        if mode == "lexical":
+            return self.retrieve_lexical(query, top_k=top_k, where=where)
+        where, routed = self.route(query_embedding, where)
+        docs = self._search_filtered(query, query_embedding, top_k, mode, where)
+        if routed and len(docs) < top_k:
+            docs = self._search_filtered(query, query_embedding, top_k, mode, None)
+        return docs
+
+    def _search_filtered(self, query: str, query_embedding: np.ndarray, top_k: int, mode: str,
+                         where: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if mode == "hybrid":
+            return self.retrieve_hybrid(query, query_embedding, top_k=top_k, where=where)
+        return self.retrieve_by_embedding(query_embedding, top_k=top_k, where=where)
 
-    def generate_rag_response(self, query: str, context: str) -> str:
-        prompt_template = PromptTemplate(
-            input_variables=["context", "question"],
-            template="""You are a helpful Study Buddy AI assistant. Use the following context to answer the question accurately and concisely.
+    def retrieve_lexical(self, query: str, top_k: int = 5,
+                         where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """BM25-only retrieval; similarity_score is the BM25 score."""
+        with timed("lexical_search"):
+            hits = self.vector_store.lexical_search(query, top_k=top_k, where=where)
+        return self._materialize(hits, where=where)
 
-Context:
-{context}
+    def search_batch(self, queries: List[str], query_embeddings: np.ndarray, top_ks: List[int],
+                     modes: List[str], wheres: Optional[List[Optional[Dict[str, Any]]]] = None
+                     ) -> List[List[Dict[str, Any]]]:
+        """
+        search() for many queries at once: dense/hybrid queries with the same (explicit or routed)
+        filter go into a single multi-vector search (deep enough for the largest request),
+        lexical rankings are per query.
+        """
+        for mode in modes:
+            if mode not in RETRIEVAL_MODES:
+                raise ValueError(f"Unknown retrieval mode: {mode}")
+        query_embeddings = np.asarray(query_embeddings)
+        wheres = list(wheres) if wheres is not None else [None] * len(queries)
+        routed = [False] * len(queries)
+        groups: Dict[str, List[int]] = {}
+        for i, mode in enumerate(modes):
+            if mode != "lexical":
+                wheres[i], routed[i] = self.route(query_embeddings[i], wheres[i])
+                groups.setdefault(json.dumps(wheres[i], sort_keys=True), []).append(i)
 
-Question: {question}
+        dense_results: Dict[int, List[Dict[str, Any]]] = {}
+        for rows in groups.values():
+            depth = max(top_ks[i] * (self.hybrid_candidates if modes[i] == "hybrid" else 1) for i in rows)
+            found = self.retrieve_by_embeddings(query_embeddings[rows], top_k=depth, where=wheres[rows[0]])
+            dense_results.update(zip(rows, found))
 
-Answer: Provide a clear and informative answer based ONLY on the context above. If the context doesn't contain enough information to answer the question, politely say, 'I'm sorry, I couldn't find the answer in the provided study materials.'"""
+        results = []
+        for i, (query, top_k, mode) in enumerate(zip(queries, top_ks, modes)):
+            if mode == "lexical":
+                docs = self.retrieve_lexical(query, top_k=top_k, where=wheres[i])
+            elif mode == "hybrid":
+                dense_docs = dense_results[i][:top_k * self.hybrid_candidates]
+                docs = self.retrieve_hybrid(query, None, top_k=top_k, dense_docs=dense_docs, where=wheres[i])
+            else:
+                docs = dense_results[i][:top_k]
+            if routed[i] and len(docs) < top_k:
+                docs = self._search_filtered(query, query_embeddings[i], top_k, mode, None)
+            results.append(docs)
+        return results
+
+    def retrieve_hybrid(self, query: str, query_embedding: Optional[np.ndarray], top_k: int = 5,
+                        dense_docs: Optional[List[Dict[str, Any]]] = None,
+                        where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Reciprocal rank fusion of dense and BM25 rankings; similarity_score is the fused score."""
+        candidates = top_k * self.hybrid_candidates
+        if dense_docs is None:
+            dense_docs = self.retrieve_by_embedding(query_embedding, top_k=candidates, where=where)
+        with timed("lexical_search"):
+            lexical_hits = self.vector_store.lexical_search(query, top_k=candidates, where=where)
+        fused = reciprocal_rank_fusion(
+            [[doc['id'] for doc in dense_docs], [doc_id for doc_id, _ in lexical_hits]],
+            k=self.rrf_k
         )
-        
-        formatted_prompt = prompt_template.format(context=context, question=query)
-        
+        known = {doc['id']: doc for doc in dense_docs}
+        return self._materialize(fused[:top_k], known, where=where)
+
+    def _materialize(self, scored_ids: List[Tuple[str, float]],
+                     known: Optional[Dict[str, Dict[str, Any]]] = None,
+                     where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Turns (id, score) pairs into retrieved-doc dicts, fetching content not already at hand.
+        With where, docs whose metadata no longer matches are dropped (the filter's id set is
+        cached per store version, which can miss another process re-tagging a file).
+        """
+        known = known or {}
+        missing = [doc_id for doc_id, _ in scored_ids if doc_id not in known]
+        fetched = self.vector_store.get_documents(missing) if missing else {}
+        retrieved_docs = []
+        for doc_id, score in scored_ids:
+            doc = known.get(doc_id) or fetched.get(doc_id)
+            if doc is None or not matches_filter(doc['metadata'], where):
+                continue
+            retrieved_docs.append({
+                'id': doc_id,
+                'content': doc['content'],
+                'metadata': doc['metadata'],
+                'similarity_score': float(score),
+                'rank': len(retrieved_docs) + 1
+            })
+        return retrieved_docs
+
+    def retrieve_by_embedding(self, query_embedding: np.ndarray, top_k: int = 5,
+                              where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Searches with an already computed query embedding."""
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=formatted_prompt,
-                config={
-                    "temperature": 0.1,
-                    "max_output_tokens": 1024
-                }
-            )
-            return response.text
+            return self.retrieve_by_embeddings(np.atleast_2d(query_embedding), top_k=top_k, where=where)[0]
         except Exception as e:
-            print(f"--- GeminiLLM: Error generating response: {e}")
-            return f"Error: Could not generate response due to a system error."
+            print(f"--- RAGRetriever: Error during retrieval: {e}")
+            return []
+
+    def retrieve_by_embeddings(self, query_embeddings: np.ndarray, top_k: int = 5,
+                               where: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """One vector store search for several query embeddings; a list of retrieved docs per query."""
+        with timed("vector_search"):
+            results = self.vector_store.query(query_embeddings, n_results=top_k, where=where)
+        batches = []
+        for q in range(len(results['ids'])):
+            retrieved_docs = []
+            documents = results['documents'][q] if results['documents'] else []
+            metadatas = results['metadatas'][q]
+            distances = results['distances'][q]
+            ids = results['ids'][q]
+
+            for i, (doc_id, document, metadata, distance) in enumerate(zip(ids, documents, metadatas, distances)):
+                similarity_score = 1 - distance # Convert distance to similarity score (cosine for the numpy backend)
+                retrieved_docs.append({
+                    'id': doc_id,
+                    'content': document,
+                    'metadata': metadata,
+                    'similarity_score': similarity_score,
+                    'rank': i + 1
+                })
+            batches.append(retrieved_docs)
+        return batches
+
+# --- 4. LLM providers live in app/core/llm.py (Gemini, or a local fake for load tests) ---
 
 # --- 5. Main RAG Service Class ---
+NO_CONTEXT_ANSWER = "I'm sorry, I couldn't find any relevant study materials for your question."
+
+
 class RAGService:
-    def __init__(self, vector_store: VectorStore, retriever: RAGRetriever, llm: GeminiLLM):
+    def __init__(self, vector_store: VectorStore, retriever: RAGRetriever, llm: BaseLLM,
+                 answer_cache: Optional[AnswerCache] = None, context_packer: Optional[ContextPacker] = None):
         self.vector_store = vector_store
         self.retriever = retriever
         self.llm = llm
+        self.answer_cache = answer_cache
+        # Merges overlapping chunks, drops near-duplicates and enforces the prompt token budget
+        self.context_packer = context_packer
+
+    def build_context(self, retrieved_docs: List[Dict[str, Any]]) -> str:
+        with timed("context_assembly"):
+            if self.context_packer is not None:
+                return self.context_packer.pack(retrieved_docs)
+            context_parts = [doc['content'] for doc in retrieved_docs]
+            return CONTEXT_SEPARATOR.join(context_parts)
+
+    @staticmethod
+    def _cache_scope(top_k: int, mode: str, where: Optional[Dict[str, Any]] = None):
+        return (top_k, mode, json.dumps(where, sort_keys=True) if where else None)
+
+    def _retrieve_or_cached(self, query: str, top_k: int, mode: str = "dense",
+                            where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Retrieval step shared by the sync and async paths. Returns {'cached': result} on an
+        answer-cache hit, otherwise the retrieved docs plus what is needed to cache the answer.
+        """
+        if self.answer_cache is None:
+            return {"retrieved_docs": self.retriever.retrieve(query, top_k=top_k, mode=mode, where=where)}
+
+        scope = self._cache_scope(top_k, mode, where)
+        version = self.vector_store.get_version()
+        cached = self.answer_cache.get_exact(query, scope, version)
+        query_embedding = None
+        if cached is None and mode != "lexical":
+            # Lexical retrieval needs no embedding, so it has no semantic lookup either
+            query_embedding = self.retriever.embedding_manager.embed_query(query)
+            cached = self.answer_cache.get_semantic(query_embedding, scope, version)
+        if cached is not None:
+            return {"cached": dict(cached, query=query)}
+
+        return {
+            "retrieved_docs": self.retriever.search(query, query_embedding, top_k=top_k, mode=mode, where=where),
+            "cache_key": (scope, version, query_embedding)
+        }
+
+    def _batch_retrieve_or_cached(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        _retrieve_or_cached for a batch of {'query', 'top_k', 'mode', 'where'?} items: all queries are embedded
+        in one encode_queries call and all cache misses share one multi-vector search.
+        """
+        unique_queries = list(dict.fromkeys(item["query"] for item in items))
+        embeddings = self.retriever.embedding_manager.encode_queries(unique_queries)
+        embedding_of = dict(zip(unique_queries, embeddings))
+        version = self.vector_store.get_version() if self.answer_cache is not None else None
+
+        prepared: List[Dict[str, Any]] = []
+        misses = []
+        for i, item in enumerate(items):
+            query_embedding = embedding_of[item["query"]]
+            if self.answer_cache is None:
+                prepared.append({})
+            else:
+                scope = self._cache_scope(item["top_k"], item["mode"], item.get("where"))
+                semantic = item["mode"] != "lexical"
+                cached = self.answer_cache.get_exact(item["query"], scope, version)
+                if cached is None and semantic:
+                    cached = self.answer_cache.get_semantic(query_embedding, scope, version)
+                if cached is not None:
+                    prepared.append({"cached": dict(cached, query=item["query"])})
+                    continue
+                prepared.append({"cache_key": (scope, version, query_embedding if semantic else None)})
+            misses.append(i)
+
+        if misses:
+            found = self.retriever.search_batch(
+                [items[i]["query"] for i in misses],
+                np.vstack([embedding_of[items[i]["query"]] for i in misses]),
+                [items[i]["top_k"] for i in misses],
+                [items[i]["mode"] for i in misses],
+                [items[i].get("where") for i in misses]
+            )
+            for i, retrieved_docs in zip(misses, found):
+                prepared[i]["retrieved_docs"] = retrieved_docs
+        return prepared
+
+    def _remember_answer(self, query: str, prepared: Dict[str, Any], result: Dict[str, Any]):
+        cache_key = prepared.get("cache_key")
+        if cache_key is None or result["answer"].startswith("Error:"):
+            return
+        scope, version, query_embedding = cache_key
+        self.answer_cache.put(query, scope, version, query_embedding, result)
 
-    def query_rag(self, query: str, top_k: int = 5) -> Dict[str, Any]:
+    def query_rag(self, query: str, top_k: int = 5, mode: str = "dense",
+                  where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Main RAG function to retrieve context and generate an answer."""
         
-        # 1. Retrieve Context
-        retrieved_docs = self.retriever.retrieve(query, top_k=top_k)
-        
-        context_parts = [doc['content'] for doc in retrieved_docs]
-        context = "\n\n---\n\n".join(context_parts)
+        # 1. Retrieve Context (or reuse a cached answer)
+        prepared = self._retrieve_or_cached(query, top_k, mode, where)
+        if "cached" in prepared:
+            return prepared["cached"]
+        retrieved_docs = prepared["retrieved_docs"]
+        context = self.build_context(retrieved_docs)
         
         if not context:
             return {
                 "query": query,
-                "answer": "I'm sorry, I couldn't find any relevant study materials for your question.",
+                "answer": NO_CONTEXT_ANSWER,
                 "retrieved_documents": []
             }
         
         # 2. Generate Answer
         answer = self.llm.generate_rag_response(query, context)
         
-        return {
+        result = {
             "query": query,
             "answer": answer,
             "retrieved_documents": retrieved_docs
-        }
\ No newline at end of file
+        }
+        self._remember_answer(query, prepared, result)
+        return result
+
+    async def aretrieve(self, query: str, top_k: int = 5, mode: str = "dense",
+                        where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Retrieval only (embed + search) on the bounded executor."""
+        return await run_blocking(STAGE_EMBED_SEARCH, self.retriever.retrieve, query, top_k, mode, where)
+
+    async def astream_answer(self, query: str, context: str) -> AsyncIterator[str]:
+        """Streams the answer for an already retrieved context, holding an LLM slot while it runs."""
+        if not context:
+            yield NO_CONTEXT_ANSWER
+            return
+        async with stage_limit(STAGE_LLM):
+            pieces = self.llm.astream_rag_response(query, context)
+            try:
+                async for piece in pieces:
+                    yield piece
+            finally:
+                # Runs on client disconnect too, so the upstream generation is cancelled
+                await pieces.aclose()
+
+    async def aquery_rag(self, query: str, top_k: int = 5, mode: str = "dense",
+                         where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Non-blocking query_rag: embedding + search run on the bounded executor and the
+        answer comes from the async LLM client, each stage under its own concurrency limit.
+        """
+        prepared = await run_blocking(STAGE_EMBED_SEARCH, self._retrieve_or_cached, query, top_k, mode, where)
+        if "cached" in prepared:
+            return prepared["cached"]
+        retrieved_docs = prepared["retrieved_docs"]
+        context = self.build_context(retrieved_docs)
+
+        if not context:
+            return {
+                "query": query,
+                "answer": NO_CONTEXT_ANSWER,
+                "retrieved_documents": []
+            }
+
+        async with stage_limit(STAGE_LLM):
+            answer = await self.llm.agenerate_rag_response(query, context)
+
+        result = {
+            "query": query,
+            "answer": answer,
+            "retrieved_documents": retrieved_docs
+        }
+        self._remember_answer(query, prepared, result)
+        return result
+
+    async def abatch_query_rag(self, items: List[Dict[str, Any]], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """
+        aquery_rag for a list of {'query', 'top_k', 'mode', 'where'?} items. Retrieval is batched (one embedding
+        call, one vector search); answers are generated concurrently, at most max_concurrency at a
+        time. Results keep the input order; a failed item gets an 'error' instead of failing the batch.
+        """
+        try:
+            prepared = await run_blocking(STAGE_EMBED_SEARCH, self._batch_retrieve_or_cached, items)
+        except Exception as e:
+            print(f"--- RAGService: Batch retrieval failed: {e}")
+            return [{"query": item["query"], "error": str(e), "retrieved_documents": []} for item in items]
+
+        fan_out = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def answer(item: Dict[str, Any], prep: Dict[str, Any]) -> Dict[str, Any]:
+            if "cached" in prep:
+                return prep["cached"]
+            query, retrieved_docs = item["query"], prep["retrieved_docs"]
+            context = self.build_context(retrieved_docs)
+            if not context:
+                return {"query": query, "answer": NO_CONTEXT_ANSWER, "retrieved_documents": []}
+            async with fan_out, stage_limit(STAGE_LLM):
+                answer_text = await self.llm.agenerate_rag_response(query, context)
+            if answer_text.startswith("Error:"):
+                return {"query": query, "error": answer_text, "retrieved_documents": retrieved_docs}
+            result = {"query": query, "answer": answer_text, "retrieved_documents": retrieved_docs}
+            self._remember_answer(query, prep, result)
+            return result
+
+        outcomes = await asyncio.gather(*(answer(item, prep) for item, prep in zip(items, prepared)),
+                                        return_exceptions=True)
+        return [
+            {"query": item["query"], "error": str(outcome), "retrieved_documents": []}
+            if isinstance(outcome, BaseException) else outcome
+            for item, outcome in zip(items, outcomes)
+        ]
@@ -0,0 +1,93 @@
+import sys
+import time
+import threading
+import importlib
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Any, Dict
+
+# Component states reported on /info/status
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+
+
+class StartupTracker:
+    """
+    Readiness of the heavy components (embedding model, vector store, LLM client, ...) while the
+    background warm-up loads them, plus how long each one and each lazily imported module took.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self._imports: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._components.setdefault(name, {"status": PENDING})
+
+    @contextmanager
+    def component(self, name: str):
+        """Marks name loading for the duration of the block, then ready (or failed, re-raising)."""
+        start = time.perf_counter()
+        with self._lock:
+            self._components[name] = {"status": LOADING, "started_at_s": round(start - self.started, 3)}
+        try:
+            yield
+        except BaseException as e:
+            self._finish(name, FAILED, start, error=f"{type(e).__name__}: {e}")
+            raise
+        self._finish(name, READY, start)
+
+    def _finish(self, name: str, state: str, start: float, **extra):
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self._components[name].update(status=state, seconds=round(seconds, 3), **extra)
+        print(f"--- Startup: {name} {state} in {seconds:.2f}s")
+
+    def record_import(self, module_name: str, seconds: float):
+        with self._lock:
+            self._imports[module_name] = round(seconds, 3)
+
+    def is_ready(self) -> bool:
+        with self._lock:
+            return bool(self._components) and all(c["status"] == READY for c in self._components.values())
+
+    def has_failed(self) -> bool:
+        with self._lock:
+            return any(c["status"] == FAILED for c in self._components.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": bool(self._components) and all(c["status"] == READY for c in self._components.values()),
+                "uptime_s": round(time.perf_counter() - self.started, 1),
+                "components": {name: dict(state) for name, state in self._components.items()},
+                "imports_s": dict(self._imports),
+            }
+
+    def stats(self) -> Dict[str, float]:
+        """Flat numbers for the /metrics collector."""
+        with self._lock:
+            values = {f"{name}_seconds": c["seconds"] for name, c in self._components.items() if "seconds" in c}
+            values.update({f"import_{name.replace('.', '_')}_seconds": s for name, s in self._imports.items()})
+        values["ready"] = 1 if self.is_ready() else 0
+        return values
+
+
+STARTUP = StartupTracker()
+
+
+def timed_import(module_name: str) -> ModuleType:
+    """importlib.import_module that records how long the first import took (heavy deps are imported lazily)."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    STARTUP.record_import(module_name, time.perf_counter() - start)
+    return module
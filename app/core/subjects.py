@@ -0,0 +1,193 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+# "CS1.pdf", "ec (1).pdf", "XH-C6.pdf", "DA_Keys.pdf" -> GATE paper code; anything else -> slug of the name
+_PAPER_CODE_RE = re.compile(r"^([A-Za-z]{2})(?:[^A-Za-z]|$)")
+
+
+def derive_subject(source_file: str) -> str:
+    """Subject partition of a file when no explicit tag is given."""
+    stem = Path(source_file).stem.strip()
+    match = _PAPER_CODE_RE.match(stem)
+    if match:
+        return match.group(1).lower()
+    return re.sub(r"[^a-z0-9]+", "_", stem.lower()).strip("_") or "general"
+
+
+def load_subject_tags(path: str) -> Dict[str, str]:
+    """Explicit {file name: subject} tags (JSON), overriding derive_subject. Missing file = no tags."""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            tags = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"--- Subjects: Could not read subject tags from {path}: {e}")
+        return {}
+    return {name: normalize_subject(subject) for name, subject in tags.items()}
+
+
+def normalize_subject(subject: str) -> str:
+    return subject.strip().lower()
+
+
+def build_filter(subjects: Optional[List[str]] = None, sources: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Chroma-style metadata filter for the given subjects and/or source files (None = everything)."""
+    conditions = []
+    if subjects:
+        subjects = sorted({normalize_subject(s) for s in subjects})
+        conditions.append({"subject": subjects[0]} if len(subjects) == 1 else {"subject": {"$in": subjects}})
+    if sources:
+        sources = sorted(set(sources))
+        conditions.append({"source_file": sources[0]} if len(sources) == 1 else {"source_file": {"$in": sources}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def matches_filter(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    Evaluates a Chroma-style filter ($and/$or, $eq/$ne/$in/$nin) against one document's metadata,
+    for post-filtering BM25 hits. Agrees with NumpyBackend._where_mask on every filter.
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            op, value = next(iter(condition.items()))
+            if op == "$eq":
+                matched = metadata.get(key) == value
+            elif op == "$ne":
+                matched = metadata.get(key) != value
+            elif op == "$in":
+                matched = metadata.get(key) in value
+            elif op == "$nin":
+                matched = metadata.get(key) not in value
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            if not matched:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+class SubjectRouter:
+    """
+    Picks subject partitions for a query that names none. Each subject is represented by the
+    normalized mean embedding of a sample of its chunks; a query is routed to the subjects
+    whose centroid is within `margin` of the best match, if the best match reaches
+    `min_score`. Otherwise (ambiguous or off-topic query) it is not routed at all.
+
+    Centroids are rebuilt in the background when the store's version changes, at most every
+    refresh_seconds. Sample chunks hit the embedding cache, so a rebuild rarely runs the model.
+    """
+
+    def __init__(self, vector_store, embedding_manager, samples_per_subject: int = 64, min_score: float = 0.3,
+                 margin: float = 0.05, max_subjects: int = 2, refresh_seconds: float = 300.0, page_size: int = 1000):
+        self.vector_store = vector_store
+        self.embedding_manager = embedding_manager
+        self.samples_per_subject = samples_per_subject
+        self.min_score = min_score
+        self.margin = margin
+        self.max_subjects = max_subjects
+        self.refresh_seconds = refresh_seconds
+        self.page_size = page_size
+        self.subjects: List[str] = []
+        self.chunk_counts: Dict[str, int] = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._version: Optional[str] = None
+        self._built_at = 0.0
+        self._building = threading.Lock()
+        self.routed = 0
+        self.unrouted = 0
+
+    def build(self):
+        """Scans the store's metadata and recomputes the subject centroids."""
+        if not self._building.acquire(blocking=False):
+            return  # a rebuild is already running
+        try:
+            version = self.vector_store.get_version()
+            samples: Dict[str, List[str]] = {}
+            rng = random.Random(0)
+            counts: Dict[str, int] = {}
+            total = self.vector_store.get_count()
+            for offset in range(0, total, self.page_size):
+                page = self.vector_store.get_page(limit=self.page_size, offset=offset)
+                for document, metadata in zip(page["documents"], page["metadatas"]):
+                    subject = (metadata or {}).get("subject")
+                    if not subject or not document:
+                        continue
+                    counts[subject] = counts.get(subject, 0) + 1
+                    # Reservoir sample: uniform over the partition without knowing its size up front
+                    bucket = samples.setdefault(subject, [])
+                    if len(bucket) < self.samples_per_subject:
+                        bucket.append(document)
+                    else:
+                        slot = rng.randrange(counts[subject])
+                        if slot < self.samples_per_subject:
+                            bucket[slot] = document
+
+            subjects = sorted(samples)
+            centroids = []
+            for subject in subjects:
+                vectors = np.asarray(self.embedding_manager.generate_embeddings(samples[subject]), dtype=np.float32)
+                vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-8)
+                centroid = vectors.mean(axis=0)
+                centroids.append(centroid / max(float(np.linalg.norm(centroid)), 1e-8))
+            self.subjects = subjects
+            self.chunk_counts = counts
+            self._centroids = np.vstack(centroids) if centroids else None
+            self._version = version
+            print(f"--- SubjectRouter: {len(subjects)} subject(s) over {sum(counts.values())} chunks")
+        except Exception as e:
+            print(f"--- SubjectRouter: Could not build centroids: {e}")
+        finally:
+            self._built_at = time.time()  # a failed build is retried after refresh_seconds too
+            self._building.release()
+
+    def start(self):
+        """Builds the centroids in the background; queries are not routed until it finishes."""
+        threading.Thread(target=self.build, name="subject-router", daemon=True).start()
+
+    def _refresh_if_stale(self):
+        if time.time() - self._built_at < self.refresh_seconds or self._building.locked():
+            return
+        if self.vector_store.get_version() == self._version:
+            self._built_at = time.time()
+            return
+        self.start()
+
+    def route(self, query_embedding: np.ndarray) -> Optional[List[str]]:
+        """Subjects to search for this query, or None to search everything."""
+        self._refresh_if_stale()
+        centroids = self._centroids
+        if centroids is None or len(centroids) < 2:
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        scores = centroids @ (query / max(float(np.linalg.norm(query)), 1e-8))
+        order = np.argsort(-scores)
+        best = float(scores[order[0]])
+        if best < self.min_score:
+            self.unrouted += 1
+            return None
+        chosen = [self.subjects[i] for i in order[:self.max_subjects] if scores[i] >= best - self.margin]
+        self.routed += 1
+        return chosen
+
+    def stats(self) -> Dict[str, Any]:
+        return {"subjects": len(self.subjects), "routed": self.routed, "unrouted": self.unrouted,
+                "built_age_s": round(time.time() - self._built_at, 1) if self._built_at else -1}
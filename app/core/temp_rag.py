@@ -1,148 +1,327 @@
-import os
-from typing import Dict, Any, List
-import chromadb
-from chromadb.api.models.Collection import Collection as ChromaCollection
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import io
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, BinaryIO
+import numpy as np
+from pypdf import PdfReader
+from langchain_core.documents import Document
 from app.core.rag import RAGService
 from app.core.data_prep import DataProcessor # Import DataProcessor from its dedicated file
+from app.core.concurrency import run_blocking, stage_limit, STAGE_EMBED_SEARCH, STAGE_LLM
+from app.core.metrics import timed
+from app.core.startup import timed_import
 
+DEFAULT_SESSION = "temp_session"
+
+# Rough per-chunk bookkeeping cost (ids, metadata, index entry) on top of text + vector bytes
+_CHUNK_OVERHEAD_BYTES = 512
+
+
+class TempSessionStore:
+    """
+    One shared in-memory Chroma collection holding the temporary uploads of every session.
+    Chunks are tagged with their session_id and queries are filtered on it. A global memory
+    budget is enforced by evicting least recently used sessions (never one that is still being
+    indexed), and idle sessions expire after ttl_seconds.
+    """
+
+    def __init__(self, memory_budget_bytes: int = 512 * 1024 * 1024, ttl_seconds: float = 3600):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.ttl_seconds = ttl_seconds
+        # EphemeralClient RAM में रखता है - पूरे process के लिए एक ही collection
+        self.client = timed_import("chromadb").EphemeralClient()
+        self.collection = self.client.get_or_create_collection(name=f"temp_shared_{uuid.uuid4().hex[:8]}")
+        # Key: session id. Value: {'filename', 'chunk_count', 'bytes', 'created', 'last_access', 'ids',
+        #                          'state', 'total_pages', 'pages_processed'}
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.memory_used_bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.RLock()
+
+    def begin_session(self, session_id: str, filename: str, total_pages: int = 0) -> str:
+        """Starts (or replaces) the upload of a session. Returns the upload id to pass to later calls."""
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._sweep_expired()
+            self._drop(session_id)
+            now = time.time()
+            self.sessions[session_id] = {
+                "filename": filename, "chunk_count": 0, "bytes": 0,
+                "created": now, "last_access": now, "ids": [],
+                "state": "indexing", "total_pages": total_pages, "pages_processed": 0,
+                "upload_id": upload_id
+            }
+        return upload_id
+
+    def _current(self, session_id: str, upload_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The session, unless a newer upload for the same session id has replaced this one."""
+        session = self.sessions.get(session_id)
+        if session is None or (upload_id is not None and session["upload_id"] != upload_id):
+            return None
+        return session
+
+    def add_chunks(self, session_id: str, texts: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray,
+                   upload_id: Optional[str] = None):
+        """Adds chunks to a session, evicting other sessions (LRU) if the memory budget requires it."""
+        if not texts:
+            return
+        size = sum(len(text.encode("utf-8")) for text in texts) \
+            + int(np.asarray(embeddings).nbytes) + _CHUNK_OVERHEAD_BYTES * len(texts)
+
+        with self._lock:
+            session = self._current(session_id, upload_id)
+            if session is None:
+                raise KeyError(f"Temporary session {session_id} was removed or replaced by a newer upload")
+            if session["bytes"] + size > self.memory_budget_bytes:
+                raise ValueError("Document is too large for the temporary store memory budget.")
+
+            for other_id in list(self.sessions.keys()):
+                if self.memory_used_bytes + size <= self.memory_budget_bytes:
+                    break
+                # Sessions still being indexed are not evicted: their next batch would find them gone
+                if other_id != session_id and self.sessions[other_id]["state"] != "indexing":
+                    print(f"--- TempSessionStore: Memory budget reached, evicting session {other_id}")
+                    self._drop(other_id)
+                    self.evictions += 1
+            if self.memory_used_bytes + size > self.memory_budget_bytes:
+                raise ValueError("Temporary store is full with uploads still being indexed; try again shortly.")
+
+            start = session["chunk_count"]
+            ids = [f"temp_{session_id}_{start + i}" for i in range(len(texts))]
+            tagged = [dict(metadata, session_id=session_id) for metadata in metadatas]
+            self.collection.add(
+                ids=ids,
+                embeddings=[embedding.tolist() for embedding in embeddings],
+                metadatas=tagged,
+                documents=list(texts)
+            )
+            session["ids"].extend(ids)
+            session["chunk_count"] += len(texts)
+            session["bytes"] += size
+            session["last_access"] = time.time()
+            self.memory_used_bytes += size
+            self.sessions.move_to_end(session_id)
+
+    def update_progress(self, session_id: str, pages_processed: int = 0, state: Optional[str] = None,
+                        upload_id: Optional[str] = None):
+        """Records ingestion progress for a session (pages are added to the running total)."""
+        with self._lock:
+            session = self._current(session_id, upload_id)
+            if session is None:
+                return
+            session["pages_processed"] += pages_processed
+            session["last_access"] = time.time()
+            if state:
+                session["state"] = state
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._sweep_expired()
+            return self.sessions.get(session_id)
+
+    def query(self, session_id: str, query_embedding: np.ndarray, top_k: int) -> Optional[Dict[str, Any]]:
+        """Searches only the given session's chunks. Returns None if the session has no data."""
+        with self._lock:
+            self._sweep_expired()
+            session = self.sessions.get(session_id)
+            if not session or not session["chunk_count"]:
+                return None
+            session["last_access"] = time.time()
+            self.sessions.move_to_end(session_id)
+            n_results = min(top_k, session["chunk_count"])
+
+        with timed("temp_search"):
+            results = self.collection.query(
+                query_embeddings=[query_embedding.tolist()],
+                n_results=n_results,
+                where={"session_id": session_id},
+                include=['documents', 'metadatas']
+            )
+        return {"results": results, "filename": session["filename"]}
+
+    def delete_session(self, session_id: str, upload_id: Optional[str] = None) -> bool:
+        with self._lock:
+            if self._current(session_id, upload_id) is None:
+                return False
+            return self._drop(session_id)
+
+    def _drop(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        if session["ids"]:
+            self.collection.delete(ids=session["ids"])
+        self.memory_used_bytes -= session["bytes"]
+        return True
+
+    def _sweep_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        for session_id, session in list(self.sessions.items()):
+            if session["last_access"] < cutoff:
+                print(f"--- TempSessionStore: Session {session_id} expired after {self.ttl_seconds:.0f}s idle")
+                self._drop(session_id)
+                self.expirations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sweep_expired()
+            return {
+                "active_sessions": len(self.sessions),
+                "total_chunks": sum(s["chunk_count"] for s in self.sessions.values()),
+                "memory_used_bytes": self.memory_used_bytes,
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
 
-# In-memory dictionary to hold temporary vector stores
-# Key: Session ID (or a simple 'temp_session')
-# Value: A dictionary containing {'collection': ChromaCollection object, 'chunk_count': int}
-TEMP_STORE: Dict[str, Dict[str, Any]] = {} 
 
 class TemporaryRAGManager:
     """
-    Handles indexing and querying for documents that are temporarily stored 
+    Handles indexing and querying for documents that are temporarily stored
     in RAM (using in-memory ChromaDB). This data is lost when the server restarts.
+    Each session (session id from the request) has its own slice of the shared store.
     """
-    
-    def __init__(self, rag_service: RAGService):
+
+    def __init__(self, rag_service: RAGService, store: Optional[TempSessionStore] = None):
         self.rag_service = rag_service
-        self.processor = DataProcessor(pdf_directory="") # Dummy path, as we use temp files
-        
-    def index_temporary_data(self, file_content: bytes, file_name: str, session_key: str = "temp_session"):
+        self.store = store or TempSessionStore()
+        self.processor = DataProcessor(pdf_directory="") # Only used for splitting; PDFs are read from memory
+
+    def index_temporary_data(self, file_content: bytes, file_name: str, session_key: str = DEFAULT_SESSION):
+        """Indexes an in-memory PDF (bytes) for session_key. See index_temporary_stream."""
+        return self.index_temporary_stream(io.BytesIO(file_content), file_name, session_key)
+
+    def index_temporary_stream(self, file_obj: BinaryIO, file_name: str, session_key: str = DEFAULT_SESSION,
+                               pages_per_batch: int = 8):
         """
-        Processes file content and indexes it into a new in-memory vector store 
-        identified by session_key.
+        Parses a PDF straight from a seekable file object and indexes it into the shared in-memory
+        store under session_key, replacing that session's previous upload. No copy is written here
+        (a multipart UploadFile over 1 MB has already been spooled to disk by Starlette; the raw
+        /upload_temp route passes an in-memory buffer). Pages are extracted, split, embedded and
+        added in small batches, so the first chunks are queryable while the rest of the file is
+        still being processed.
         """
-        
-        # 1. फ़ाइल को डिस्क पर अस्थायी रूप से सेव करें (क्योंकि PyPDFLoader को फ़ाइल पाथ चाहिए)
-        temp_dir = os.path.join(os.getcwd(), 'temp_uploads')
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_path = os.path.join(temp_dir, file_name)
-        
-        with open(temp_path, "wb") as f:
-            f.write(file_content)
-
-        chunks: List[Any] = []
-        
+        # 1. PDF को memory/stream से सीधे पढ़ें (डिस्क पर लिखने की ज़रूरत नहीं)
+        reader = PdfReader(file_obj)
+        total_pages = len(reader.pages)
+        upload_id = self.store.begin_session(session_key, file_name, total_pages=total_pages)
+        embedding_manager = self.rag_service.retriever.embedding_manager
+        chunk_total = 0
+
         try:
-            # 2. Document Loading, Splitting
-            loader = PyPDFLoader(temp_path)
-            documents = loader.load()
-            
-            for doc in documents:
-                doc.metadata['source_file'] = file_name
-                doc.metadata['is_temp'] = True
-            
-            # Simple chunking for temporary data
-            chunks = self.processor.split_documents(documents, chunk_size=500, chunk_overlap=100)
-            
-            if not chunks:
+            for batch_start in range(0, total_pages, pages_per_batch):
+                # 2. Page extraction + splitting, one batch at a time
+                documents = []
+                with timed("temp_parse"):
+                    for page_number in range(batch_start, min(batch_start + pages_per_batch, total_pages)):
+                        text = reader.pages[page_number].extract_text() or ""
+                        documents.append(Document(
+                            page_content=text,
+                            metadata={'source': file_name, 'page': page_number, 'source_file': file_name, 'is_temp': True}
+                        ))
+
+                # Simple chunking for temporary data
+                chunks = self.processor.split_documents(documents, chunk_size=500, chunk_overlap=100)
+                if chunks:
+                    # 3. Embedding Generate करें (Main Embedding Manager का उपयोग करके)
+                    texts = [doc.page_content for doc in chunks]
+                    with timed("temp_embed"):
+                        embeddings = embedding_manager.generate_embeddings(texts)
+                    # 4. Shared in-memory store में इस session के लिए जोड़ें (तुरंत query-able)
+                    with timed("temp_store_add"):
+                        self.store.add_chunks(session_key, texts, [doc.metadata for doc in chunks], embeddings,
+                                              upload_id=upload_id)
+                    chunk_total += len(chunks)
+
+                self.store.update_progress(session_key, pages_processed=len(documents), upload_id=upload_id)
+
+            if not chunk_total:
                 raise ValueError("No content extracted from the document.")
 
-            texts = [doc.page_content for doc in chunks]
-            
-            # 3. Embedding Generate करें (Main Embedding Manager का उपयोग करके)
-            embeddings = self.rag_service.retriever.embedding_manager.generate_embeddings(texts)
-            
-            # 4. In-Memory ChromaDB क्लाइंट (EphemeralClient)
-            # EphemeralClient RAM में रखता है
-            temp_client = chromadb.Client() 
-            temp_collection = temp_client.get_or_create_collection(
-                name=f"temp_col_{session_key}"
-            )
+            self.store.update_progress(session_key, state="ready", upload_id=upload_id)
+            return {"filename": file_name, "chunk_count": chunk_total, "session_id": session_key}
 
-            # 5. ChromaDB में जोड़ें
-            ids, metadatas, documents_text, embeddings_list = [], [], [], []
-            for i, (doc, embedding) in enumerate(zip(chunks, embeddings)):
-                doc_id = f"temp_{session_key}_{i}"
-                ids.append(doc_id)
-                metadatas.append(doc.metadata)
-                documents_text.append(doc.page_content)
-                embeddings_list.append(embedding.tolist())
-            
-            temp_collection.add(
-                ids=ids,
-                embeddings=embeddings_list,
-                metadatas=metadatas,
-                documents=documents_text
-            )
+        except Exception:
+            # Half-indexed uploads are not kept
+            self.store.delete_session(session_key, upload_id)
+            raise
 
-            # 6. अस्थायी स्टोर में डेटा सेव करें
-            TEMP_STORE[session_key] = {
-                "collection": temp_collection,
-                "filename": file_name,
-                "chunk_count": len(chunks)
-            }
-            
-            return TEMP_STORE[session_key]
-
-        finally:
-            # 7. डिस्क से अस्थायी फ़ाइल हटा दें
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            # Clean up temp directory if empty (optional)
-            try:
-                if not os.listdir(temp_dir):
-                    os.rmdir(temp_dir)
-            except OSError:
-                pass # Directory may not be empty
-
-    def query_temporary_data(self, query: str, top_k: int, session_key: str = "temp_session") -> Dict[str, str]:
-        """Queries the temporary store and generates an LLM response."""
-        
-        temp_data = TEMP_STORE.get(session_key)
-        if not temp_data:
-            return {"answer": None, "source_file": None} # None का मतलब है कि मेन DB से पूछो
+    def retrieve_temporary_context(self, query: str, top_k: int, session_key: str = DEFAULT_SESSION) -> Optional[Dict[str, Any]]:
+        """Embeds the query and searches the session's temporary data. Returns None when there is nothing to use."""
+
+        if not self.store.get_session(session_key):
+            return None # None का मतलब है कि मेन DB से पूछो
 
-        temp_collection: ChromaCollection = temp_data['collection']
-        
         # Embedding Manager का उपयोग करके क्वेरी को एम्बेड करें
-        query_embedding = self.rag_service.retriever.embedding_manager.generate_embeddings([query])[0]
-        
-        # अस्थायी कलेक्शन में खोजें
-        results = temp_collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=top_k,
-            include=['documents', 'metadatas']
-        )
-        
-        context = "\n\n---\n\n".join(results['documents'][0]) if results['documents'] else ""
-        
-
-        print("\n[TEMP RAG DEBUG START] ----------------------------------")
-        if not context:
-            print(f"INFO: Search in TEMP store failed. Retrieved 0 chunks.")
-        else:
-            print(f"SUCCESS: Retrieved {len(results['documents'][0])} chunks from TEMP store.")
-            print("Context Snippet (First 200 chars):", context[:200] + "...")
-        print("[TEMP RAG DEBUG END] ------------------------------------\n")
+        query_embedding = self.rag_service.retriever.embedding_manager.embed_query(query)
+
+        # अस्थायी store में (सिर्फ़ इसी session के chunks) खोजें
+        found = self.store.query(session_key, query_embedding, top_k)
+        if found is None:
+            return None
+        results = found["results"]
+
+        docs = []
+        if results['documents']:
+            for i, (doc_id, document, metadata) in enumerate(zip(results['ids'][0], results['documents'][0],
+                                                                  results['metadatas'][0])):
+                docs.append({'id': doc_id, 'content': document, 'metadata': metadata, 'rank': i + 1})
+        # Same packing as the main store: overlapping 500/100 chunks are merged before the LLM sees them
+        context = self.rag_service.build_context(docs)
 
         if not context:
-            return {"answer": None, "source_file": None} 
+            return None
+
+        return {
+            "context": context,
+            "source_file": found['filename'],
+            "sources": [{"metadata": metadata, "rank": i + 1} for i, metadata in enumerate(results['metadatas'][0])]
+        }
+
+    def query_temporary_data(self, query: str, top_k: int, session_key: str = DEFAULT_SESSION) -> Dict[str, str]:
+        """Queries the temporary store and generates an LLM response."""
+        retrieved = self.retrieve_temporary_context(query, top_k, session_key)
+        if retrieved is None:
+            return {"answer": None, "source_file": None}
 
-        
         # Gemini LLM से जवाब जनरेट करें (temp context का उपयोग करके)
-        answer = self.rag_service.llm.generate_rag_response(query, context)
-        
-        return {"answer": answer, "source_file": temp_data['filename']}
-
-    def delete_temporary_data(self, session_key: str = "temp_session"):
-        """Deletes the temporary vector store."""
-        if session_key in TEMP_STORE:
-            del TEMP_STORE[session_key]
+        answer = self.rag_service.llm.generate_rag_response(query, retrieved['context'])
+
+        return {"answer": answer, "source_file": retrieved['source_file']}
+
+    async def aquery_temporary_data(self, query: str, top_k: int, session_key: str = DEFAULT_SESSION) -> Dict[str, str]:
+        """Non-blocking query_temporary_data: search on the executor, answer via the async LLM client."""
+        retrieved = await run_blocking(STAGE_EMBED_SEARCH, self.retrieve_temporary_context, query, top_k, session_key)
+        if retrieved is None:
+            return {"answer": None, "source_file": None}
+
+        async with stage_limit(STAGE_LLM):
+            answer = await self.rag_service.llm.agenerate_rag_response(query, retrieved['context'])
+
+        return {"answer": answer, "source_file": retrieved['source_file']}
+
+    def delete_temporary_data(self, session_key: str = DEFAULT_SESSION):
+        """Deletes the session's temporary data."""
+        if self.store.delete_session(session_key):
             print(f"--- TemporaryRAGManager: Temporary store for {session_key} deleted.")
+
+    def session_status(self, session_key: str = DEFAULT_SESSION) -> Dict[str, Any]:
+        """Status of one session plus global store statistics."""
+        session = self.store.get_session(session_key) or {}
+        return {
+            "session_id": session_key,
+            "is_active": bool(session),
+            "filename": session.get("filename", "N/A"),
+            "chunk_count": session.get("chunk_count", 0),
+            "memory_bytes": session.get("bytes", 0),
+            "ingestion": {
+                "state": session.get("state", "none"),
+                "pages_processed": session.get("pages_processed", 0),
+                "total_pages": session.get("total_pages", 0)
+            },
+            "store": self.store.stats()
+        }
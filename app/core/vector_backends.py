@@ -0,0 +1,644 @@
+import os
+import re
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from app.core.startup import timed_import
+from app.core.filelock import file_lock, tmp_path_for
+
+BACKENDS = ("chroma", "numpy")
+QUANTIZATION_MODES = ("none", "int8", "binary")
+
+# Per-generation data files of NumpyBackend, e.g. vectors.3.npy
+_GENERATION_FILE_RE = re.compile(r"^\w+\.(\d+)\.\w+$")
+
+# Set bits per byte value, for Hamming distances on numpy versions without np.bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class _IndexView:
+    """
+    A NumpyBackend's arrays as of one moment, for a search that runs without the backend lock.
+    Writers replace the arrays rather than changing them in place (see upsert), and the id and
+    document lists only grow or are replaced, so the view stays consistent.
+    """
+
+    def __init__(self, backend: "NumpyBackend"):
+        self.vectors = backend._vectors
+        self.codes = backend._codes
+        self.scales = backend._scales
+        self.quantization = backend.quantization
+        self.rerank_factor = backend.rerank_factor
+        self.block_rows = backend.search_block_rows
+        self.ids = backend._ids
+        self.count = len(backend._ids)
+        self.documents = backend._documents
+        self.doc_blob = backend._doc_blob
+        self.doc_offsets = backend._doc_offsets
+        self.columns = dict(backend._columns)
+
+    def document(self, row: int) -> str:
+        if self.documents is not None:
+            return self.documents[row]
+        if self.doc_blob is None:
+            return ""
+        start, end = int(self.doc_offsets[row]), int(self.doc_offsets[row + 1])
+        return bytes(self.doc_blob[start:end]).decode("utf-8")
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return {key: column[row] for key, column in self.columns.items() if column[row] is not None}
+
+    def search(self, queries: np.ndarray, k: int, candidates: Optional[np.ndarray] = None,
+               exact: bool = False) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top-k (rows, cosine similarities) per query, via the quantized codes unless exact=True."""
+        if candidates is not None and not len(candidates):
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))] * len(queries)
+        use_codes = self.codes is not None and not exact
+        scores = self._approx_scores(queries, candidates) if use_codes else self._scores(queries, candidates)
+        k = min(k, scores.shape[0])
+
+        hits = []
+        for q in range(scores.shape[1]):
+            if not use_codes:
+                top = _top_k(scores[:, q], k)
+                rows = top if candidates is None else candidates[top]
+                hits.append((rows, scores[top, q]))
+                continue
+            # Shortlist on the codes, then re-rank the shortlist with the full-precision vectors
+            shortlist = _top_k(scores[:, q], min(k * self.rerank_factor, scores.shape[0]))
+            rows = np.sort(shortlist if candidates is None else candidates[shortlist])
+            exact_scores = self.vectors[rows].astype(np.float32, copy=False) @ queries[q]
+            top = _top_k(exact_scores, k)
+            hits.append((rows[top], exact_scores[top]))
+        return hits
+
+    def _scores(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Cosine similarities of every (candidate) row with every query, in float32."""
+        if rows is not None:
+            return self.vectors[rows].astype(np.float32, copy=False) @ queries.T
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ queries.T
+        # float16 has no BLAS path: upcast block by block instead of the whole matrix at once
+        blocks = [self.vectors[start:start + self.block_rows].astype(np.float32) @ queries.T
+                  for start in range(0, len(self.vectors), self.block_rows)]
+        return np.vstack(blocks)
+
+    def _approx_scores(self, queries: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Candidate scores from the quantized codes (higher is better), shape (n_rows, n_queries)."""
+        codes = self.codes if rows is None else self.codes[rows]
+        if self.quantization == "int8":
+            scaled = (queries * self.scales).T
+            return np.vstack([codes[start:start + self.block_rows].astype(np.float32) @ scaled
+                              for start in range(0, len(codes), self.block_rows)])
+        # binary: negative Hamming distance between sign bits
+        query_bits = np.packbits(queries > 0, axis=1)
+        bitwise_count = getattr(np, "bitwise_count", None)
+        scores = np.empty((len(codes), len(queries)), dtype=np.float32)
+        for q, bits in enumerate(query_bits):
+            xor = np.bitwise_xor(codes, bits)
+            counts = bitwise_count(xor) if bitwise_count is not None else _POPCOUNT[xor]
+            scores[:, q] = -counts.sum(axis=1, dtype=np.int32)
+        return scores
+
+
+class VectorBackend:
+    """
+    Storage and nearest-neighbour search behind VectorStore. get() and query() return the same
+    shapes as Chroma ({'ids', 'documents', 'metadatas'[, 'distances']}, one list per query).
+    """
+
+    name = "base"
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def add(self, ids: List[str], embeddings: np.ndarray, metadatas: List[Dict[str, Any]], documents: List[str]):
+        raise NotImplementedError
+
+    def upsert(self, ids: List[str], embeddings: np.ndarray, metadatas: List[Dict[str, Any]], documents: List[str]):
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]):
+        raise NotImplementedError
+
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None, offset: int = 0) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def query(self, query_embeddings: np.ndarray, n_results: int,
+              where: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def ids_matching(self, where: Dict[str, Any]) -> List[str]:
+        """Ids of the documents whose metadata matches a Chroma-style filter."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Makes buffered writes durable. No-op for backends that persist on every write."""
+
+    def version(self) -> str:
+        """Token that changes with the persisted contents, whichever process wrote them."""
+        return str(self.count())
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "count": self.count()}
+
+
+class ChromaBackend(VectorBackend):
+    """Chroma PersistentClient collection (HNSW, squared L2 distances)."""
+
+    name = "chroma"
+
+    def __init__(self, persist_directory: str, collection_name: str):
+        chromadb = timed_import("chromadb")  # only the chroma backend pays for the import
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.collection = self.client.get_or_create_collection(
+            name=collection_name,
+            metadata={"description": "PDF document embeddings for RAG"}
+        )
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def add(self, ids, embeddings, metadatas, documents):
+        self.collection.add(ids=list(ids), embeddings=np.asarray(embeddings, dtype=np.float32),
+                            metadatas=metadatas, documents=list(documents))
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        self.collection.upsert(ids=list(ids), embeddings=np.asarray(embeddings, dtype=np.float32),
+                               metadatas=metadatas, documents=list(documents))
+
+    def delete(self, ids):
+        self.collection.delete(ids=list(ids))
+
+    def get(self, ids=None, limit=None, offset=0):
+        if ids is not None:
+            return self.collection.get(ids=list(ids), include=['documents', 'metadatas'])
+        return self.collection.get(limit=limit, offset=offset, include=['documents', 'metadatas'])
+
+    def query(self, query_embeddings, n_results, where=None):
+        query_embeddings = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            where=where or None,
+            include=['documents', 'metadatas', 'distances']
+        )
+
+    def ids_matching(self, where):
+        return self.collection.get(where=where, include=[])['ids']
+
+
+class NumpyBackend(VectorBackend):
+    """
+    Exact search over a memory-mapped matrix of L2-normalized embeddings (float32 or float16).
+
+    On disk (one directory): vectors.<gen>.npy, the documents as one UTF-8 blob plus an offsets
+    array, and rows.<gen>.json with the ids and the metadata stored column by column. meta.json
+    names the current generation and is replaced last, so a flush is atomic and readers never see
+    a half-written index. Readers open a generation under a shared write.lock, and the previous
+    generation stays on disk until the next flush. Opening only maps the files, so load time is near zero and gunicorn
+    workers share the vectors through the page cache. Distances are cosine distances (1 - cos).
+
+    Writes copy the mapped data into memory once; new rows are buffered and concatenated on the
+    next search. Nothing reaches disk until flush(). Another process's flush is picked up
+    automatically (meta.json is stat'ed on each call). Writers may run in several processes:
+    flush() holds write.lock, and if another process flushed since this one loaded, it reloads
+    that generation and re-applies its own journaled writes on top before writing the next one.
+
+    With quantization='int8' (per-dimension scalar codes, 4x smaller) or 'binary' (sign bits,
+    32x smaller, Hamming distance) the candidate search scans only the compact codes; the best
+    n_results * rerank_factor candidates are then re-scored with the full-precision vectors,
+    which stay memory-mapped and are only touched for those rows. The mode is fixed when the
+    index is built and recorded in meta.json.
+    """
+
+    name = "numpy"
+
+    def __init__(self, directory: str, dtype: str = "float32", quantization: str = "none",
+                 rerank_factor: int = 4, search_block_rows: int = 8192):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported quantization: {quantization} (expected one of {QUANTIZATION_MODES})")
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.quantization = quantization
+        self.rerank_factor = max(1, rerank_factor)
+        self.search_block_rows = search_block_rows
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.write_lock_path = os.path.join(directory, "write.lock")
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # --- persistence ---
+    def _files(self, generation: int) -> Dict[str, str]:
+        return {
+            "vectors": os.path.join(self.directory, f"vectors.{generation}.npy"),
+            "documents": os.path.join(self.directory, f"documents.{generation}.bin"),
+            "offsets": os.path.join(self.directory, f"doc_offsets.{generation}.npy"),
+            "rows": os.path.join(self.directory, f"rows.{generation}.json"),
+            "codes": os.path.join(self.directory, f"codes.{generation}.npy"),
+        }
+
+    def _load(self, locked: bool = False):
+        """
+        Opens the generation named by meta.json. Readers hold write.lock shared, so no flush can
+        swap or remove files mid-open (flush() passes locked=True as it already holds it). The new
+        state is only committed once every file has opened; on failure the old one stays intact.
+        """
+        if locked:
+            state = self._open_generation()
+        else:
+            with file_lock(self.write_lock_path, shared=True):
+                state = self._open_generation()
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._documents: Optional[List[str]] = None  # in-memory copy, only once written to
+        self._pending: List[np.ndarray] = []
+        self._partitions: Dict[str, Dict[Any, np.ndarray]] = {}  # column -> value -> rows, for $eq/$in filters
+        self._journal: List[Tuple[str, tuple]] = []  # writes since the last load, replayed if flush has to merge
+        self._dirty = False
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids)}
+
+    def _open_generation(self) -> Dict[str, Any]:
+        """Reads meta.json and maps its generation's files into a new state, without touching self."""
+        state: Dict[str, Any] = {
+            "_generation": 0,
+            "_meta_mtime": None,
+            "_dim": None,
+            "_ids": [],
+            "_columns": {},
+            "_vectors": np.zeros((0, 0), dtype=self.dtype),
+            "_doc_blob": None,
+            "_doc_offsets": np.zeros(1, dtype=np.int64),
+            "_codes": None,  # quantized copy of _vectors, rebuilt after writes
+            "_scales": None,  # int8 only: per-dimension dequantization scale
+        }
+        if not os.path.exists(self.meta_path):
+            return state
+        meta_mtime = os.stat(self.meta_path).st_mtime_ns
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        files = self._files(meta["generation"])
+        with open(files["rows"], "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        # Like dtype, the quantization the index was built with wins over the constructor argument
+        quantization = meta.get("quantization", "none")
+        dtype = self.dtype
+        if rows["ids"]:
+            stored = np.load(files["vectors"], mmap_mode="r")
+            # The stored dtype wins; switching VECTOR_DTYPE takes effect on the next rebuild
+            dtype = stored.dtype
+            state["_vectors"] = stored
+            state["_doc_offsets"] = np.load(files["offsets"], mmap_mode="r")
+            if state["_doc_offsets"][-1]:
+                state["_doc_blob"] = np.memmap(files["documents"], dtype=np.uint8, mode="r")
+            if quantization != "none":
+                state["_codes"] = np.load(files["codes"], mmap_mode="r")
+        elif meta["dim"]:
+            state["_vectors"] = np.zeros((0, meta["dim"]), dtype=dtype)
+        if meta.get("int8_scales"):
+            state["_scales"] = np.asarray(meta["int8_scales"], dtype=np.float32)
+        state.update(_generation=meta["generation"], _meta_mtime=meta_mtime, _dim=meta["dim"],
+                     _ids=rows["ids"], _columns=rows["columns"], dtype=dtype, quantization=quantization)
+        return state
+
+    def _maybe_reload(self):
+        """Re-opens the index if another process flushed a newer generation."""
+        if self._dirty:
+            return
+        try:
+            mtime = os.stat(self.meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        try:
+            self._load()
+        except (OSError, ValueError) as e:
+            # Keep serving the generation we have; the unchanged _meta_mtime makes the next call retry
+            print(f"--- NumpyBackend: Could not open the newer generation, keeping generation {self._generation}: {e}")
+
+    def _stored_generation(self) -> int:
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)["generation"]
+        except FileNotFoundError:
+            return 0
+
+    def flush(self):
+        with self._lock, file_lock(self.write_lock_path):
+            if not self._dirty:
+                return
+            if self._stored_generation() != self._generation:
+                # Another process flushed since our load: rebase our writes onto its generation
+                journal = self._journal
+                print(f"--- NumpyBackend: Merging {len(journal)} pending write(s) onto a newer generation")
+                self._load(locked=True)
+                for method, args in journal:
+                    getattr(self, method)(*args)
+            self._compact()
+            generation = self._generation + 1
+            files = self._files(generation)
+
+            texts = [text.encode("utf-8") for text in self._all_documents()]
+            offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+            if texts:
+                np.cumsum([len(text) for text in texts], out=offsets[1:])
+            with open(files["documents"], "wb") as f:
+                f.write(b"".join(texts))
+            np.save(files["offsets"], offsets)
+            np.save(files["vectors"], np.ascontiguousarray(self._vectors, dtype=self.dtype))
+            self._ensure_codes()
+            if self._codes is not None:
+                np.save(files["codes"], self._codes)
+            with open(files["rows"], "w", encoding="utf-8") as f:
+                json.dump({"ids": self._ids, "columns": self._columns}, f, ensure_ascii=False)
+
+            meta = {"generation": generation, "dim": self._dim, "dtype": self.dtype.name, "count": len(self._ids),
+                    "quantization": self.quantization,
+                    "int8_scales": self._scales.tolist() if self._scales is not None else None}
+            tmp_path = tmp_path_for(self.meta_path)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self.meta_path)
+
+            # Keep the previous generation as well, for readers still opening it; processes that
+            # map older ones keep their open handles
+            for name in os.listdir(self.directory):
+                match = _GENERATION_FILE_RE.match(name)
+                if match and int(match.group(1)) < generation - 1:
+                    os.remove(os.path.join(self.directory, name))
+            self._load(locked=True)
+
+    # --- in-memory state ---
+    def _compact(self):
+        if self._pending:
+            self._vectors = np.vstack([self._vectors] + self._pending)
+            self._pending = []
+
+    def _ensure_codes(self):
+        """(Re)builds the quantized codes from the full vectors after writes."""
+        if self.quantization == "none" or self._codes is not None or not len(self._vectors):
+            return
+        blocks = range(0, len(self._vectors), self.search_block_rows)
+        if self.quantization == "binary":
+            self._codes = np.vstack([np.packbits(self._vectors[start:start + self.search_block_rows] > 0, axis=1)
+                                     for start in blocks])
+            return
+        max_abs = np.zeros(self._dim, dtype=np.float32)
+        for start in blocks:
+            block = np.abs(self._vectors[start:start + self.search_block_rows].astype(np.float32))
+            np.maximum(max_abs, block.max(axis=0), out=max_abs)
+        self._scales = np.maximum(max_abs, 1e-8) / 127.0
+        self._codes = np.vstack([
+            np.clip(np.rint(self._vectors[start:start + self.search_block_rows] / self._scales), -127, 127)
+            .astype(np.int8)
+            for start in blocks
+        ])
+
+    def _make_writable(self):
+        """Copies the mapped vectors and documents into memory before the first write."""
+        if self._documents is None:
+            self._documents = self._all_documents()
+            self._vectors = np.array(self._vectors, dtype=self.dtype)
+            self._doc_blob = None
+        self._dirty = True
+
+    def _all_documents(self) -> List[str]:
+        if self._documents is not None:
+            return list(self._documents)
+        view = _IndexView(self)
+        return [view.document(row) for row in range(view.count)]
+
+    def _normalize(self, embeddings: np.ndarray) -> np.ndarray:
+        matrix = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    # --- writes ---
+    def add(self, ids, embeddings, metadatas, documents):
+        duplicates = [doc_id for doc_id in ids if doc_id in self._row_of]
+        if duplicates:
+            raise ValueError(f"Ids already exist: {duplicates[:5]}")
+        self.upsert(ids, embeddings, metadatas, documents)
+
+    def upsert(self, ids, embeddings, metadatas, documents):
+        vectors = self._normalize(embeddings)
+        with self._lock:
+            self._maybe_reload()
+            self._journal.append(("upsert", (ids, vectors, metadatas, documents)))
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._vectors = np.zeros((0, self._dim), dtype=self.dtype)
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self._dim}")
+            self._make_writable()
+            self._compact()
+
+            new_rows = []
+            copied = False
+            for doc_id, vector, metadata, document in zip(ids, vectors, metadatas, documents):
+                row = self._row_of.get(doc_id)
+                if row is None:
+                    row = len(self._ids)
+                    self._row_of[doc_id] = row
+                    self._ids.append(doc_id)
+                    self._documents.append(document)
+                    for column in self._columns.values():
+                        column.append(None)
+                    new_rows.append(vector)
+                else:
+                    if row < len(self._vectors):
+                        if not copied:
+                            # Copy on write: searches running without the lock may hold the old array
+                            self._vectors = self._vectors.copy()
+                            copied = True
+                        self._vectors[row] = vector
+                    else:
+                        new_rows[row - len(self._vectors)] = vector
+                    self._documents[row] = document
+                    for column in self._columns.values():
+                        column[row] = None
+                for key, value in metadata.items():
+                    if key not in self._columns:
+                        self._columns[key] = [None] * len(self._ids)
+                    self._columns[key][row] = value
+            if new_rows:
+                self._pending.append(np.asarray(new_rows, dtype=self.dtype))
+            self._codes = None
+            self._partitions = {}
+
+    def delete(self, ids):
+        with self._lock:
+            self._maybe_reload()
+            self._journal.append(("delete", (ids,)))  # the ids may exist in a generation we have not seen yet
+            rows = [self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of]
+            if not rows:
+                return
+            self._make_writable()
+            self._compact()
+            keep = np.ones(len(self._ids), dtype=bool)
+            keep[rows] = False
+            kept_rows = np.flatnonzero(keep)
+            self._vectors = self._vectors[keep]
+            self._ids = [self._ids[row] for row in kept_rows]
+            self._documents = [self._documents[row] for row in kept_rows]
+            self._columns = {key: [column[row] for row in kept_rows] for key, column in self._columns.items()}
+            self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            self._codes = None
+            self._partitions = {}
+
+    # --- reads ---
+    def version(self) -> str:
+        # Every flush, from any process, writes a new generation
+        with self._lock:
+            self._maybe_reload()
+            return str(self._generation)
+
+    def count(self) -> int:
+        with self._lock:
+            self._maybe_reload()
+            return len(self._ids)
+
+    def get(self, ids=None, limit=None, offset=0):
+        with self._lock:
+            self._maybe_reload()
+            view = _IndexView(self)
+            if ids is not None:
+                rows = [self._row_of[doc_id] for doc_id in ids if doc_id in self._row_of]
+            else:
+                end = len(self._ids) if limit is None else min(offset + limit, len(self._ids))
+                rows = range(offset, end)
+            return {
+                "ids": [view.ids[row] for row in rows],
+                "documents": [view.document(row) for row in rows],
+                "metadatas": [view.metadata(row) for row in rows],
+            }
+
+    def query(self, query_embeddings, n_results, where=None):
+        queries = self._normalize(query_embeddings)
+        with self._lock:
+            self._maybe_reload()
+            self._compact()
+            self._ensure_codes()
+            candidates = None
+            if where and self._ids:
+                candidates = np.flatnonzero(self._where_mask(where))
+            view = _IndexView(self)
+
+        # Searched without the lock, so concurrent queries (and sidecar connections) run in parallel
+        hits = view.search(queries, n_results, candidates) if view.count else [([], [])] * len(queries)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for rows, similarities in hits:
+            results["ids"].append([view.ids[row] for row in rows])
+            results["documents"].append([view.document(row) for row in rows])
+            results["metadatas"].append([view.metadata(row) for row in rows])
+            results["distances"].append([float(1.0 - similarity) for similarity in similarities])
+        return results
+
+    def ids_matching(self, where):
+        with self._lock:
+            self._maybe_reload()
+            if not self._ids:
+                return []
+            return [self._ids[row] for row in np.flatnonzero(self._where_mask(where))]
+
+    def measure_recall(self, k: int = 10, sample_size: int = 200, seed: int = 0) -> Optional[float]:
+        """
+        recall@k of the quantized search against exact search, using a sample of stored vectors
+        as queries. None when the index is not quantized or empty.
+        """
+        with self._lock:
+            self._compact()
+            if self.quantization == "none" or not self._ids:
+                return None
+            self._ensure_codes()
+            view = _IndexView(self)
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(view.count, size=min(sample_size, view.count), replace=False)
+        queries = self._normalize(view.vectors[np.sort(sample)])
+        approx = view.search(queries, k)
+        exact = view.search(queries, k, exact=True)
+        found = sum(len(set(a_rows.tolist()) & set(e_rows.tolist()))
+                    for (a_rows, _), (e_rows, _) in zip(approx, exact))
+        expected = sum(len(e_rows) for e_rows, _ in exact)
+        return found / expected if expected else None
+
+    def _where_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """Boolean row mask for a Chroma-style filter ($and/$or, $eq/$ne/$in/$nin)."""
+        mask = np.ones(len(self._ids), dtype=bool)
+        for key, condition in where.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self._where_mask(sub)
+            elif key == "$or":
+                mask &= np.logical_or.reduce([self._where_mask(sub) for sub in condition])
+            else:
+                op, value = next(iter(condition.items())) if isinstance(condition, dict) else ("$eq", condition)
+                if op in ("$eq", "$in"):
+                    mask &= self._partition_mask(key, [value] if op == "$eq" else value)
+                    continue
+                column = self._columns.get(key, [None] * len(self._ids))
+                if op == "$ne":
+                    matches = (v != value for v in column)
+                elif op == "$nin":
+                    values = set(value)
+                    matches = (v not in values for v in column)
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+                mask &= np.fromiter(matches, dtype=bool, count=len(column))
+        return mask
+
+    def _partition_mask(self, key: str, values: List[Any]) -> np.ndarray:
+        """
+        Rows whose `key` equals one of values. The column is grouped into value -> rows once and
+        reused until the next write, so a subject filter costs a lookup instead of a column scan.
+        """
+        partitions = self._partitions.get(key)
+        if partitions is None:
+            grouped: Dict[Any, List[int]] = {}
+            for row, v in enumerate(self._columns.get(key, ())):
+                if v is not None:
+                    grouped.setdefault(v, []).append(row)
+            partitions = {v: np.asarray(rows, dtype=np.int64) for v, rows in grouped.items()}
+            self._partitions[key] = partitions
+        mask = np.zeros(len(self._ids), dtype=bool)
+        for value in values:
+            rows = partitions.get(value)
+            if rows is not None:
+                mask[rows] = True
+        return mask
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": self.name, "count": len(self._ids), "dim": self._dim,
+                    "dtype": self.dtype.name, "generation": self._generation,
+                    "quantization": self.quantization, "rerank_factor": self.rerank_factor,
+                    "vector_bytes": int(self._vectors.nbytes),
+                    "code_bytes": int(self._codes.nbytes) if self._codes is not None else 0}
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first."""
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def create_vector_backend(kind: str, persist_directory: str, collection_name: str,
+                          vector_dtype: str = "float32", quantization: str = "none",
+                          rerank_factor: int = 4) -> VectorBackend:
+    """Backend factory for VectorStore ('chroma' or 'numpy'). Quantization applies to 'numpy' only."""
+    if kind == "chroma":
+        if quantization != "none":
+            print(f"--- VectorStore: Quantization '{quantization}' is only supported by the numpy backend, ignoring")
+        return ChromaBackend(persist_directory, collection_name)
+    if kind == "numpy":
+        return NumpyBackend(os.path.join(persist_directory, f"numpy_{collection_name}"), dtype=vector_dtype,
+                            quantization=quantization, rerank_factor=rerank_factor)
+    raise ValueError(f"Unknown vector backend: {kind} (expected one of {BACKENDS})")
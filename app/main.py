@@ -1,51 +1,333 @@
+import time
+_IMPORT_STARTED = time.perf_counter()  # app import time is reported on /info/status
 import os
+import signal
+import asyncio
+from typing import List, Optional
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
-from app.core.rag import EmbeddingManager, VectorStore, RAGRetriever, GeminiLLM, RAGService
+from app.core.rag import EmbeddingManager, VectorStore, RAGRetriever, RAGService
+from app.core.llm import create_llm
+from app.core.llm_dispatch import LLMDispatcher, DispatchingLLM
 from app.api.upload import upload_router, initialize_temp_rag_router
-from app.models.schemas import QueryRequest, RAGResponse, SimpleRAGResponse
-from app.core.quiz_gen import QuizGenerator
+from app.api.sse import rag_event_stream, source_metadata
+from app.models.schemas import (
+    QueryRequest, RAGResponse, SimpleRAGResponse, BatchQueryResponse, BatchContextResponse
+)
+from app.core.quiz_gen import QuizGenerator, validate_mcq
+from app.core.quiz_bank import QuizBank
+from app.core.temp_rag import TempSessionStore
+from app.core.inference_service import (
+    InferenceClient, RemoteEmbeddingManager, RemoteVectorStore, RemoteTempSessionStore
+)
+from app.core.embedding_cache import create_embedding_cache
+from app.core.page_cache import create_page_cache
+from app.core import concurrency
+from app.core.concurrency import run_blocking
+from app.core.answer_cache import AnswerCache
+from app.core.context import ContextPacker
+from app.core import metrics
+from app.core.startup import STARTUP
+from app.core.data_prep import DataProcessor
+from app.core.ingest import IncrementalIngestor
+from app.core.subjects import SubjectRouter, build_filter, load_subject_tags
+from app.core.jobs import IngestionJobQueue, IngestThrottle
+
+STARTUP.record_import("app.main", time.perf_counter() - _IMPORT_STARTED)
 
 # Load environment
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")  # "gemini", or "fake" for load tests (FAKE_LLM_* knobs)
+LLM_RPM = float(os.getenv("LLM_RPM", "0"))  # provider requests/minute budget, 0 = unlimited
+LLM_TPM = float(os.getenv("LLM_TPM", "0"))  # provider tokens/minute budget (prompt + expected output), 0 = unlimited
+LLM_DISPATCH_CONCURRENCY = int(os.getenv("LLM_DISPATCH_CONCURRENCY", "0"))  # provider calls in flight, 0 = unlimited
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_MS = float(os.getenv("LLM_RETRY_BASE_MS", "500"))
+LLM_RETRY_MAX_MS = float(os.getenv("LLM_RETRY_MAX_MS", "20000"))
+LLM_COALESCE = os.getenv("LLM_COALESCE", "true").lower() == "true"  # identical in-flight prompts share one call
+LLM_SYNC_TIMEOUT_S = float(os.getenv("LLM_SYNC_TIMEOUT_S", "300"))  # max wait of a blocking (thread) LLM call
 VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "data/vector_store")
 CHROMA_COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "study_buddy_docs")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" or "numpy" (memory-mapped exact search)
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")  # numpy backend only; float16 halves the index, searches slower
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")  # numpy backend only: none, int8 or binary
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))  # quantized search re-scores top_k * factor
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
 GENERATION_MODEL_NAME = os.getenv("GENERATION_MODEL_NAME", "gemini-2.5-flash")
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+EMBED_SEARCH_CONCURRENCY = int(os.getenv("EMBED_SEARCH_CONCURRENCY", "8"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "32"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "1"))
+TEMP_INGEST_CONCURRENCY = int(os.getenv("TEMP_INGEST_CONCURRENCY", "4"))
+PDF_DIRECTORY = os.getenv("PDF_DIRECTORY", "data/pdfs")
+SUBJECT_TAGS_FILE = os.getenv("SUBJECT_TAGS_FILE", os.path.join(PDF_DIRECTORY, "subjects.json"))  # {file: subject}
+SUBJECT_ROUTING = os.getenv("SUBJECT_ROUTING", "false").lower() == "true"  # route unfiltered queries; tag files first
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.3"))  # below this best-centroid score: search everything
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))  # also search subjects this close to the best one
+INGEST_JOBS_DIR = os.getenv("INGEST_JOBS_DIR", "data/ingest_jobs")
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", "1"))  # 0 parses in the job thread
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "32"))  # chunks per embed/upsert step
+INGEST_CHECKPOINT_BATCHES = int(os.getenv("INGEST_CHECKPOINT_BATCHES", "8"))  # flush + manifest every N batches
+INGEST_CHECKPOINT_SECONDS = float(os.getenv("INGEST_CHECKPOINT_SECONDS", "30"))  # ... or every T seconds
+INGEST_MAX_CHUNKS_PER_SECOND = float(os.getenv("INGEST_MAX_CHUNKS_PER_SECOND", "0"))  # 0 = no cap
+INGEST_YIELD_MAX_MS = float(os.getenv("INGEST_YIELD_MAX_MS", "2000"))  # max pause per batch while queries run
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", "1.01"))  # > 1.0: exact tier only
+TEMP_MEMORY_BUDGET_MB = int(os.getenv("TEMP_MEMORY_BUDGET_MB", "512"))
+TEMP_SESSION_TTL_SECONDS = float(os.getenv("TEMP_SESSION_TTL_SECONDS", "3600"))
+TEMP_UPLOAD_MAX_MB = int(os.getenv("TEMP_UPLOAD_MAX_MB", "64"))  # cap on the in-memory /rag/upload_temp body
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))  # 0 disables the budget
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.85"))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "64"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))  # LLM calls in flight per batch request
+QUIZ_BANK_DIR = os.getenv("QUIZ_BANK_DIR", "data/quiz_bank")
+QUIZ_BANK_TARGET_SIZE = int(os.getenv("QUIZ_BANK_TARGET_SIZE", "30"))
+QUIZ_BANK_LOW_WATERMARK = int(os.getenv("QUIZ_BANK_LOW_WATERMARK", "10"))
+QUIZ_BANK_MAX_SERVES = int(os.getenv("QUIZ_BANK_MAX_SERVES", "3"))
+QUIZ_BANK_TOPICS = [t for t in os.getenv("QUIZ_BANK_TOPICS", "").split(",") if t.strip()]
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")  # "shared": model + index + temp store in one sidecar
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/study_buddy_inference.sock")
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", "")  # shared mode: gunicorn.conf.py generates one per start
+INFERENCE_CONNECT_TIMEOUT_S = float(os.getenv("INFERENCE_CONNECT_TIMEOUT_S", "300"))
+WARMUP_IN_BACKGROUND = os.getenv("WARMUP_IN_BACKGROUND", "true").lower() == "true"  # false: load before serving
+WARMUP_FAILURE_EXIT_DELAY_S = float(os.getenv("WARMUP_FAILURE_EXIT_DELAY_S", "10"))  # then a gunicorn worker exits
 
 # Global objects
 rag_service: RAGService = None
 quiz_generator: QuizGenerator = None
+quiz_bank: QuizBank = None
+ingestion_jobs: IngestionJobQueue = None
+llm_dispatcher: LLMDispatcher = None
+inference_client: InferenceClient = None
+subject_router: SubjectRouter = None
 
 # Allowed frontend origins
 allowed_origins = ["http://localhost:5173", "http://127.0.0.1:5173"]
 
+def _connect_inference() -> InferenceClient:
+    """Shared mode: waits for the sidecar (it may still be loading the model) and returns the client."""
+    global inference_client
+    if inference_client is None:
+        inference_client = InferenceClient(INFERENCE_SOCKET, INFERENCE_AUTHKEY.encode("utf-8"))
+    inference_client.wait_until_ready(INFERENCE_CONNECT_TIMEOUT_S)
+    return inference_client
+
+
+def _load_embedding_manager() -> EmbeddingManager:
+    if INFERENCE_MODE == "shared":
+        return RemoteEmbeddingManager(_connect_inference(), EMBEDDING_MODEL_NAME)
+    embedding_manager = EmbeddingManager(
+        model_name=EMBEDDING_MODEL_NAME,
+        cache=create_embedding_cache(EMBEDDING_MODEL_NAME)
+    )
+    embedding_manager.warm_up()
+    embedding_manager.enable_query_batching(
+        max_batch_size=QUERY_BATCH_MAX_SIZE,
+        max_wait_ms=QUERY_BATCH_MAX_WAIT_MS,
+        cache_size=QUERY_CACHE_SIZE
+    )
+    return embedding_manager
+
+
+def _open_vector_store() -> VectorStore:
+    if INFERENCE_MODE == "shared":
+        return RemoteVectorStore(_connect_inference(), CHROMA_COLLECTION_NAME, VECTOR_STORE_PATH)
+    return VectorStore(
+        collection_name=CHROMA_COLLECTION_NAME,
+        persist_directory=VECTOR_STORE_PATH,
+        backend=VECTOR_BACKEND,
+        vector_dtype=VECTOR_DTYPE,
+        quantization=VECTOR_QUANTIZATION,
+        rerank_factor=VECTOR_RERANK_FACTOR
+    )
+
+
+def _build_services(embedding_manager: EmbeddingManager, vector_store: VectorStore, llm_client):
+    """Wires the loaded components together and publishes them to the endpoints."""
+    global rag_service, quiz_generator, quiz_bank, ingestion_jobs, subject_router
+
+    router = SubjectRouter(vector_store, embedding_manager, min_score=ROUTER_MIN_SCORE, margin=ROUTER_MARGIN)
+    retriever = RAGRetriever(vector_store, embedding_manager, router=router if SUBJECT_ROUTING else None)
+    answer_cache = None
+    if ANSWER_CACHE_MAX_ENTRIES > 0:
+        answer_cache = AnswerCache(
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+            semantic_threshold=ANSWER_CACHE_SEMANTIC_THRESHOLD
+        )
+    context_packer = ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD)
+    service = RAGService(vector_store, retriever, llm_client, answer_cache=answer_cache,
+                         context_packer=context_packer)
+    generator = QuizGenerator(retriever=retriever, llm=llm_client)
+    bank = QuizBank(
+        generator,
+        bank_directory=QUIZ_BANK_DIR,
+        target_size=QUIZ_BANK_TARGET_SIZE,
+        low_watermark=QUIZ_BANK_LOW_WATERMARK,
+        max_serves=QUIZ_BANK_MAX_SERVES
+    )
+    if INFERENCE_MODE == "shared":
+        temp_store = RemoteTempSessionStore(inference_client)  # visible to every worker
+    else:
+        temp_store = TempSessionStore(
+            memory_budget_bytes=TEMP_MEMORY_BUDGET_MB * 1024 * 1024,
+            ttl_seconds=TEMP_SESSION_TTL_SECONDS
+        )
+    # Permanent uploads: parse in a worker process, embed/upsert in throttled batches off the request path
+    page_cache = create_page_cache()
+    job_queue = IngestionJobQueue(
+        IncrementalIngestor(DataProcessor(pdf_directory=PDF_DIRECTORY, page_cache=page_cache),
+                            embedding_manager, vector_store, subject_tags=load_subject_tags(SUBJECT_TAGS_FILE),
+                            checkpoint_batches=INGEST_CHECKPOINT_BATCHES,
+                            checkpoint_seconds=INGEST_CHECKPOINT_SECONDS),
+        jobs_dir=INGEST_JOBS_DIR,
+        parse_workers=INGEST_PARSE_WORKERS,
+        batch_size=INGEST_BATCH_SIZE,
+        throttle=IngestThrottle(
+            max_chunks_per_second=INGEST_MAX_CHUNKS_PER_SECOND,
+            max_yield_seconds=INGEST_YIELD_MAX_MS / 1000.0,
+            busy=lambda: concurrency.active(concurrency.STAGE_EMBED_SEARCH) > 0
+        )
+    )
+    initialize_temp_rag_router(service, temp_store, job_queue, temp_upload_max_bytes=TEMP_UPLOAD_MAX_MB * 1024 * 1024)
+
+    # Component stats exported on /metrics (read at scrape time)
+    metrics.REGISTRY.register_collector("vector_store", vector_store.backend.stats)
+    metrics.REGISTRY.register_collector("temp_store", temp_store.stats)
+    metrics.REGISTRY.register_collector("quiz_bank", bank.stats)
+    metrics.REGISTRY.register_collector("ingest_jobs", job_queue.stats)
+    metrics.REGISTRY.register_collector("query_embedding", embedding_manager.query_batcher.stats)
+    metrics.REGISTRY.register_collector("subject_router", router.stats)
+    if answer_cache is not None:
+        metrics.REGISTRY.register_collector("answer_cache", answer_cache.stats)
+    if embedding_manager.cache is not None:
+        metrics.REGISTRY.register_collector("embedding_cache", embedding_manager.cache.stats)
+    if page_cache is not None:
+        metrics.REGISTRY.register_collector("page_cache", page_cache.stats)
+    if inference_client is not None:
+        metrics.REGISTRY.register_collector("inference_sidecar", lambda: inference_client.call("server", "stats"))
+
+    rag_service, quiz_generator, quiz_bank, ingestion_jobs = service, generator, bank, job_queue
+    subject_router = router
+    subject_router.start()  # centroids are built in the background; queries search everything meanwhile
+    ingestion_jobs.start()  # also resumes jobs left unfinished by a previous process
+    quiz_bank.prefill(QUIZ_BANK_TOPICS)  # background, does not delay readiness
+
+
+async def _load_component(name: str, fn, *args):
+    def load():
+        with STARTUP.component(name):
+            return fn(*args)
+    return await run_blocking(concurrency.STAGE_STARTUP, load)
+
+
+async def warm_up() -> bool:
+    """
+    Loads the heavy components (model import + load + dummy encode, vector store, LLM client)
+    side by side on the blocking pool, then wires the services. Endpoints answer 503 until
+    rag_service is set; /info/status shows per-component progress meanwhile.
+    """
+    global llm_dispatcher
+    print("--- Initializing RAG Components ---")
+    try:
+        embedding_manager, vector_store, llm_client = await asyncio.gather(
+            _load_component("embedding_model", _load_embedding_manager),
+            _load_component("vector_store", _open_vector_store),
+            _load_component("llm", create_llm, LLM_PROVIDER, GENERATION_MODEL_NAME, GEMINI_API_KEY),
+        )
+        # Every LLM call (RAG, quiz, bank refills, all threads) goes through one dispatcher on this loop
+        llm_dispatcher = LLMDispatcher(
+            requests_per_minute=LLM_RPM,
+            tokens_per_minute=LLM_TPM,
+            max_concurrency=LLM_DISPATCH_CONCURRENCY,
+            max_retries=LLM_MAX_RETRIES,
+            retry_base_seconds=LLM_RETRY_BASE_MS / 1000.0,
+            retry_max_seconds=LLM_RETRY_MAX_MS / 1000.0,
+            coalesce=LLM_COALESCE,
+            loop=asyncio.get_running_loop(),
+            sync_timeout_seconds=LLM_SYNC_TIMEOUT_S
+        )
+        metrics.REGISTRY.register_collector("llm_dispatch", llm_dispatcher.stats)
+        llm_client = DispatchingLLM(llm_client, llm_dispatcher)
+        await _load_component("services", _build_services, embedding_manager, vector_store, llm_client)
+    except Exception as e:
+        # The failed component and its error stay visible on /info/status
+        print(f"--- Startup failed: {e}")
+        return False
+    print(f"--- RAG Components ready ({STARTUP.snapshot()['uptime_s']}s after start) ---")
+    return True
+
+
+async def _warm_up_or_exit():
+    """
+    Background warm-up. On failure a gunicorn worker stops itself (after a short delay, so the
+    error is visible on /info/status and a persistent fault does not respawn workers in a tight
+    loop) and gunicorn replaces it with a fresh process. Without gunicorn (plain uvicorn) there is
+    nothing to replace the process, so it keeps serving 503 with the failure on /info/status.
+    """
+    if await warm_up():
+        return
+    if os.getenv("GUNICORN_WORKER") != "1":
+        print("--- Warm-up failed; serving 503 until restarted (see /info/status)")
+        return
+    print(f"--- Stopping worker in {WARMUP_FAILURE_EXIT_DELAY_S:.0f}s so it gets replaced")
+    await asyncio.sleep(WARMUP_FAILURE_EXIT_DELAY_S)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
 # FastAPI lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global rag_service, quiz_generator
-
-    if not GEMINI_API_KEY:
+    if LLM_PROVIDER == "gemini" and not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY not set. Cannot start server.")
+    if INFERENCE_MODE == "shared" and not INFERENCE_AUTHKEY:
+        # The sidecar unpickles requests, so it must never accept a guessable key
+        raise ValueError("INFERENCE_AUTHKEY not set (INFERENCE_MODE=shared). Cannot start server.")
 
-    print("--- Initializing RAG Components ---")
-    embedding_manager = EmbeddingManager(model_name=EMBEDDING_MODEL_NAME)
-    vector_store = VectorStore(
-        collection_name=CHROMA_COLLECTION_NAME,
-        persist_directory=VECTOR_STORE_PATH
+    # Blocking work (embedding, search, ingestion) runs on a bounded pool, never on the event loop
+    concurrency.configure(
+        blocking_workers=BLOCKING_WORKERS,
+        stage_limits={
+            concurrency.STAGE_EMBED_SEARCH: EMBED_SEARCH_CONCURRENCY,
+            concurrency.STAGE_LLM: LLM_CONCURRENCY,
+            concurrency.STAGE_INGEST: INGEST_CONCURRENCY,
+            concurrency.STAGE_TEMP_INGEST: TEMP_INGEST_CONCURRENCY,
+        }
     )
-    retriever = RAGRetriever(vector_store, embedding_manager)
-    llm_client = GeminiLLM(model_name=GENERATION_MODEL_NAME, api_key=GEMINI_API_KEY)
-    rag_service = RAGService(vector_store, retriever, llm_client)
-    quiz_generator = QuizGenerator(retriever=retriever, llm=llm_client)
+    STARTUP.register("embedding_model", "vector_store", "llm", "services")
+    metrics.REGISTRY.register_collector("startup", STARTUP.stats)
 
-    initialize_temp_rag_router(rag_service)  # optional
+    # Bind and answer health checks right away; the components load in the background
+    if not WARMUP_IN_BACKGROUND:
+        warm_up_task = asyncio.create_task(warm_up())
+        if not await warm_up_task:
+            raise RuntimeError("RAG components failed to load. Cannot start server.")
+    else:
+        warm_up_task = asyncio.create_task(_warm_up_or_exit())
     yield
+    if not warm_up_task.done():
+        warm_up_task.cancel()
+    if rag_service is not None and rag_service.retriever.embedding_manager.cache is not None:
+        rag_service.retriever.embedding_manager.cache.flush()
+    if llm_dispatcher is not None:
+        llm_dispatcher.close()  # fails pending calls, so quiz-bank refill threads do not block exit
+    if quiz_bank is not None:
+        quiz_bank.shutdown()
+    if ingestion_jobs is not None:
+        ingestion_jobs.shutdown()
+    if inference_client is not None:
+        inference_client.close()
+    concurrency.shutdown()
     print("--- FastAPI Shutdown Complete ---")
 
 
@@ -62,10 +344,32 @@ app.add_middleware(
     allow_headers=["*"],  
 )
 
+# Per-request stage timings -> Server-Timing header + latency histogram
+@app.middleware("http")
+async def server_timing_middleware(request: Request, call_next):
+    token = metrics.start_request_timings()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = metrics.finish_request_timings(token)
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.observe(elapsed, method=request.method, route=getattr(route, "path", "unmatched"),
+                                    status=response.status_code)
+    # For streamed responses this covers retrieval only; the LLM stages are still in the histograms
+    response.headers["Server-Timing"] = metrics.server_timing_header(timings, elapsed)
+    return response
+
+@app.get("/metrics", tags=["Info"], response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # Pydantic model for quiz request
 class QuizRequest(BaseModel):
     topic: str
     num_questions: int = 5
+    subject: Optional[str] = None # Generate only from this subject's chunks
 
 # Health check
 @app.get("/", tags=["Health"])
@@ -78,18 +382,75 @@ async def query_study_buddy(request: QueryRequest):
     if rag_service is None:
         raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
     try:
-        result = rag_service.query_rag(query=request.query, top_k=request.top_k)
+        result = await rag_service.aquery_rag(query=request.query, top_k=request.top_k, mode=request.mode,
+                                              where=request.metadata_filter())
         return {"query": result["query"], "answer": result["answer"]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming RAG query (Server-Sent Events: sources -> token* -> done)
+@app.post("/rag/query/stream", tags=["RAG - Streaming"])
+async def stream_study_buddy(request: QueryRequest, http_request: Request):
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+    try:
+        retrieved_docs = await rag_service.aretrieve(request.query, top_k=request.top_k, mode=request.mode,
+                                                     where=request.metadata_filter())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    context = rag_service.build_context(retrieved_docs)
+    return rag_event_stream(
+        http_request,
+        query=request.query,
+        sources=source_metadata(retrieved_docs),
+        tokens=rag_service.astream_answer(request.query, context)
+    )
+
+# Batch endpoints: one embedding call + one vector search for the whole list, bounded LLM fan-out
+async def _run_batch(requests: List[QueryRequest]):
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+    if len(requests) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch.")
+    items = [{"query": r.query, "top_k": r.top_k, "mode": r.mode, "where": r.metadata_filter()} for r in requests]
+    return await rag_service.abatch_query_rag(items, max_concurrency=BATCH_LLM_CONCURRENCY)
+
+@app.post("/rag/query/batch", response_model=BatchQueryResponse, tags=["RAG - Batch"])
+async def query_study_buddy_batch(requests: List[QueryRequest]):
+    results = await _run_batch(requests)
+    return {"results": [
+        {"index": i, "query": r["query"], "answer": r.get("answer"), "error": r.get("error")}
+        for i, r in enumerate(results)
+    ]}
+
+@app.post("/rag/context/batch", response_model=BatchContextResponse, tags=["RAG - Batch"])
+async def retrieve_context_batch(requests: List[QueryRequest]):
+    results = await _run_batch(requests)
+    return {"results": [dict(r, index=i) for i, r in enumerate(results)]}
+
 # Quiz endpoint
 @app.post("/generate-quiz", tags=["Quiz"])
 async def generate_quiz_endpoint(request: QuizRequest):
-    if quiz_generator is None:
+    if quiz_generator is None or quiz_bank is None:
         raise HTTPException(status_code=503, detail="Quiz Generator not initialized.")
     try:
-        quiz_json = quiz_generator.generate_quiz_json(request.topic, request.num_questions)
+        # 1. Serve from the pre-generated bank (milliseconds)
+        quiz_json = await run_blocking(
+            concurrency.STAGE_EMBED_SEARCH, quiz_bank.take, request.topic, request.num_questions, request.subject
+        )
+        if quiz_json is None:
+            # 2. Bank miss: generate on demand and keep the questions for later requests
+            generated = await quiz_generator.agenerate_quiz_json(
+                request.topic, request.num_questions,
+                where=build_filter(subjects=[request.subject] if request.subject else None)
+            )
+            quiz_json = [q for q in generated if validate_mcq(q)]
+            # Already served once, by this response
+            await run_blocking(concurrency.STAGE_EMBED_SEARCH, quiz_bank.add, request.topic, quiz_json,
+                               served=1, subject=request.subject)
+        if quiz_bank.needs_refill(request.topic, request.subject):
+            quiz_bank.schedule_refill(request.topic, request.subject)
         return quiz_json
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -100,22 +461,43 @@ async def retrieve_context_only(request: QueryRequest):
     if rag_service is None:
         raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
     try:
-        result = rag_service.query_rag(query=request.query, top_k=request.top_k)
+        result = await rag_service.aquery_rag(query=request.query, top_k=request.top_k, mode=request.mode,
+                                              where=request.metadata_filter())
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Subject partitions (as of the router's last scan)
+@app.get("/rag/subjects", tags=["Info"])
+def list_subjects():
+    if subject_router is None:
+        raise HTTPException(status_code=503, detail="RAG Service is not initialized.")
+    return {"subjects": subject_router.chunk_counts, "routing": SUBJECT_ROUTING, "router": subject_router.stats()}
+
 # System status
 @app.get("/info/status", tags=["Info"])
 def get_system_status():
     if rag_service is None:
-        return {"status": "Starting Up/Uninitialized", "documents_loaded": 0, "error": True}
+        return {
+            "status": "Error" if STARTUP.has_failed() else "Starting Up/Uninitialized",
+            "documents_loaded": 0,
+            "error": True,
+            "startup": STARTUP.snapshot()
+        }
     try:
         return {
             "status": "Ready",
+            "inference_mode": INFERENCE_MODE,
+            "startup": STARTUP.snapshot(),
             "documents_loaded": rag_service.vector_store.get_count(),
             "embedding_model": rag_service.retriever.embedding_manager.model_name,
-            "generation_model": rag_service.llm.model_name
+            "generation_model": rag_service.llm.model_name,
+            "vector_backend": rag_service.vector_store.backend.stats(),
+            "answer_cache": rag_service.answer_cache.stats() if rag_service.answer_cache else None,
+            "quiz_bank": quiz_bank.stats() if quiz_bank else None,
+            "ingest_jobs": ingestion_jobs.stats() if ingestion_jobs else None,
+            "llm_dispatch": llm_dispatcher.stats() if llm_dispatcher else None,
+            "subject_router": subject_router.stats() if subject_router else None
         }
     except Exception:
         return {"status": "Error", "documents_loaded": 0, "error": True}
\ No newline at end of file
@@ -1,10 +1,17 @@
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Literal, Optional
+from app.core.subjects import build_filter
 
 # Input model for the API
 class QueryRequest(BaseModel):
     query: str
     top_k: int = 5 # Number of chunks to retrieve
+    mode: Literal["dense", "lexical", "hybrid"] = "dense" # Vector, BM25, or fused retrieval
+    subject: Optional[str] = None # Search only this subject's chunks (e.g. "cs"); None = routed automatically
+    sources: Optional[List[str]] = None # Search only these source files
+
+    def metadata_filter(self) -> Optional[Dict[str, Any]]:
+        return build_filter(subjects=[self.subject] if self.subject else None, sources=self.sources)
 
 # Output models
 class DocumentChunk(BaseModel):
@@ -21,4 +28,20 @@ class RAGResponse(BaseModel):
 
 class SimpleRAGResponse(BaseModel):
     query: str
-    answer: str
\ No newline at end of file
+    answer: str
+
+# Batch endpoints: one item per input query, in input order
+class BatchQueryItem(BaseModel):
+    index: int
+    query: str
+    answer: Optional[str] = None
+    error: Optional[str] = None # Set instead of answer when this item failed
+
+class BatchContextItem(BatchQueryItem):
+    retrieved_documents: List[DocumentChunk] = []
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryItem]
+
+class BatchContextResponse(BaseModel):
+    results: List[BatchContextItem]
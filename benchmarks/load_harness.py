@@ -0,0 +1,295 @@
+"""
+End-to-end HTTP load test: mixed concurrent traffic against /rag/query, /rag/temp_query,
+/rag/upload and /generate-quiz, reporting throughput, tail latency and error rates per endpoint
+and per gunicorn worker count.
+
+By default the server is started here for each worker count with LLM_PROVIDER=fake, so no
+Gemini key or network is needed; --url targets an already running server instead.
+Requires httpx (pip install httpx).
+
+    python -m benchmarks.load_harness --workers 1,2,4 --concurrency 32 --duration 60 --output load.json
+    python -m benchmarks.load_harness --url http://127.0.0.1:8000 --mix query=1 --duration 30
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import httpx
+
+from benchmarks.synthetic_corpus import TOPICS, synthetic_queries
+
+ENDPOINTS = ("query", "temp_query", "upload", "quiz")
+DEFAULT_MIX = "query=6,temp_query=2,upload=1,quiz=1"
+LLM_ERROR_PREFIX = "Error:"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' in --mix (expected {', '.join(ENDPOINTS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def _default_upload_file(pdf_dir: str) -> Optional[Path]:
+    pdfs = sorted(Path(pdf_dir).glob("*.pdf"), key=lambda p: p.stat().st_size)
+    return pdfs[0] if pdfs else None
+
+
+class LoadGenerator:
+    """
+    Closed-loop load: `concurrency` virtual users each send one request at a time, picking the
+    endpoint by the mix weights. Each user has its own temp-upload session, uploaded once before
+    measuring so temp queries have something to hit.
+    """
+
+    def __init__(self, base_url: str, mix: Dict[str, float], concurrency: int, duration_s: float,
+                 upload_name: str, upload_bytes: bytes, top_k: int = 5, think_ms: float = 0.0,
+                 timeout_s: float = 120.0, seed: int = 0):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.concurrency = concurrency
+        self.duration_s = duration_s
+        self.upload_name = upload_name
+        self.upload_bytes = upload_bytes
+        self.top_k = top_k
+        self.think_s = think_ms / 1000.0
+        self.timeout_s = timeout_s
+        self.seed = seed
+        self.queries = [query for query, _ in synthetic_queries(200, seed=seed)]
+        self.topics = [topic.replace("_", " ") for topic in TOPICS]
+        # (endpoint, status, seconds, note); status 0 = transport error
+        self.records: List[Tuple[str, int, float, str]] = []
+
+    async def _send(self, client: httpx.AsyncClient, endpoint: str, session_id: str,
+                    rng: random.Random) -> Tuple[int, str]:
+        headers = {"X-Session-Id": session_id}
+        if endpoint == "upload":
+            files = {"file": (self.upload_name, self.upload_bytes, "application/pdf")}
+            response = await client.post("/rag/upload", files=files, headers=headers)
+            return response.status_code, ""
+        if endpoint == "quiz":
+            body = {"topic": rng.choice(self.topics), "num_questions": 5}
+            response = await client.post("/generate-quiz", json=body)
+            return response.status_code, ""
+
+        path = "/rag/query" if endpoint == "query" else "/rag/temp_query"
+        body = {"query": rng.choice(self.queries), "top_k": self.top_k}
+        response = await client.post(path, json=body, headers=headers)
+        note = ""
+        if response.status_code == 200:
+            answer = response.json().get("answer", "")
+            if LLM_ERROR_PREFIX in answer[:40]:
+                note = "llm_error"  # 200 with the LLM fallback answer
+            elif endpoint == "temp_query" and answer.startswith("[Answer from Main DB]"):
+                note = "temp_miss"  # session data not on the worker that served this request
+        return response.status_code, note
+
+    async def _user(self, client: httpx.AsyncClient, user: int, deadline: float):
+        rng = random.Random(self.seed * 1000 + user)
+        session_id = f"loadtest-{user}"
+        names, weights = list(self.mix), list(self.mix.values())
+        try:
+            await self._send(client, "upload", session_id, rng)
+        except httpx.HTTPError:
+            pass
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                status, note = await self._send(client, endpoint, session_id, rng)
+            except httpx.HTTPError as e:
+                status, note = 0, type(e).__name__
+            self.records.append((endpoint, status, time.perf_counter() - start, note))
+            if self.think_s:
+                await asyncio.sleep(self.think_s)
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout_s, limits=limits) as client:
+            started = time.perf_counter()
+            deadline = started + self.duration_s
+            await asyncio.gather(*(self._user(client, user, deadline) for user in range(self.concurrency)))
+            elapsed = time.perf_counter() - started
+        return summarize(self.records, elapsed)
+
+
+def _summary(records: List[Tuple[str, int, float, str]], elapsed: float) -> Dict[str, Any]:
+    latencies_ms = np.asarray([seconds for _, _, seconds, _ in records]) * 1000.0
+    statuses: Dict[str, int] = {}
+    notes: Dict[str, int] = {}
+    for _, status, _, note in records:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if note:
+            notes[note] = notes.get(note, 0) + 1
+    errors = sum(1 for _, status, _, _ in records if not 200 <= status < 300)
+    return {
+        "requests": len(records),
+        "throughput_per_s": round(len(records) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(errors / len(records), 4),
+        "llm_error_rate": round(notes.get("llm_error", 0) / len(records), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 1),
+        "max_ms": round(float(latencies_ms.max()), 1),
+        "status_counts": statuses,
+        "notes": notes,
+    }
+
+
+def summarize(records: List[Tuple[str, int, float, str]], elapsed: float) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"elapsed_s": round(elapsed, 2)}
+    if not records:
+        return result
+    result["overall"] = _summary(records, elapsed)
+    for endpoint in ENDPOINTS:
+        subset = [record for record in records if record[0] == endpoint]
+        if subset:
+            result[endpoint] = _summary(subset, elapsed)
+    return result
+
+
+# --- server management ---
+def start_server(workers: int, port: int, env_overrides: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ, **env_overrides)
+    command = [
+        sys.executable, "-m", "gunicorn", "app.main:app",
+        "-c", "gunicorn.conf.py",  # INFERENCE_MODE=shared starts the inference sidecar
+        "-w", str(workers),
+        "--bind", f"127.0.0.1:{port}",
+        "--timeout", "300",
+    ]
+    print(f"--- LoadTest: Starting server with {workers} worker(s) on port {port}", file=sys.stderr)
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_until_ready(base_url: str, server: subprocess.Popen, timeout_s: float) -> float:
+    """Polls /info/status until every worker reports Ready (approximated by consecutive successes)."""
+    started = time.perf_counter()
+    ready_streak = 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=5.0) as client:
+        while time.perf_counter() - started < timeout_s:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited during startup (code {server.returncode})")
+            try:
+                response = await client.get("/info/status")
+                ready_streak = ready_streak + 1 if response.json().get("status") == "Ready" else 0
+            except (httpx.HTTPError, ValueError):
+                ready_streak = 0
+            if ready_streak >= 5:
+                return time.perf_counter() - started
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"Server not ready after {timeout_s:.0f}s")
+
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    upload_path = Path(args.upload_file) if args.upload_file else _default_upload_file(args.pdf_dir)
+    if upload_path is None and "upload" in mix:
+        raise SystemExit("No PDF to upload: pass --upload-file or drop 'upload' from --mix.")
+    upload_bytes = upload_path.read_bytes() if upload_path else b""
+
+    def generator(base_url: str) -> LoadGenerator:
+        return LoadGenerator(base_url, mix, args.concurrency, args.duration,
+                             upload_name=upload_path.name if upload_path else "", upload_bytes=upload_bytes,
+                             top_k=args.top_k, think_ms=args.think_ms, seed=args.seed)
+
+    if args.url:
+        return {"external": await generator(args.url).run()}
+
+    env_overrides = {
+        "LLM_PROVIDER": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.llm_tokens_per_second),
+        "FAKE_LLM_ERROR_RATE": str(args.llm_error_rate),
+        "QUIZ_BANK_TOPICS": "",  # no background prefill competing with the measured traffic
+        "INFERENCE_MODE": args.inference_mode,
+    }
+    results = {}
+    for workers in [int(w) for w in args.workers.split(",")]:
+        base_url = f"http://127.0.0.1:{args.port}"
+        server = start_server(workers, args.port, env_overrides)
+        try:
+            startup_s = await wait_until_ready(base_url, server, args.startup_timeout)
+            run = await generator(base_url).run()
+            results[f"workers_{workers}"] = dict(run, startup_s=round(startup_s, 1))
+        finally:
+            stop_server(server)
+    return results
+
+
+def print_table(results: Dict[str, Any]):
+    print(f"{'run':<12} {'endpoint':<11} {'reqs':>6} {'rps':>8} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8}",
+          file=sys.stderr)
+    for run_name, run in results.items():
+        for endpoint in ("overall",) + ENDPOINTS:
+            row = run.get(endpoint)
+            if row:
+                print(f"{run_name:<12} {endpoint:<11} {row['requests']:>6} {row['throughput_per_s']:>8.1f} "
+                      f"{row['error_rate'] * 100:>5.1f}% {row['p50_ms']:>8.0f} {row['p95_ms']:>8.0f} "
+                      f"{row['p99_ms']:>8.0f}", file=sys.stderr)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Mixed-traffic HTTP load test for the Study Buddy API.")
+    parser.add_argument("--url", help="Target a running server instead of starting one per worker count.")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated gunicorn worker counts.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent virtual users.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of measured traffic per run.")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between a user's requests.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Endpoint weights (default: {DEFAULT_MIX}).")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--pdf-dir", default="data")
+    parser.add_argument("--upload-file", help="PDF for /rag/upload (default: smallest PDF in --pdf-dir).")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="Fake LLM time to first token.")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--inference-mode", choices=("local", "shared"), default="local",
+                        help="shared: one embedding/search sidecar for all workers.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results JSON here (default: stdout).")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": asyncio.run(run_load(args)),
+    }
+    print_table(report["results"])
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"--- Load test results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,375 @@
+"""
+Offline component benchmarks for ingestion and retrieval.
+
+Runs against the PDFs in data/ plus an optional synthetic corpus, with a stub LLM, so no network
+is needed. Results are written as JSON and can be compared against a saved baseline:
+
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --embedder hashing --synthetic-pages 5000 \\
+        --baseline benchmarks/baseline.json --fail-on-regression
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+from app.core.data_prep import DataProcessor, file_sha256
+from app.core.page_cache import PageTextCache
+from app.core.rag import EmbeddingManager, VectorStore, RAGRetriever, RAGService
+from app.core.context import ContextPacker
+from app.core.lexical import tokenize
+from benchmarks.synthetic_corpus import synthetic_pages, synthetic_queries
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+class HashingEmbedder:
+    """
+    Model-free stand-in for EmbeddingManager (feature-hashed token counts, L2-normalized).
+    Useful for timing the pipeline around the model, or on machines without the model cached.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.model_name = f"hashing-{dim}"
+
+    def generate_embeddings(self, texts: List[str], use_cache: bool = True) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in tokenize(text):
+                h = zlib.crc32(token.encode("utf-8"))  # stable across runs, unlike hash()
+                matrix[i, h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self.generate_embeddings([query])[0]
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        return self.generate_embeddings(queries)
+
+
+class StubLLM:
+    """Offline LLM: a fixed answer after an optional simulated generation delay."""
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.model_name = "stub"
+        self.latency_s = latency_ms / 1000.0
+
+    def generate_rag_response(self, query: str, context: str) -> str:
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        return f"Stub answer from {len(context)} characters of context."
+
+    async def agenerate_rag_response(self, query: str, context: str) -> str:
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return f"Stub answer from {len(context)} characters of context."
+
+
+# --- helpers ---
+def _latency_summary(samples_s: List[float]) -> Dict[str, float]:
+    samples_ms = np.asarray(samples_s) * 1000.0
+    return {
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples_ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 3),
+        "mean_ms": round(float(samples_ms.mean()), 3),
+    }
+
+
+def _rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# --- benchmarks ---
+def bench_extraction(pdf_dir: str, workers: int) -> Dict[str, Any]:
+    """Pages/s for PDF text extraction: serial, from the page cache and (if workers > 1) with the process pool."""
+    processor = DataProcessor(pdf_directory=pdf_dir, max_workers=1)
+    pdf_files = processor.list_pdf_files()
+    result: Dict[str, Any] = {"files": len(pdf_files), "pages": []}
+    if not pdf_files:
+        return result
+
+    start = time.perf_counter()
+    per_file = list(processor.iter_pdf_documents(pdf_files))
+    serial_seconds = time.perf_counter() - start
+    pages = [page for _, file_pages in per_file for page in file_pages]
+    result.update({"pages": pages, "page_count": len(pages), "serial_seconds": round(serial_seconds, 3),
+                   "serial_pages_per_s": _rate(len(pages), serial_seconds)})
+
+    # Rebuild of unchanged files: hash + read back from a page cache filled with the pages above
+    with tempfile.TemporaryDirectory() as cache_dir:
+        page_cache = PageTextCache(cache_dir)
+        for pdf_file, file_pages in per_file:
+            page_cache.put(file_sha256(str(pdf_file)), file_pages)
+        cached = DataProcessor(pdf_directory=pdf_dir, max_workers=1, page_cache=page_cache)
+        start = time.perf_counter()
+        count = sum(len(file_pages) for _, file_pages in cached.iter_pdf_documents(pdf_files))
+        cached_seconds = time.perf_counter() - start
+        result.update({"cached_seconds": round(cached_seconds, 3),
+                       "cached_pages_per_s": _rate(count, cached_seconds),
+                       "cache_bytes": page_cache.stats()["bytes"]})
+
+    if workers > 1:
+        parallel = DataProcessor(pdf_directory=pdf_dir, max_workers=workers)
+        start = time.perf_counter()
+        count = sum(len(file_pages) for _, file_pages in parallel.iter_pdf_documents(pdf_files))
+        parallel_seconds = time.perf_counter() - start
+        result.update({"workers": workers, "parallel_seconds": round(parallel_seconds, 3),
+                       "parallel_pages_per_s": _rate(count, parallel_seconds)})
+    return result
+
+
+def bench_splitting(pages: List[Any], repeats: int = 3) -> Dict[str, Any]:
+    """Chunks/s for DataProcessor.split_documents (best of repeats)."""
+    processor = DataProcessor(pdf_directory="")
+    best, chunks = float("inf"), []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        chunks = processor.split_documents(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        best = min(best, time.perf_counter() - start)
+    return {"chunks": chunks, "chunk_count": len(chunks), "seconds": round(best, 3),
+            "chunks_per_s": _rate(len(chunks), best)}
+
+
+def bench_embedding(embedder: Any, texts: List[str], batch_size: int) -> Dict[str, Any]:
+    """Embeddings/s for generate_embeddings in batch_size batches."""
+    embedder.generate_embeddings(texts[:min(8, len(texts))])  # warm-up
+    start = time.perf_counter()
+    batches = [embedder.generate_embeddings(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    seconds = time.perf_counter() - start
+    return {"embeddings": np.vstack(batches).astype(np.float32), "count": len(texts), "batch_size": batch_size,
+            "seconds": round(seconds, 3), "embeddings_per_s": _rate(len(texts), seconds)}
+
+
+def bench_index(backend: str, quantization: str, chunks: List[Any], embeddings: np.ndarray,
+                workdir: str, batch_size: int) -> Dict[str, Any]:
+    """Index build time (upserts + flush) and time to reopen the built index."""
+    path = os.path.join(workdir, f"{backend}_{quantization}")
+    ids = [f"bench_{i}" for i in range(len(chunks))]
+    store = VectorStore(collection_name="benchmark_docs", persist_directory=path, backend=backend,
+                        quantization=quantization)
+    start = time.perf_counter()
+    for i in range(0, len(chunks), batch_size):
+        store.upsert_documents(chunks[i:i + batch_size], embeddings[i:i + batch_size], ids[i:i + batch_size])
+    store.flush()
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reopened = VectorStore(collection_name="benchmark_docs", persist_directory=path, backend=backend,
+                           quantization=quantization)
+    open_seconds = time.perf_counter() - start
+    return {"store": reopened, "documents": reopened.get_count(), "build_seconds": round(build_seconds, 3),
+            "build_docs_per_s": _rate(len(chunks), build_seconds), "open_seconds": round(open_seconds, 4)}
+
+
+def bench_queries(store: VectorStore, embedder: Any, embeddings: np.ndarray, queries: List[str],
+                  top_k: int) -> Dict[str, Any]:
+    """Retrieval latency per mode and dense recall@k against exact brute-force search."""
+    retriever = RAGRetriever(store, embedder)
+    query_embeddings = embedder.generate_embeddings(queries)
+    result: Dict[str, Any] = {}
+
+    for mode in ("dense", "lexical", "hybrid"):
+        retriever.search(queries[0], query_embeddings[0], top_k=top_k, mode=mode)  # warm-up
+        samples = []
+        for query, query_embedding in zip(queries, query_embeddings):
+            start = time.perf_counter()
+            retriever.search(query, query_embedding, top_k=top_k, mode=mode)
+            samples.append(time.perf_counter() - start)
+        result[mode] = _latency_summary(samples)
+
+    # Ground truth: exact cosine top-k over all chunk embeddings
+    normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    found = 0
+    for query_embedding in query_embeddings:
+        scores = normalized @ (query_embedding / max(np.linalg.norm(query_embedding), 1e-12))
+        exact = {f"bench_{i}" for i in np.argsort(-scores)[:top_k]}
+        retrieved = {doc['id'] for doc in retriever.retrieve_by_embedding(query_embedding, top_k=top_k)}
+        found += len(exact & retrieved)
+    result[f"recall_at_{top_k}"] = round(found / (len(queries) * top_k), 4)
+    return result
+
+
+def bench_end_to_end(store: VectorStore, embedder: Any, queries: List[str], top_k: int,
+                     llm_latency_ms: float) -> Dict[str, Any]:
+    """query_rag latency with the stub LLM (retrieval + context packing + prompt, no network)."""
+    service = RAGService(store, RAGRetriever(store, embedder), StubLLM(llm_latency_ms),
+                         context_packer=ContextPacker())
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        service.query_rag(query, top_k=top_k)
+        samples.append(time.perf_counter() - start)
+    return _latency_summary(samples)
+
+
+# --- baseline comparison ---
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def _direction(metric: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if the metric is informational."""
+    name = metric.rsplit(".", 1)[-1]
+    if name.endswith("_per_s") or name.startswith("recall"):
+        return 1
+    if name.endswith("_ms") or name.endswith("_seconds"):
+        return -1
+    return 0
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Per-metric changes vs the baseline; 'regression' marks changes worse than tolerance (relative)."""
+    current, previous = _flatten(results), _flatten(baseline)
+    rows = []
+    for metric in sorted(set(current) & set(previous)):
+        direction = _direction(metric)
+        if not direction or not previous[metric]:
+            continue
+        change = (current[metric] - previous[metric]) / abs(previous[metric])
+        rows.append({"metric": metric, "baseline": previous[metric], "current": current[metric],
+                     "change": round(change, 4), "regression": direction * change < -tolerance})
+    return rows
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    workdir = tempfile.mkdtemp(prefix="studybuddy_bench_")
+    try:
+        # 1. Extraction (real PDFs) + synthetic pages for scale
+        extraction = bench_extraction(args.pdf_dir, args.workers)
+        pages = extraction.pop("pages")
+        results["extraction"] = extraction
+        if args.synthetic_pages:
+            pages = pages + synthetic_pages(args.synthetic_pages, seed=args.seed)
+        if not pages:
+            raise SystemExit("No pages to benchmark: add PDFs to --pdf-dir or pass --synthetic-pages.")
+
+        # 2. Splitting
+        splitting = bench_splitting(pages)
+        chunks = splitting.pop("chunks")
+        if args.max_chunks and len(chunks) > args.max_chunks:
+            chunks = chunks[:args.max_chunks]
+        results["splitting"] = splitting
+
+        # 3. Embedding
+        if args.embedder == "hashing":
+            embedder = HashingEmbedder()
+        else:
+            embedder = EmbeddingManager(model_name=args.model, cache=None)
+        embedding = bench_embedding(embedder, [chunk.page_content for chunk in chunks], args.batch_size)
+        embeddings = embedding.pop("embeddings")
+        results["embedding"] = dict(embedding, model=embedder.model_name)
+
+        # 4./5. Index build, query latency and recall, end-to-end with the stub LLM, per backend
+        queries = [query for query, _ in synthetic_queries(args.queries, seed=args.seed + 1)]
+        for spec in args.backends.split(","):
+            backend, _, quantization = spec.strip().partition(":")
+            label = f"{backend}_{quantization}" if quantization else backend
+            index = bench_index(backend, quantization or "none", chunks, embeddings, workdir, args.batch_size)
+            store = index.pop("store")
+            results[f"index_{label}"] = index
+            results[f"query_{label}"] = bench_queries(store, embedder, embeddings, queries, args.top_k)
+            results[f"end_to_end_{label}"] = bench_end_to_end(store, embedder, queries, args.top_k,
+                                                              args.llm_latency_ms)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline ingestion/retrieval benchmarks for Study Buddy.")
+    parser.add_argument("--pdf-dir", default="data", help="Directory with the PDFs to extract (default: data).")
+    parser.add_argument("--synthetic-pages", type=int, default=0, help="Extra synthetic pages for scale tests.")
+    parser.add_argument("--max-chunks", type=int, default=0, help="Cap on chunks embedded/indexed (0 = all).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Process pool size for extraction.")
+    parser.add_argument("--embedder", choices=("model", "hashing"), default="model",
+                        help="'model' = EmbeddingManager (model must be cached locally), 'hashing' = no model.")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2"))
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--backends", default="chroma,numpy",
+                        help="Comma-separated backend[:quantization] list, e.g. chroma,numpy,numpy:int8.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated stub LLM latency.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results JSON here (default: stdout).")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Relative change counted as a regression.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit 1 if any metric regressed.")
+    parser.add_argument("--save-baseline", help="Also write the results as a new baseline file.")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": run(args),
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        comparison = compare_to_baseline(report["results"], baseline.get("results", baseline), args.tolerance)
+        report["comparison"] = comparison
+        regressions = [row for row in comparison if row["regression"]]
+        for row in comparison:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(f"{row['metric']:<45} {row['baseline']:>12.3f} -> {row['current']:>12.3f} "
+                  f"({row['change']:+.1%}) {flag}", file=sys.stderr)
+
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"--- Benchmark results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(output, encoding="utf-8")
+        print(f"--- Baseline saved to {args.save_baseline}", file=sys.stderr)
+
+    if regressions and args.fail_on_regression:
+        print(f"--- {len(regressions)} metric(s) regressed beyond {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
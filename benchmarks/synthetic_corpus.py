@@ -0,0 +1,51 @@
+import random
+from typing import List, Tuple
+from langchain_core.documents import Document
+
+# Topic vocabularies give the corpus real structure: queries about a topic have true neighbours,
+# so dense, lexical and hybrid retrieval all have something to find.
+TOPICS = {
+    "graphs": "graph vertex edge dijkstra shortest path bfs dfs spanning tree kruskal prim cycle degree adjacency",
+    "databases": "relation schema normal form bcnf join index transaction acid lock serializability query tuple",
+    "networks": "packet router tcp udp congestion window subnet ip address routing protocol latency bandwidth",
+    "os": "process thread scheduler deadlock semaphore mutex paging virtual memory page fault kernel interrupt",
+    "probability": "random variable distribution expectation variance bayes conditional independence gaussian",
+    "linear_algebra": "matrix vector eigenvalue eigenvector rank determinant basis subspace orthogonal projection",
+    "compilers": "lexer parser grammar token syntax tree ll lr first follow register allocation optimization",
+    "ml": "gradient descent loss regression classifier overfitting regularization neural network training",
+}
+FILLER = "the of and a to in is that for it as with be on by this which are from at an can".split()
+
+
+def synthetic_pages(num_pages: int, words_per_page: int = 350, num_files: int = 20,
+                    seed: int = 0) -> List[Document]:
+    """Deterministic pages of topic-flavoured text, shaped like PyPDFLoader output."""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    pages = []
+    for i in range(num_pages):
+        topic = topics[i % len(topics)]
+        vocabulary = TOPICS[topic].split()
+        words = [rng.choice(vocabulary) if rng.random() < 0.45 else rng.choice(FILLER)
+                 for _ in range(words_per_page)]
+        # Sentences and paragraphs so the splitter's separators are exercised
+        sentences = [" ".join(words[j:j + 12]).capitalize() + "." for j in range(0, len(words), 12)]
+        text = "\n\n".join(" ".join(sentences[j:j + 5]) for j in range(0, len(sentences), 5))
+        source_file = f"synthetic_{i % num_files:03d}.pdf"
+        pages.append(Document(page_content=text, metadata={
+            "source": source_file, "source_file": source_file, "page": i // num_files,
+            "file_type": "pdf", "topic": topic
+        }))
+    return pages
+
+
+def synthetic_queries(num_queries: int, seed: int = 1) -> List[Tuple[str, str]]:
+    """(query, topic) pairs built from the same vocabularies."""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    queries = []
+    for i in range(num_queries):
+        topic = topics[i % len(topics)]
+        terms = rng.sample(TOPICS[topic].split(), 3)
+        queries.append((f"explain {terms[0]} and {terms[1]} in {terms[2]}", topic))
+    return queries
@@ -108,14 +108,34 @@ const App = () => {
     setError(null);
     setUploadMessage('Indexing document...');
 
-    const formData = new FormData();
-    formData.append('file', selectedFile);
-
     try {
-      const url = `${API_BASE_URL}/rag/upload?save_permanent=${savePermanent}`;
-      const response = await axios.post(url, formData);
+      let response;
+      if (savePermanent) {
+        const formData = new FormData();
+        formData.append('file', selectedFile);
+        response = await axios.post(`${API_BASE_URL}/rag/upload?save_permanent=true`, formData);
+      } else {
+        // Raw body instead of multipart: the server keeps it in RAM and never spools it to disk
+        const url = `${API_BASE_URL}/rag/upload_temp?filename=${encodeURIComponent(selectedFile.name)}`;
+        response = await axios.post(url, selectedFile, { headers: { 'Content-Type': 'application/pdf' } });
+      }
+
+      let statusMsg = response.data.status;
+      // Permanent uploads are indexed by a background job; follow it until it finishes
+      if (response.data.job_id) {
+        let job = response.data;
+        while (job.status === 'Queued' || job.status === 'queued' || job.status === 'running') {
+          await new Promise(resolve => setTimeout(resolve, 1000));
+          job = (await axios.get(`${API_BASE_URL}/rag/jobs/${response.data.job_id}`)).data;
+          const percent = job.progress ? ` ${Math.round(job.progress.percent)}%` : '';
+          setUploadMessage(`Indexing document... (${job.stage}${percent})`);
+        }
+        if (job.status === 'failed') {
+          throw new Error(job.error || 'Indexing failed');
+        }
+        statusMsg = `Saved Permanently (${job.result.status}, ${job.result.chunk_count} chunks)`;
+      }
 
-      const statusMsg = response.data.status;
       setUploadMessage(`✅ Success: ${statusMsg}`);
       setAnswer(`Book "${selectedFile.name}" indexed. Ready to ask questions.`);
       fetchSystemStatus();
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+import secrets
+import threading
+import subprocess
+from dotenv import load_dotenv
+
+# Picked up automatically by `gunicorn app.main:app` run from the repository root.
+load_dotenv()
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# INFERENCE_MODE=shared: one inference_server.py sidecar holds the embedding model, the vector
+# index and the temp uploads for all workers, instead of one copy of each per worker.
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+SIDECAR_RESTART_MAX_DELAY_S = float(os.getenv("SIDECAR_RESTART_MAX_DELAY_S", "60"))
+_sidecar = None
+_stopping = threading.Event()
+_sidecar_lock = threading.Lock()  # a respawn never races on_exit's terminate
+
+
+def _spawn_sidecar():
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          "inference_server.py")])
+
+
+def _supervise(log):
+    """Restarts the sidecar if it dies (crash, OOM kill), backing off while it keeps failing."""
+    global _sidecar
+    delay, started = 1.0, time.monotonic()
+    while not _stopping.wait(1.0):
+        code = _sidecar.poll()
+        if code is None:
+            if time.monotonic() - started > SIDECAR_RESTART_MAX_DELAY_S:
+                delay = 1.0  # stayed up: the next crash restarts quickly again
+            continue
+        log.error("Inference sidecar exited with code %s, restarting in %.0fs", code, delay)
+        if _stopping.wait(delay):
+            return
+        with _sidecar_lock:
+            if _stopping.is_set():
+                return
+            _sidecar = _spawn_sidecar()
+        started = time.monotonic()
+        delay = min(delay * 2, SIDECAR_RESTART_MAX_DELAY_S)
+        log.info("Restarted inference sidecar (pid %s)", _sidecar.pid)
+
+
+def on_starting(server):
+    global _sidecar
+    if INFERENCE_MODE != "shared":
+        return
+    # Set before the workers are forked, so they inherit the key
+    os.environ.setdefault("INFERENCE_AUTHKEY", secrets.token_hex(16))
+    _sidecar = _spawn_sidecar()
+    server.log.info("Started inference sidecar (pid %s)", _sidecar.pid)
+    threading.Thread(target=_supervise, args=(server.log,), name="sidecar-supervisor", daemon=True).start()
+
+
+def post_fork(server, worker):
+    # Tells the app it runs in a gunicorn worker, which the master replaces if it exits
+    os.environ["GUNICORN_WORKER"] = "1"
+
+
+def on_exit(server):
+    _stopping.set()
+    with _sidecar_lock:
+        if _sidecar is None or _sidecar.poll() is not None:
+            return
+        _sidecar.terminate()
+        try:
+            _sidecar.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            _sidecar.kill()
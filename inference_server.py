@@ -0,0 +1,79 @@
+import os
+import sys
+import signal
+from dotenv import load_dotenv
+from app.core.rag import EmbeddingManager, VectorStore
+from app.core.temp_rag import TempSessionStore
+from app.core.embedding_cache import create_embedding_cache
+from app.core.inference_service import InferenceServer
+
+# Shared-inference sidecar (INFERENCE_MODE=shared): gunicorn.conf.py starts it next to the
+# workers, which then use it instead of loading their own model and index.
+load_dotenv()
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/study_buddy_inference.sock")
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", "")  # gunicorn.conf.py generates one per start
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "data/vector_store")
+CHROMA_COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "study_buddy_docs")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+QUERY_BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+TEMP_MEMORY_BUDGET_MB = int(os.getenv("TEMP_MEMORY_BUDGET_MB", "512"))
+TEMP_SESSION_TTL_SECONDS = float(os.getenv("TEMP_SESSION_TTL_SECONDS", "3600"))
+
+
+def _stop(signum, frame):
+    raise SystemExit(0)
+
+
+def main() -> int:
+    if not INFERENCE_AUTHKEY:
+        # Requests are unpickled, so a guessable key would let any local process run code here
+        print("--- Inference sidecar: INFERENCE_AUTHKEY not set. Cannot start.")
+        return 2
+    print("--- Inference sidecar: Loading components ---")
+    embedding_manager = EmbeddingManager(
+        model_name=EMBEDDING_MODEL_NAME,
+        cache=create_embedding_cache(EMBEDDING_MODEL_NAME)
+    )
+    embedding_manager.warm_up()
+    # Single queries from all workers are batched together here
+    embedding_manager.enable_query_batching(
+        max_batch_size=QUERY_BATCH_MAX_SIZE,
+        max_wait_ms=QUERY_BATCH_MAX_WAIT_MS,
+        cache_size=QUERY_CACHE_SIZE
+    )
+    vector_store = VectorStore(
+        collection_name=CHROMA_COLLECTION_NAME,
+        persist_directory=VECTOR_STORE_PATH,
+        backend=VECTOR_BACKEND,
+        vector_dtype=VECTOR_DTYPE,
+        quantization=VECTOR_QUANTIZATION,
+        rerank_factor=VECTOR_RERANK_FACTOR
+    )
+    temp_store = TempSessionStore(
+        memory_budget_bytes=TEMP_MEMORY_BUDGET_MB * 1024 * 1024,
+        ttl_seconds=TEMP_SESSION_TTL_SECONDS
+    )
+
+    server = InferenceServer(INFERENCE_SOCKET, INFERENCE_AUTHKEY.encode("utf-8"),
+                             embedding_manager, vector_store, temp_store)
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if embedding_manager.cache is not None:
+            embedding_manager.cache.flush()
+        print("--- Inference sidecar: Stopped ---")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
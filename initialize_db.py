@@ -1,59 +1,180 @@
 import os
+import sys
+import time
+import shutil
+import argparse
 from dotenv import load_dotenv
-import numpy as np
-from app.core.data_prep import DataProcessor
+from app.core.data_prep import DataProcessor, default_worker_count, file_sha256
 from app.core.rag import EmbeddingManager, VectorStore
+from app.core.ingest import IncrementalIngestor
+from app.core.embedding_cache import create_embedding_cache
+from app.core.page_cache import create_page_cache
+from app.core.subjects import load_subject_tags
 
 # 1. Load Environment Variables
 load_dotenv()
 PDF_DIRECTORY = os.getenv("PDF_DIRECTORY", "data/pdfs")
+SUBJECT_TAGS_FILE = os.getenv("SUBJECT_TAGS_FILE", os.path.join(PDF_DIRECTORY, "subjects.json"))  # {file: subject}
 VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "data/vector_store")
 CHROMA_COLLECTION_NAME = os.getenv("CHROMA_COLLECTION_NAME", "study_buddy_docs")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")  # "chroma" or "numpy" (memory-mapped exact search)
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")  # numpy backend only; float16 halves the index, searches slower
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")  # numpy backend only: none, int8 or binary
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))  # quantized search re-scores top_k * factor
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+PDF_WORKERS = default_worker_count()
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
 
-def setup_rag_database():
-    """Performs the document loading, splitting, embedding, and storage."""
+# A full rebuild is written here first and only swapped in once it is complete, so a killed
+# build never leaves the service with an empty store. Its manifest doubles as the checkpoint.
+STAGING_PATH = f"{VECTOR_STORE_PATH.rstrip(os.sep)}.building"
+
+
+class BuildProgress:
+    """Prints chunk-level progress and throughput for the current build."""
+
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.files_done = 0
+        self.chunks_done = 0
+        self.started = time.time()
+
+    def file_started(self, pdf_name: str, chunk_count: int):
+        print(f"[{self.files_done + 1}/{self.total_files}] {pdf_name}: {chunk_count} chunks")
+
+    def batch_done(self, done: int, total: int, batch_chunks: int):
+        self.chunks_done += batch_chunks
+        elapsed = max(time.time() - self.started, 1e-6)
+        rate = self.chunks_done / elapsed
+        print(f"    {done}/{total} chunks | {self.chunks_done} total | {rate:.1f} chunks/s")
+
+    def file_finished(self):
+        self.files_done += 1
+
+    def summary(self) -> str:
+        elapsed = time.time() - self.started
+        return f"{self.files_done} files, {self.chunks_done} chunks embedded in {elapsed:.1f}s"
+
+
+def _swap_in_staging():
+    """Atomically replaces the live store with the finished staging build."""
+    old_path = f"{VECTOR_STORE_PATH.rstrip(os.sep)}.old"
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+    if os.path.exists(VECTOR_STORE_PATH):
+        os.rename(VECTOR_STORE_PATH, old_path)
+    os.rename(STAGING_PATH, VECTOR_STORE_PATH)
+    if os.path.exists(old_path):
+        shutil.rmtree(old_path)
+
+
+def _report_quantization(vector_store: VectorStore, k: int = 10):
+    """Prints index size and recall@k of quantized search against exact search."""
+    measure_recall = getattr(vector_store.backend, "measure_recall", None)
+    recall = measure_recall(k=k) if measure_recall else None
+    if recall is None:
+        return
+    stats = vector_store.backend.stats()
+    print(f"--- Quantization ({stats['quantization']}, rerank x{stats['rerank_factor']}): "
+          f"recall@{k} vs exact = {recall:.3f}, codes {stats['code_bytes'] / 1e6:.1f} MB "
+          f"vs vectors {stats['vector_bytes'] / 1e6:.1f} MB")
+
+
+def setup_rag_database(incremental: bool = False):
+    """
+    Performs the document loading, splitting, embedding, and storage.
+    Chunks are embedded and inserted in EMBED_BATCH_SIZE batches; progress is checkpointed per
+    batch, so re-running after a crash resumes where the previous run stopped.
+    With incremental=True the live store is updated in place and only changed files are indexed.
+    """
     print("\n--- RAG Database Setup Initiated ---")
-    
-    # 1. Data Processing
-    data_processor = DataProcessor(pdf_directory=PDF_DIRECTORY)
-    all_pdf_documents = data_processor.process_all_pdfs()
-    
-    if not all_pdf_documents:
+    target_path = VECTOR_STORE_PATH if incremental else STAGING_PATH
+    if not incremental and os.path.exists(STAGING_PATH):
+        print(f"--- Found unfinished build in {STAGING_PATH}, resuming")
+
+    # 1. Data Processing: decide which files still need work from the manifest/checkpoint
+    # Pages of unchanged PDFs come from the page cache (PAGE_CACHE_DIR), so re-chunking skips parsing
+    data_processor = DataProcessor(pdf_directory=PDF_DIRECTORY, max_workers=PDF_WORKERS,
+                                   page_cache=create_page_cache())
+    pdf_files = data_processor.list_pdf_files()
+    if not pdf_files:
         print("No documents loaded. Database setup aborted.")
-        return
+        return True
 
-    # 2. Text Splitting
-    chunks = data_processor.split_documents(all_pdf_documents, chunk_size=1000, chunk_overlap=200)
-    texts = [doc.page_content for doc in chunks]
-    
-    # 3. Embedding Generation
     try:
-        embedding_manager = EmbeddingManager(model_name=EMBEDDING_MODEL_NAME)
-        embeddings = embedding_manager.generate_embeddings(texts)
+        embedding_manager = EmbeddingManager(
+            model_name=EMBEDDING_MODEL_NAME,
+            cache=create_embedding_cache(EMBEDDING_MODEL_NAME)
+        )
+        vector_store = VectorStore(collection_name=CHROMA_COLLECTION_NAME, persist_directory=target_path,
+                                   backend=VECTOR_BACKEND, vector_dtype=VECTOR_DTYPE,
+                                   quantization=VECTOR_QUANTIZATION, rerank_factor=VECTOR_RERANK_FACTOR)
     except Exception as e:
-        print(f"Failed to generate embeddings: {e}")
-        return
+        print(f"Failed to initialize embedding model or VectorStore: {e}")
+        return False
+
+    ingestor = IncrementalIngestor(data_processor, embedding_manager, vector_store,
+                                   subject_tags=load_subject_tags(SUBJECT_TAGS_FILE))
+    file_hashes = {pdf_file: file_sha256(str(pdf_file)) for pdf_file in pdf_files}
+    pending = [f for f in pdf_files
+               if not ingestor.is_indexed(f.name, file_hashes[f], CHUNK_SIZE, CHUNK_OVERLAP)]
 
-    # 4. Vector Store Initialization and Addition
+    # Files that were removed from the PDF directory are dropped from the index too
+    present = {f.name for f in pdf_files}
+    for source_file in list(ingestor.manifest.entries):
+        if source_file not in present:
+            ingestor.remove_file(source_file)
+
+    print(f"--- {len(pdf_files) - len(pending)} file(s) already indexed, {len(pending)} to process "
+          f"with {PDF_WORKERS} worker(s), batch size {EMBED_BATCH_SIZE}")
+
+    # 2. Text Splitting (streamed per file) + 3. Embedding + 4. Storage, batch by batch
+    progress = BuildProgress(total_files=len(pending))
     try:
-        # NOTE: We clear the old database before adding new docs
-        # If you want to append, you can remove the next two lines 
-        import shutil
-        if os.path.exists(VECTOR_STORE_PATH):
-            shutil.rmtree(VECTOR_STORE_PATH) 
-        
-        vector_store = VectorStore(
-            collection_name=CHROMA_COLLECTION_NAME, 
-            persist_directory=VECTOR_STORE_PATH
-        )
-        vector_store.add_documents(chunks, embeddings)
-        
+        for pdf_file, chunks in data_processor.iter_chunks(CHUNK_SIZE, CHUNK_OVERLAP, pdf_files=pending):
+            progress.file_started(pdf_file.name, len(chunks))
+            last_done = [0]
+
+            def on_batch(done: int, total: int):
+                progress.batch_done(done, total, done - last_done[0])
+                last_done[0] = done
+
+            ingestor.index_chunks(pdf_file.name, file_hashes[pdf_file], chunks, CHUNK_SIZE, CHUNK_OVERLAP,
+                                  batch_size=EMBED_BATCH_SIZE, progress=on_batch)
+            progress.file_finished()
     except Exception as e:
-        print(f"Failed to initialize or add documents to VectorStore: {e}")
-        return
+        print(f"Build interrupted: {e}")
+        print("Re-run initialize_db.py to resume from the last completed batch.")
+        return False
+
+    if ingestor.manifest.entries and vector_store.get_count() == 0:
+        print("Build produced an empty store. Aborting without replacing the live store.")
+        return False
+
+    if embedding_manager.cache is not None:
+        embedding_manager.cache.flush()
+        print(f"--- Embedding cache: {embedding_manager.cache.stats()}")
+    if data_processor.page_cache is not None:
+        removed = data_processor.page_cache.prune(set(file_hashes.values()))
+        print(f"--- Page cache: {data_processor.page_cache.stats()} ({removed} stale entries removed)")
+    print(f"--- Build finished: {progress.summary()}. Total docs: {vector_store.get_count()}")
+    _report_quantization(vector_store)
+
+    if not incremental:
+        # Release the store before moving its directory
+        del ingestor, vector_store
+        _swap_in_staging()
+        print(f"--- Swapped new store into {VECTOR_STORE_PATH}")
 
     print("--- RAG Database Setup Complete ---")
+    return True
+
 
 if __name__ == "__main__":
-    setup_rag_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the Study Buddy vector store from PDF_DIRECTORY.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Update the live store in place, indexing only new or changed PDFs.")
+    args = parser.parse_args()
+    sys.exit(0 if setup_rag_database(incremental=args.incremental) else 1)
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+import numpy as np
+from app.core.answer_cache import AnswerCache
+from app.core.rag import RAGRetriever, RAGService, VectorStore
+
+SCOPE = (5, "dense", None)
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _near(base, cosine):
+    """A unit vector at the given cosine similarity to base (base must lie in the first two dims)."""
+    orthogonal = np.zeros_like(base)
+    orthogonal[2] = 1.0
+    return cosine * base + np.sqrt(1.0 - cosine ** 2) * orthogonal
+
+
+def test_semantic_tier_is_off_by_default():
+    cache = AnswerCache()
+    stack = _unit(1, 0, 0, 0)
+    cache.put("what is a stack", SCOPE, "v1", stack, {"answer": "LIFO"})
+
+    assert cache.get_semantic(_near(stack, 0.97), SCOPE, "v1") is None
+    assert cache.get_exact("What is a stack?", SCOPE, "v1") == {"answer": "LIFO"}
+
+
+def test_near_miss_query_does_not_reuse_an_answer():
+    cache = AnswerCache(semantic_threshold=0.99)
+    stack = _unit(1, 0, 0, 0)
+    cache.put("what is a stack", SCOPE, "v1", stack, {"answer": "LIFO"})
+
+    # e.g. "what is a queue": related, but a different question
+    assert cache.get_semantic(_near(stack, 0.96), SCOPE, "v1") is None
+    assert cache.get_semantic(_near(stack, 0.995), SCOPE, "v1") == {"answer": "LIFO"}
+    assert cache.get_semantic(_near(stack, 0.995), (3, "dense", None), "v1") is None
+    assert cache.get_semantic(_near(stack, 0.995), SCOPE, "v2") is None  # index changed
+
+
+def test_evicted_rows_are_reused_and_never_matched():
+    cache = AnswerCache(max_entries=2, semantic_threshold=0.99)
+    vectors = [_unit(1, 0, 0, 0), _unit(0, 1, 0, 0), _unit(1, 1, 0, 0)]
+    for i, vector in enumerate(vectors):
+        cache.put(f"q{i}", SCOPE, "v1", vector, {"answer": str(i)})
+
+    assert cache.evictions == 1
+    assert cache.get_semantic(vectors[0], SCOPE, "v1") is None
+    assert cache.get_semantic(vectors[2], SCOPE, "v1") == {"answer": "2"}
+    assert cache._matrix.shape == (2, 4)
+
+
+class _Embedder:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, query):
+        self.calls += 1
+        return np.ones(8, dtype=np.float32)
+
+
+def test_lexical_queries_are_not_embedded_for_the_cache(tmp_path):
+    store = VectorStore("test", str(tmp_path), backend="numpy")
+    embedder = _Embedder()
+    service = RAGService(store, RAGRetriever(store, embedder), llm=None,
+                         answer_cache=AnswerCache(semantic_threshold=0.99))
+
+    prepared = service._retrieve_or_cached("heap sort", top_k=3, mode="lexical")
+    assert embedder.calls == 0
+    assert prepared["cache_key"][2] is None
+
+
+def test_store_version_sees_another_process_reupload(tmp_path):
+    writer = VectorStore("test", str(tmp_path), backend="numpy")
+    reader = VectorStore("test", str(tmp_path), backend="numpy")
+    old = SimpleNamespace(page_content="old text", metadata={"source": "a.pdf"})
+    writer.upsert_documents([old], np.eye(8, dtype=np.float32)[:1], ["old"])
+    writer.flush()
+    before = reader.get_version()
+
+    # Same document count, different contents
+    new = SimpleNamespace(page_content="new text", metadata={"source": "a.pdf"})
+    writer.upsert_documents([new], np.eye(8, dtype=np.float32)[1:2], ["new"])
+    writer.delete_documents(["old"])
+    writer.flush()
+    assert reader.get_count() == 1
+    assert reader.get_version() != before
@@ -0,0 +1,64 @@
+import itertools
+import numpy as np
+from app.core.embedding_cache import WAYS, EmbeddingCache
+
+
+def _text_with_nul_digest_tail() -> str:
+    for i in itertools.count():
+        text = f"chunk {i}"
+        if EmbeddingCache.key_for(text).endswith("00"):
+            return text
+
+
+def test_key_ending_in_nul_byte_hits(tmp_path):
+    text = _text_with_nul_digest_tail()
+    cache = EmbeddingCache(str(tmp_path), "model", max_entries=8, dtype="float32")
+    vector = np.arange(4, dtype=np.float32)
+    cache.put_many([text], vector[None, :])
+
+    for _ in range(2):
+        cached = cache.get_many([text])[0]
+        assert cached is not None
+        np.testing.assert_array_equal(cached, vector)
+    assert cache.hits == 2 and cache.misses == 0
+
+
+def test_key_survives_reload(tmp_path):
+    text = _text_with_nul_digest_tail()
+    cache = EmbeddingCache(str(tmp_path), "model", max_entries=8, dtype="float32")
+    cache.put_many([text], np.ones((1, 4), dtype=np.float32))
+    cache.flush()
+
+    reopened = EmbeddingCache(str(tmp_path), "model", max_entries=8, dtype="float32")
+    assert reopened.get_many([text])[0] is not None
+
+
+def test_processes_share_one_directory(tmp_path):
+    # Two instances stand in for two workers: each maps the files and takes the lock itself
+    first = EmbeddingCache(str(tmp_path), "model", max_entries=64, dtype="float32")
+    second = EmbeddingCache(str(tmp_path), "model", max_entries=64, dtype="float32")
+    first.put_many(["a"], np.full((1, 4), 1.0, dtype=np.float32))
+    second.put_many(["b"], np.full((1, 4), 2.0, dtype=np.float32))
+
+    np.testing.assert_array_equal(second.get_many(["a"])[0], np.full(4, 1.0))
+    np.testing.assert_array_equal(first.get_many(["b"])[0], np.full(4, 2.0))
+    assert first.stats()["entries"] == 2
+
+
+def test_full_set_replaces_its_oldest_row(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", max_entries=WAYS, dtype="float32")  # one set
+    texts = [f"chunk {i}" for i in range(WAYS + 1)]
+    for i, text in enumerate(texts):
+        cache.put_many([text], np.full((1, 4), float(i), dtype=np.float32))
+
+    cached = cache.get_many(texts)
+    assert cached[0] is None
+    assert all(vector is not None for vector in cached[1:])
+    np.testing.assert_array_equal(cached[-1], np.full(4, float(WAYS)))
+
+
+def test_returned_vectors_are_copies(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", max_entries=8, dtype="float32")
+    cache.put_many(["a"], np.ones((1, 4), dtype=np.float32))
+    cache.get_many(["a"])[0][:] = 0
+    np.testing.assert_array_equal(cache.get_many(["a"])[0], np.ones(4))
@@ -0,0 +1,62 @@
+import json
+import os
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from app.core.ingest import IncrementalIngestor, IngestionManifest, MANIFEST_FILENAME
+from app.core.rag import VectorStore
+
+
+class CountingEmbedder:
+    """Deterministic embeddings; raises on call number fail_on (1-based) to simulate a crash."""
+
+    def __init__(self, fail_on=None):
+        self.calls = 0
+        self.fail_on = fail_on
+
+    def generate_embeddings(self, texts):
+        self.calls += 1
+        if self.calls == self.fail_on:
+            raise RuntimeError("worker died")
+        return np.asarray([[len(text), 1.0, 0.0, 0.0] for text in texts], dtype=np.float32)
+
+
+def _chunks(count):
+    return [SimpleNamespace(page_content=f"chunk number {i} " * (i + 1), metadata={"source": "book.pdf"})
+            for i in range(count)]
+
+
+def _ingestor(path, embedder):
+    store = VectorStore("test", str(path), backend="numpy")
+    return IncrementalIngestor(None, embedder, store, checkpoint_batches=1, checkpoint_seconds=3600)
+
+
+def test_interrupted_file_resumes_after_last_checkpoint(tmp_path):
+    crashed = _ingestor(tmp_path, CountingEmbedder(fail_on=3))
+    with pytest.raises(RuntimeError):
+        crashed.index_chunks("book.pdf", "f" * 64, _chunks(6), 1000, 200, batch_size=2, subject="cs")
+
+    with open(os.path.join(tmp_path, MANIFEST_FILENAME), encoding="utf-8") as f:
+        checkpoint = json.load(f)["book.pdf"]
+    assert checkpoint["complete"] is False and checkpoint["batches_done"] == 2
+
+    embedder = CountingEmbedder()
+    resumed = _ingestor(tmp_path, embedder)
+    result = resumed.index_chunks("book.pdf", "f" * 64, _chunks(6), 1000, 200, batch_size=2, subject="cs")
+
+    assert embedder.calls == 1  # only the batch after the checkpoint
+    assert result["chunk_count"] == 6
+    assert resumed.vector_store.get_count() == 6
+    entry = IngestionManifest(os.path.join(tmp_path, MANIFEST_FILENAME)).get("book.pdf")
+    assert entry["complete"] is True and len(entry["chunk_ids"]) == 6
+
+
+def test_manifest_saves_merge_entries_from_two_instances(tmp_path):
+    path = os.path.join(tmp_path, MANIFEST_FILENAME)
+    first, second = IngestionManifest(path), IngestionManifest(path)
+    first.set("a.pdf", {"sha256": "a", "complete": True})
+    second.set("b.pdf", {"sha256": "b", "complete": True})
+    first.save()
+    second.save()
+
+    assert sorted(IngestionManifest(path).entries) == ["a.pdf", "b.pdf"]
@@ -0,0 +1,120 @@
+import os
+import time
+import fcntl
+from app.core import filelock
+from app.core.filelock import hold_exclusive
+from app.core.jobs import IngestionJobQueue, SUCCEEDED, QUEUED
+
+
+class FakeIngestor:
+    processor = None
+
+    def __init__(self):
+        self.files = []
+
+    def ingest_file(self, pdf_path, chunk_size, chunk_overlap, **kwargs):
+        self.files.append(pdf_path)
+        return {"status": "indexed", "source_file": os.path.basename(pdf_path), "chunk_count": 1}
+
+
+def _wait_for(queue, job_id, status, timeout_s=5.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        record = queue.get(job_id)
+        if record and record["status"] == status:
+            return record
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not reach {status}: {queue.get(job_id)}")
+
+
+def _die(queue, job_id):
+    """As if the owning process had exited: the kernel drops its lock."""
+    os.close(queue._claims.pop(job_id))
+
+
+def test_live_owner_keeps_its_job(tmp_path):
+    owner = IngestionJobQueue(FakeIngestor(), str(tmp_path), parse_workers=0)
+    job_id = owner.submit(str(tmp_path / "book.pdf"), "book.pdf")["job_id"]
+
+    other = IngestionJobQueue(FakeIngestor(), str(tmp_path), parse_workers=0)
+    assert not other._claim(job_id)
+    other.start()
+    time.sleep(0.1)
+    assert other.ingestor.files == []
+    assert other.get(job_id)["status"] == QUEUED
+    other.shutdown()
+
+
+def test_job_of_a_dead_owner_is_resumed_once(tmp_path):
+    owner = IngestionJobQueue(FakeIngestor(), str(tmp_path), parse_workers=0)
+    job_id = owner.submit(str(tmp_path / "book.pdf"), "book.pdf")["job_id"]
+    _die(owner, job_id)
+
+    # Workers booting together race for the orphaned job; exactly one may take it
+    queues = [IngestionJobQueue(FakeIngestor(), str(tmp_path), parse_workers=0) for _ in range(3)]
+    claims = [queue._claim(job_id) for queue in queues]
+    assert claims.count(True) == 1
+    winner = queues[claims.index(True)]
+    for queue in queues:
+        queue.start()
+
+    _wait_for(winner, job_id, SUCCEEDED)
+    assert winner.ingestor.files == [str(tmp_path / "book.pdf")]
+    assert sum(len(queue.ingestor.files) for queue in queues) == 1
+    for queue in queues:
+        queue.shutdown()
+
+
+def test_finished_job_is_not_run_again(tmp_path):
+    first = IngestionJobQueue(FakeIngestor(), str(tmp_path), parse_workers=0)
+    job_id = first.submit(str(tmp_path / "book.pdf"), "book.pdf")["job_id"]
+    first.start()
+    _wait_for(first, job_id, SUCCEEDED)
+    first.shutdown()
+
+    restarted = IngestionJobQueue(FakeIngestor(), str(tmp_path), parse_workers=0)
+    restarted.start()
+    time.sleep(0.1)
+    assert restarted.ingestor.files == []
+    restarted.shutdown()
+
+
+def test_lock_taken_on_an_unlinked_file_is_retried(tmp_path, monkeypatch):
+    path = str(tmp_path / "job.lock")
+    holder = hold_exclusive(path)
+    successor = []
+    real_flock = fcntl.flock
+
+    def flock(fd, operation):
+        if not successor:
+            # Between our open() and flock(): the holder unlinks and releases, and another
+            # process takes the new file at the same path
+            successor.append(None)
+            os.remove(path)
+            os.close(holder)
+            successor[0] = hold_exclusive(path)
+        return real_flock(fd, operation)
+
+    monkeypatch.setattr(filelock.fcntl, "flock", flock)
+    assert successor == [] and hold_exclusive(path) is None
+    assert successor[0] is not None
+
+
+def test_job_that_died_after_publishing_is_marked_done(tmp_path):
+    owner = IngestionJobQueue(FakeIngestor(), str(tmp_path / "jobs"), parse_workers=0)
+    snapshot = owner.upload_path("book.pdf")
+    destination = str(tmp_path / "book.pdf")
+    job_id = owner.submit(snapshot, "book.pdf", destination=destination)["job_id"]
+    record = owner._read(job_id)
+    record.update(status="running", stage="publishing", result={"status": "indexed", "chunk_count": 3})
+    owner._store(record)
+    with open(destination, "wb") as f:  # the snapshot was moved into place, then the worker died
+        f.write(b"%PDF")
+    _die(owner, job_id)
+
+    resumed = IngestionJobQueue(FakeIngestor(), str(tmp_path / "jobs"), parse_workers=0)
+    resumed.start()
+    record = resumed.get(job_id)
+    assert record["status"] == SUCCEEDED and record["result"]["chunk_count"] == 3
+    assert resumed.ingestor.files == []
+    resumed.shutdown()
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+import numpy as np
+from app.core.lexical import BM25Index
+from app.core.rag import VectorStore
+
+
+def _store(path):
+    return VectorStore("test", str(path), backend="numpy")
+
+
+def _docs(*texts):
+    return [SimpleNamespace(page_content=text, metadata={"source": "test.pdf"}) for text in texts]
+
+
+def test_search_scores_only_allowed_ids():
+    index = BM25Index()
+    index.add(["a", "b", "c"], ["heap sort heap", "heap insert", "bayes theorem"])
+    assert [doc_id for doc_id, _ in index.search("heap")] == ["a", "b"]
+    assert [doc_id for doc_id, _ in index.search("heap", allowed={"b", "c"})] == ["b"]
+    assert index.search("heap", allowed=set()) == []
+
+
+def test_journal_is_replayed_onto_a_newer_pickle(tmp_path):
+    first, second = _store(tmp_path), _store(tmp_path)
+    first.upsert_documents(_docs("gate algorithms heap"), np.eye(8, dtype=np.float32)[:1], ["a"])
+    second.upsert_documents(_docs("probability bayes theorem"), np.eye(8, dtype=np.float32)[1:2], ["b"])
+    first.flush()
+    second.flush()  # the pickle changed since second loaded it: its writes are replayed on top
+
+    reader = _store(tmp_path)
+    assert [doc_id for doc_id, _ in reader.lexical_search("heap")] == ["a"]
+    assert [doc_id for doc_id, _ in reader.lexical_search("bayes")] == ["b"]
+    assert len(reader.lexical_index) == 2
+
+
+def test_reader_picks_up_another_process_save(tmp_path):
+    writer, reader = _store(tmp_path), _store(tmp_path)
+    assert reader.lexical_search("heap") == []
+    writer.upsert_documents(_docs("heap sort"), np.eye(8, dtype=np.float32)[:1], ["a"])
+    writer.flush()
+    assert [doc_id for doc_id, _ in reader.lexical_search("heap")] == ["a"]
@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+from app.core.llm_dispatch import LLMDispatcher
+
+
+class ApiError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def _run(test):
+    async def main():
+        return await test(LLMDispatcher(loop=asyncio.get_running_loop(), retry_base_seconds=0.01))
+    return asyncio.run(main())
+
+
+def test_identical_prompts_share_one_call():
+    async def test(dispatcher):
+        calls, release = [], asyncio.Event()
+
+        async def make_call():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        waiting = [asyncio.ensure_future(dispatcher.call(make_call, key=key)) for key in ("a", "a", "b")]
+        await asyncio.sleep(0)
+        release.set()
+        assert await asyncio.gather(*waiting) == ["answer"] * 3
+        assert len(calls) == 2 and dispatcher.coalesced == 1
+        assert dispatcher._inflight == {}
+    _run(test)
+
+
+def test_rate_limit_is_retried_with_a_pause():
+    async def test(dispatcher):
+        errors = [ApiError(429)]
+
+        async def make_call():
+            if errors:
+                raise errors.pop()
+            return "answer"
+
+        assert await dispatcher.call(make_call) == "answer"
+        assert dispatcher.retries == 1 and dispatcher.rate_limited == 1
+        assert dispatcher._paused_until > 0
+
+        async def bad_request():
+            raise ApiError(400)
+
+        with pytest.raises(ApiError):
+            await dispatcher.call(bad_request)
+        assert dispatcher.retries == 1 and dispatcher.failures == 1
+    _run(test)
+
+
+def test_close_fails_running_queued_and_backing_off_calls():
+    async def test(dispatcher):
+        dispatcher.max_concurrency = 1
+        dispatcher.retry_base_seconds = 60
+        started, never = asyncio.Event(), asyncio.Event()
+
+        async def hang():
+            started.set()
+            await never.wait()
+
+        async def overloaded():
+            raise ApiError(503)
+
+        backing_off = asyncio.ensure_future(dispatcher.call(overloaded))
+        while dispatcher.retries == 0:
+            await asyncio.sleep(0.01)
+        running = asyncio.ensure_future(dispatcher.call(hang, key="running"))
+        await started.wait()
+        queued = asyncio.ensure_future(dispatcher.call(hang))  # waits for the only slot
+        await asyncio.sleep(0.01)
+        assert dispatcher.stats()["queue_depth"] == 1
+
+        dispatcher.close()
+        results = await asyncio.wait_for(asyncio.gather(running, queued, backing_off, return_exceptions=True), 5)
+        assert isinstance(results[0], asyncio.CancelledError)
+        assert all(isinstance(result, RuntimeError) for result in results[1:])
+        with pytest.raises(RuntimeError):
+            await dispatcher.call(hang)
+    _run(test)
@@ -0,0 +1,38 @@
+import threading
+import numpy as np
+from app.core.query_batcher import QueryEmbeddingBatcher
+
+
+def _encode(texts):
+    return np.array([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_concurrent_callers_share_batches_and_get_their_own_vectors():
+    calls = []
+
+    def encode(texts):
+        calls.append(len(texts))
+        return _encode(texts)
+
+    batcher = QueryEmbeddingBatcher(encode, max_batch_size=64, max_wait_ms=50)
+    queries = [f"query {i % 5}" + "x" * (i % 5) for i in range(40)]
+    results = [None] * len(queries)
+    start = threading.Barrier(len(queries))
+
+    def call(i):
+        start.wait()
+        results[i] = batcher.embed(queries[i])
+        results[i][:] = -1  # a caller scribbling on its vector
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(queries))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(calls) < len(queries)  # duplicates and concurrent queries were coalesced
+    for query in set(queries):
+        np.testing.assert_array_equal(batcher.embed(query), _encode([query])[0])
+    stats = batcher.stats()
+    # every call was either batched or served from the cache
+    assert stats["queries"] + stats["cache_hits"] == len(queries) + len(set(queries))
@@ -0,0 +1,41 @@
+import threading
+from app.core.quiz_bank import QuizBank
+from app.core.quiz_gen import MCQ_OPTION_KEYS
+
+
+def _question(text):
+    return {"question": text, "options": {key: f"option {key}" for key in MCQ_OPTION_KEYS},
+            "correct_answer": MCQ_OPTION_KEYS[0], "explanation": "because"}
+
+
+def test_busy_topic_does_not_block_other_topics(tmp_path):
+    bank = QuizBank(quiz_generator=None, bank_directory=str(tmp_path))
+    holding, release = threading.Event(), threading.Event()
+
+    def hold_topic():
+        with bank._locked(bank._topic_key("slow")):
+            holding.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_topic)
+    holder.start()
+    holding.wait(5)
+    added = []
+    adder = threading.Thread(target=lambda: added.append(bank.add("fast", [_question("What is 2 + 2?")])))
+    adder.start()
+    adder.join(2)
+    finished = not adder.is_alive()
+    release.set()
+    holder.join()
+    adder.join()
+
+    assert finished and added == [1]
+    assert bank.take("fast", 1) is not None
+
+def test_served_once_question_is_retired_after_max_serves(tmp_path):
+    bank = QuizBank(quiz_generator=None, bank_directory=str(tmp_path), max_serves=2)
+    bank.add("topic", [_question("Q1")], served=1, subject="physics")
+
+    assert bank.take("topic", 1) is None  # other subject's bank
+    assert bank.take("topic", 1, subject="physics") is not None
+    assert bank.take("topic", 1, subject="physics") is None
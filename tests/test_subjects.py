@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from app.core.subjects import SubjectRouter, build_filter, derive_subject, matches_filter
+from app.core.vector_backends import NumpyBackend
+
+
+class FakeStore:
+    def __init__(self, documents, subjects):
+        self.documents, self.subjects = documents, subjects
+
+    def get_version(self):
+        return "1"
+
+    def get_count(self):
+        return len(self.documents)
+
+    def get_page(self, limit, offset):
+        return {"documents": self.documents[offset:offset + limit],
+                "metadatas": [{"subject": s} for s in self.subjects[offset:offset + limit]]}
+
+
+class AxisEmbedder:
+    """Documents named "<axis>:..." embed to that unit axis."""
+
+    def generate_embeddings(self, texts):
+        vectors = np.zeros((len(texts), 4), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vectors[row, int(text.split(":")[0])] = 1.0
+        return vectors
+
+
+def _router(**kwargs):
+    store = FakeStore(["0:a", "0:b", "1:c", "2:d"], ["cs", "cs", "da", "ma"])
+    router = SubjectRouter(store, AxisEmbedder(), refresh_seconds=3600, page_size=2, **kwargs)
+    router.build()
+    return router
+
+
+def test_query_is_routed_to_the_closest_subjects():
+    router = _router(margin=0.05)
+    assert router.subjects == ["cs", "da", "ma"] and router.chunk_counts["cs"] == 2
+    assert router.route(np.array([1.0, 0.1, 0, 0])) == ["cs"]
+    assert router.route(np.array([1.0, 1.0, 0, 0])) == ["cs", "da"]  # tie within the margin
+    assert router.stats()["routed"] == 2
+
+
+def test_off_topic_query_is_not_routed():
+    router = _router(min_score=0.5)
+    assert router.route(np.array([0, 0, 0, 1.0])) is None
+    assert router.stats()["unrouted"] == 1
+
+    empty = SubjectRouter(FakeStore([], []), AxisEmbedder(), refresh_seconds=3600)
+    empty.build()
+    assert empty.route(np.array([1.0, 0, 0, 0])) is None  # no centroids: search everything
+
+
+def test_build_filter_and_derive_subject():
+    assert build_filter() is None
+    assert build_filter(subjects=["CS "]) == {"subject": "cs"}
+    assert build_filter(subjects=["da", "cs"], sources=["x.pdf"]) == \
+        {"$and": [{"subject": {"$in": ["cs", "da"]}}, {"source_file": "x.pdf"}]}
+    assert derive_subject("ec (1).pdf") == "ec"
+    assert derive_subject("Linear Algebra.pdf") == "linear_algebra"
+
+
+def test_matches_filter_agrees_with_numpy_backend(tmp_path):
+    metadatas = [{"subject": "cs", "source_file": "a.pdf"}, {"subject": "da", "source_file": "b.pdf"},
+                 {"subject": "cs", "source_file": "b.pdf"}, {"source_file": "c.pdf"}, {"subject": "ma"}]
+    ids = [f"d{i}" for i in range(len(metadatas))]
+    backend = NumpyBackend(str(tmp_path))
+    backend.upsert(ids, np.eye(len(ids), dtype=np.float32), metadatas, ["x"] * len(ids))
+
+    filters = [
+        build_filter(subjects=["cs"]),
+        build_filter(subjects=["cs", "ma"], sources=["b.pdf"]),
+        {"subject": {"$eq": "da"}},
+        {"subject": {"$ne": "cs"}},
+        {"subject": {"$nin": ["cs", "da"]}},
+        {"$or": [{"subject": "ma"}, {"source_file": {"$in": ["a.pdf", "c.pdf"]}}]},
+        {"$and": [{"source_file": "b.pdf"}, {"subject": {"$ne": "da"}}]},
+    ]
+    for where in filters:
+        expected = [doc_id for doc_id, metadata in zip(ids, metadatas) if matches_filter(metadata, where)]
+        assert backend.ids_matching(where) == expected, where
+
+    with pytest.raises(ValueError):
+        matches_filter({"subject": "cs"}, {"subject": {"$gt": "a"}})
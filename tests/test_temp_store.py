@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("pypdf")
+from app.core.temp_rag import TempSessionStore
+
+
+def _chunk(store, session_id, upload_id, dim=8):
+    store.add_chunks(session_id, ["x" * 100], [{"page": 0}], np.ones((1, dim), dtype=np.float32),
+                     upload_id=upload_id)
+
+
+def test_session_still_indexing_is_not_evicted():
+    store = TempSessionStore(memory_budget_bytes=1500)
+    first = store.begin_session("a", "a.pdf")
+    _chunk(store, "a", first)
+    second = store.begin_session("b", "b.pdf")
+    _chunk(store, "b", second)
+
+    with pytest.raises(ValueError):
+        _chunk(store, "b", second)
+    # "a" is still indexing, so its next batch must still find its session
+    assert store.get_session("a") is not None
+    assert store.evictions == 0
+
+    store.update_progress("b", state="ready", upload_id=second)
+    _chunk(store, "a", first)
+    assert store.get_session("b") is None
+    assert store.get_session("a")["chunk_count"] == 2
+
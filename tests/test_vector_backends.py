@@ -0,0 +1,91 @@
+import os
+import numpy as np
+from app.core.vector_backends import NumpyBackend, _IndexView
+
+
+def _vectors(*rows):
+    return np.asarray(rows, dtype=np.float32)
+
+
+def test_flush_merges_writes_from_two_instances(tmp_path):
+    first = NumpyBackend(str(tmp_path))
+    second = NumpyBackend(str(tmp_path))
+    first.upsert(["a"], _vectors([1, 0, 0, 0]), [{"subject": "cs"}], ["alpha"])
+    second.upsert(["b"], _vectors([0, 1, 0, 0]), [{"subject": "da"}], ["beta"])
+    first.flush()
+    second.flush()  # rebases its journal onto the generation first wrote
+
+    reader = NumpyBackend(str(tmp_path))
+    found = reader.get(ids=["a", "b"])
+    assert found["ids"] == ["a", "b"]
+    assert found["documents"] == ["alpha", "beta"]
+    assert reader.ids_matching({"subject": "da"}) == ["b"]
+    assert first.count() == 2  # picks up the newer generation on its next call
+
+
+def test_delete_from_another_instance_is_merged(tmp_path):
+    first = NumpyBackend(str(tmp_path))
+    first.upsert(["a", "b"], _vectors([1, 0, 0, 0], [0, 1, 0, 0]), [{}, {}], ["alpha", "beta"])
+    first.flush()
+
+    second = NumpyBackend(str(tmp_path))
+    first.upsert(["c"], _vectors([0, 0, 1, 0]), [{}], ["gamma"])
+    second.delete(["a"])
+    second.flush()
+    first.flush()
+
+    assert sorted(NumpyBackend(str(tmp_path)).get()["ids"]) == ["b", "c"]
+
+
+def test_previous_generation_stays_on_disk(tmp_path):
+    backend = NumpyBackend(str(tmp_path))
+    for i in range(3):
+        backend.upsert([f"doc{i}"], _vectors([1, i, 0, 0]), [{}], [f"text {i}"])
+        backend.flush()
+
+    assert sorted(name for name in os.listdir(tmp_path) if name.startswith("rows.")) == ["rows.2.json",
+                                                                                        "rows.3.json"]
+
+
+def test_failed_reload_keeps_serving_the_loaded_generation(tmp_path):
+    writer = NumpyBackend(str(tmp_path))
+    writer.upsert(["a"], _vectors([1, 0, 0, 0]), [{}], ["alpha"])
+    writer.flush()
+    reader = NumpyBackend(str(tmp_path))
+
+    writer.upsert(["b"], _vectors([0, 1, 0, 0]), [{}], ["beta"])
+    writer.flush()
+    os.rename(tmp_path / "rows.2.json", tmp_path / "rows.2.json.bak")
+    assert reader.get()["ids"] == ["a"]  # generation 2 cannot be opened yet
+
+    os.rename(tmp_path / "rows.2.json.bak", tmp_path / "rows.2.json")
+    assert reader.get()["ids"] == ["a", "b"]  # and is retried on the next call
+
+
+def test_filters_match_a_column_scan(tmp_path):
+    backend = NumpyBackend(str(tmp_path))
+    subjects = ["cs", "da", "cs", None, "ma"]
+    metadatas = [{"subject": subject} if subject else {} for subject in subjects]
+    backend.upsert([f"d{i}" for i in range(5)], np.eye(5, dtype=np.float32), metadatas, ["x"] * 5)
+
+    assert backend.ids_matching({"subject": "cs"}) == ["d0", "d2"]
+    assert backend.ids_matching({"subject": {"$in": ["da", "ma"]}}) == ["d1", "d4"]
+    assert backend.ids_matching({"subject": {"$ne": "cs"}}) == ["d1", "d3", "d4"]
+    assert backend.ids_matching({"subject": {"$nin": ["cs", "da"]}}) == ["d3", "d4"]
+
+
+def test_search_view_is_not_changed_by_later_writes(tmp_path):
+    backend = NumpyBackend(str(tmp_path), quantization="int8")
+    backend.upsert(["a", "b"], _vectors([1, 0, 0, 0], [0, 1, 0, 0]), [{}, {}], ["alpha", "beta"])
+    with backend._lock:
+        backend._compact()
+        backend._ensure_codes()
+        view = _IndexView(backend)
+
+    # Overwrite a row and delete another while the view is held, as a concurrent search would
+    backend.upsert(["a"], _vectors([0, 0, 1, 0]), [{}], ["gamma"])
+    backend.delete(["b"])
+    rows, _ = view.search(np.asarray([[1, 0, 0, 0]], dtype=np.float32), 1)[0]
+    assert [view.ids[row] for row in rows] == ["a"]
+    assert view.vectors[0].tolist() == [1, 0, 0, 0]
+    assert backend.query(np.asarray([[0, 0, 1, 0]], dtype=np.float32), 1)["documents"] == [["gamma"]]